@@ -1,22 +1,301 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, make_response, g
 import redis
+import struct
+import sys
 import time
+from array import array
 from datetime import datetime, timedelta
 import plotly.graph_objs as go
 from plotly.utils import PlotlyJSONEncoder
 import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from downsampling import AGGREGATIONS, DEFAULT_MAX_POINTS, choose_bucket_ms, lttb
+from live_tail import BucketFolder, LiveTailHub
+from metrics import CONTENT_TYPE, HTTP_REQUEST_DURATION, REGISTRY, collect_pool_usage, track_redis
+from query_cache import QueryResultCache, align_range, combine_bucket_stats, range_etag, trim_before
+from replica_routing import DEFAULT_MAX_LAG_BYTES, endpoints_from_config, translate_address
+from rollups import fetch_planned_ranges, plan_query
+from series_index import SeriesIndex
+from sentinel_failover import is_failover_error, sentinel_from_config
+from series_info_cache import SeriesInfoCache
+from shard_router import router_from_config
 
 app = Flask(__name__)
 
 # Configuration Redis
 redis_host = "localhost"
 redis_port = 6379
-r = redis.Redis(host=redis_host, port=redis_port, decode_responses=True)
+redis_password = os.environ.get("REDIS_PASSWORD")
+r = redis.Redis(host=redis_host, port=redis_port, password=redis_password, decode_responses=True)
 
 # Liste des emplacements et types de capteurs (doit correspondre à votre configuration)
 LOCATIONS = ["salon", "chambre1", "chambre2", "cuisine", "salle_de_bain"]
 SENSOR_TYPES = ["temperature", "humidity", "air_quality"]
 
+SHARDING_CONFIG_PATH = "sharding_metadata/true_sharding_config.json"
+
+
+def load_sharding_config():
+    """Charge la configuration de true sharding (None si elle n'existe pas)"""
+    try:
+        with open(SHARDING_CONFIG_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def config_mtime():
+    """Date de modification de la configuration de true sharding (None si elle n'existe pas)"""
+    try:
+        return os.path.getmtime(SHARDING_CONFIG_PATH)
+    except OSError:
+        return None
+
+
+def shard_endpoints_from_config(location, cfg):
+    """Connexions d'un shard : master (découvert via Sentinel) et réplicas pour les lectures"""
+    strategy = os.environ.get("REDIS_READ_STRATEGY", "least_latency")
+    max_lag_bytes = int(os.environ.get("REDIS_MAX_REPLICA_LAG_BYTES", DEFAULT_MAX_LAG_BYTES))
+    return endpoints_from_config(location, cfg, redis_password, strategy, max_lag_bytes)
+
+
+def static_connections(config):
+    """
+    Connexions d'écriture avant résolution des shards : adresse statique de chaque master
+    (aucune connexion n'est ouverte avant la première commande). Sans configuration,
+    tous les emplacements utilisent la connexion par défaut.
+    """
+    if config is None:
+        return {location: r for location in LOCATIONS}
+    return {location: redis.Redis(host=cfg["host"], port=cfg["port"], password=redis_password,
+                                  decode_responses=True, socket_timeout=5)
+            for location, cfg in config.get("shards", {}).items()}
+
+
+sharding_config = load_sharding_config()
+routing_mtime = config_mtime()
+routing_lock = threading.Lock()
+# Shards résolus au premier usage (découverte Sentinel, ping) et non à l'import : l'import
+# du module (tests, benchmark) ne fait aucune entrée-sortie bloquante
+pending_shards = dict((sharding_config or {}).get("shards", {}))
+shard_endpoints = {}
+shard_connections = static_connections(sharding_config)
+# Routeur clé -> shard décrit dans la configuration (par défaut : un shard par emplacement)
+shard_router = router_from_config((sharding_config or {}).get("router"), list(shard_connections))
+
+
+def endpoints_for(shard):
+    """Connexions du shard (master découvert et réplicas), résolues à la première demande"""
+    endpoints = shard_endpoints.get(shard)
+    if endpoints is not None or shard not in pending_shards:
+        return endpoints
+    with routing_lock:
+        cfg = pending_shards.pop(shard, None)
+        if cfg is None:
+            return shard_endpoints.get(shard)
+        endpoints = shard_endpoints[shard] = shard_endpoints_from_config(shard, cfg)
+        shard_connections[shard] = endpoints.master
+    return endpoints
+
+
+def resolve_all_shards():
+    """Résout les shards encore en attente (avant un parcours de tous les shards)"""
+    for shard in list(pending_shards):
+        endpoints_for(shard)
+    return shard_connections
+
+
+def reload_routing():
+    """
+    Relit le routeur (épinglages compris) et les shards si la configuration a changé
+    (migration ou rééquilibrage lancés par l'outil d'administration pendant que l'application
+    tourne), comme RedisTrueShardingSystem.reload_routing. Seuls les shards dont la configuration
+    a changé sont reconnectés, au premier usage ; les dictionnaires sont mis à jour sur place,
+    car partagés avec les métriques des pools et l'index des séries.
+    """
+    global sharding_config, routing_mtime, shard_router
+    mtime = config_mtime()
+    if mtime is None or mtime == routing_mtime:
+        return False
+    with routing_lock:
+        if mtime == routing_mtime:
+            return False
+        config = load_sharding_config()
+        if config is None:
+            return False
+        shards = config.get("shards", {})
+        previous = (sharding_config or {}).get("shards", {})
+        connections = static_connections(config)
+        for location, cfg in shards.items():
+            if location not in shard_connections or previous.get(location) != cfg:
+                shard_endpoints.pop(location, None)
+                pending_shards[location] = cfg
+                shard_connections[location] = connections[location]
+        for location in set(shard_connections) - set(connections):
+            shard_endpoints.pop(location, None)
+            pending_shards.pop(location, None)
+            del shard_connections[location]
+        shard_router = router_from_config(config.get("router"), list(shard_connections))
+        sharding_config = config
+        routing_mtime = mtime
+    router = shard_router.describe()
+    print(f"🔀 Routage rechargé : {len(shard_connections)} shard(s), routeur {router['type']}, "
+          f"{len(router.get('pins', {}))} série(s) épinglée(s)")
+    return True
+
+
+def connection_for_key(key):
+    """Connexion du shard qui héberge une série (connexion par défaut si le shard est inconnu)"""
+    shard = shard_router.route(key)
+    endpoints_for(shard)
+    return shard_connections.get(shard, r)
+
+
+def rediscover_master(shard, endpoints):
+    """
+    Redemande aux Sentinels l'adresse du master d'un shard après une erreur de bascule ;
+    si elle a changé (+switch-master), le nouveau master remplace l'ancien dans les connexions
+    du shard et dans shard_connections. Renvoie True si le master a changé.
+    """
+    cfg = (sharding_config or {}).get("shards", {}).get(shard, {})
+    if not cfg.get("sentinel"):
+        return False
+    try:
+        host, port = translate_address(sentinel_from_config(cfg).discover_master(cfg["sentinel"]["master_name"]),
+                                       cfg.get("address_map"))
+    except Exception as e:
+        print(f"⚠️ Master de {shard} introuvable via Sentinel: {e}")
+        return False
+    current = endpoints.master.connection_pool.connection_kwargs
+    if (current.get("host"), current.get("port")) == (host, port):
+        return False
+    master = redis.Redis(host=host, port=port, password=redis_password, decode_responses=True, socket_timeout=5)
+    with routing_lock:
+        endpoints.master = master
+        if shard_endpoints.get(shard) is endpoints:
+            shard_connections[shard] = master
+    print(f"🔁 Nouveau master pour {shard}: {host}:{port}")
+    return True
+
+
+def read_from_shard(shard, func):
+    """
+    Exécute une lecture func(connexion) sur un réplica à jour du shard, avec repli
+    sur le master (ou sur la connexion du shard s'il n'a pas de réplica configuré).
+    Si le master ne répond plus, il est redécouvert via Sentinel et la lecture rejouée une fois.
+    """
+    endpoints = endpoints_for(shard)
+    if endpoints is None:
+        return func(shard_connections.get(shard, r))
+    try:
+        return endpoints.execute_read(func)
+    except Exception as e:
+        if not is_failover_error(e) or not rediscover_master(shard, endpoints):
+            raise
+    return endpoints.execute_read(func)
+
+
+# Utilisation des pools de connexions, exportée par /metrics
+REGISTRY.add_collector(collect_pool_usage(shard_connections))
+
+# Cache des métadonnées de séries (TS.INFO) pour les panneaux de comptage et de recherche.
+# Les écritures viennent d'autres processus (générateur, archiveur) : l'invalidation par
+# record_write ne s'applique pas ici, les entrées ne sont rafraîchies qu'à expiration du TTL
+# (nombre d'échantillons et dernier timestamp en retard d'au plus INFO_CACHE_TTL secondes)
+info_cache = SeriesInfoCache(ttl_seconds=int(os.environ.get("INFO_CACHE_TTL", 30)),
+                             max_entries=int(os.environ.get("INFO_CACHE_MAX_ENTRIES", 10_000)),
+                             negative_ttl_seconds=int(os.environ.get("INFO_CACHE_NEGATIVE_TTL", 2)))
+
+# Cache des résultats de /get_sensor_data : les buckets fermés sont réutilisés, seul le bucket
+# en cours est relu ; QUERY_CACHE_REDIS_URL partage le cache entre plusieurs processus
+query_cache = QueryResultCache(
+    max_points=int(os.environ.get("QUERY_CACHE_MAX_POINTS", 2_000_000)),
+    segment_ttl_seconds=int(os.environ.get("QUERY_CACHE_SEGMENT_TTL", 300)),
+    response_ttl_seconds=float(os.environ.get("QUERY_CACHE_RESPONSE_TTL", 5)),
+    shared=(redis.Redis.from_url(os.environ["QUERY_CACHE_REDIS_URL"], password=redis_password, decode_responses=True)
+            if os.environ.get("QUERY_CACHE_REDIS_URL") else None))
+
+# Flux temps réel (SSE) : un seul suiveur par shard, partagé par tous les clients abonnés
+live_hub = LiveTailHub(lambda key: shard_router.route(key), read_from_shard,
+                       poll_interval=float(os.environ.get("LIVE_POLL_INTERVAL", 1.0)))
+# Commentaire envoyé sans nouvel échantillon : garde la connexion ouverte et détecte les clients partis
+LIVE_HEARTBEAT_SECONDS = 15
+
+# Index local des séries (clés et labels) pour la recherche, persisté dans sharding_metadata
+series_index = SeriesIndex.load()
+SERIES_INDEX_MAX_AGE = int(os.environ.get("SERIES_INDEX_MAX_AGE", 300))
+
+
+def ensure_series_index():
+    """Construit l'index au premier usage, puis le rafraîchit en arrière-plan s'il est trop ancien"""
+    resolve_all_shards()
+    if not len(series_index):
+        series_index.refresh(shard_connections, SENSOR_TYPES)
+    else:
+        series_index.refresh_in_background(shard_connections, SENSOR_TYPES, SERIES_INDEX_MAX_AGE)
+
+
+# Nombre de points maximal accepté par graphique (max_points)
+MAX_POINTS_LIMIT = 100_000
+
+
+def parse_max_points(data):
+    """max_points d'une requête (DEFAULT_MAX_POINTS par défaut), entier entre 1 et MAX_POINTS_LIMIT"""
+    value = data.get('max_points', DEFAULT_MAX_POINTS)
+    try:
+        if isinstance(value, (bool, float)):
+            raise ValueError
+        max_points = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"max_points invalide: {value!r} (entier attendu)")
+    if not 1 <= max_points <= MAX_POINTS_LIMIT:
+        raise ValueError(f"max_points invalide: {max_points} (entre 1 et {MAX_POINTS_LIMIT})")
+    return max_points
+
+
+def time_range_to_start(now, time_range):
+    """Convertit une période (1h, 24h, 7d, 30d) en timestamp de début (ms)"""
+    if time_range == '1h':
+        return now - 3600 * 1000
+    elif time_range == '24h':
+        return now - 24 * 3600 * 1000
+    elif time_range == '7d':
+        return now - 7 * 24 * 3600 * 1000
+    elif time_range == '30d':
+        return now - 30 * 24 * 3600 * 1000
+    return now - 3600 * 1000  # Par défaut 1h
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.before_request
+def refresh_routing():
+    """Suit les changements de la configuration de true sharding (une lecture de mtime par requête)"""
+    reload_routing()
+
+
+@app.after_request
+def record_request_latency(response):
+    """Latence par route (le motif de la route, pas l'URL, pour borner le nombre de séries)"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'inconnue'
+        HTTP_REQUEST_DURATION.labels(route=route, method=request.method,
+                                     status=response.status_code).observe(time.perf_counter() - started)
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """Métriques au format texte Prometheus (commandes Redis par shard, routes, pools...)"""
+    return app.response_class(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 
 @app.route('/')
 def dashboard():
@@ -25,6 +304,226 @@ def dashboard():
                            sensor_types=SENSOR_TYPES)
 
 
+def fetch_series_points(key, start_time, end_time, downsampling='auto', aggregation='avg',
+                        max_points=DEFAULT_MAX_POINTS, bucket_ms=None):
+    """
+    Récupère les points d'une série en limitant leur nombre :
+    - auto : agrégation côté Redis (TS.RANGE ... AGGREGATION) avec un bucket choisi selon la plage
+      (ou imposé par bucket_ms), lue dans le palier de compaction le plus grossier qui convient
+      (1m, 1h, 1d) plutôt que dans les données brutes
+    - lttb : données brutes décimées avec l'algorithme LTTB
+    - none : données brutes
+    """
+    meta = {'mode': downsampling, 'max_points': max_points}
+    shard = shard_router.route(key)
+
+    if downsampling == 'auto':
+        bucket_ms = bucket_ms or choose_bucket_ms(start_time, end_time, max_points)
+        plan = plan_query(start_time, end_time, int(time.time() * 1000), aggregation, bucket_ms=bucket_ms)
+        with track_redis(shard, 'TS.RANGE'):
+            points = read_from_shard(
+                shard, lambda conn: fetch_planned_ranges(conn, [key], start_time, end_time, aggregation, plan))[key]
+        if isinstance(points, Exception):
+            raise points
+        meta.update({'aggregation': aggregation, 'bucket_ms': bucket_ms, 'tier': plan['tier']})
+    else:
+        with track_redis(shard, 'TS.RANGE'):
+            raw_data = read_from_shard(shard, lambda conn: conn.execute_command('TS.RANGE', key, start_time, end_time))
+        points = [(int(point[0]), float(point[1])) for point in raw_data]
+        meta['raw_points'] = len(points)
+        if downsampling == 'lttb':
+            points = lttb(points, max_points)
+
+    meta['points'] = len(points)
+    return points, meta
+
+
+def fetch_bucket_stats(key, start_time, end_time, bucket_ms):
+    """
+    Statistiques exactes par bucket (min, max, somme, nombre) calculées côté Redis sur les
+    données brutes, sans rapatrier les points : lignes [timestamp, min, max, somme, nombre]
+    """
+    def read_aggregates(conn):
+        pipe = conn.pipeline(transaction=False)
+        for aggregation in ('min', 'max', 'sum', 'count'):
+            pipe.execute_command('TS.RANGE', key, start_time, end_time, 'AGGREGATION', aggregation, bucket_ms)
+        return pipe.execute()
+
+    shard = shard_router.route(key)
+    with track_redis(shard, 'TS.RANGE'):
+        mins, maxs, sums, counts = read_from_shard(shard, read_aggregates)
+
+    # Les quatre agrégations renvoient les mêmes buckets (ceux qui contiennent des échantillons)
+    return [[int(low[0]), float(low[1]), float(high[1]), float(total[1]), int(float(count[1]))]
+            for low, high, total, count in zip(mins, maxs, sums, counts)]
+
+
+def fetch_tier_bucket_stats(key, start_time, end_time, bucket_ms):
+    """
+    Statistiques par bucket lues dans les paliers agrégés min, max et avg (même plan que les
+    points), sans parcourir les données brutes de toute la plage : lignes [timestamp, min, max,
+    moyenne, 1]. Les paliers ne conservent pas le nombre d'échantillons bruts : chaque bucket
+    compte pour un, la moyenne de la plage est celle des buckets et le nombre celui des buckets.
+    """
+    plan = plan_query(start_time, end_time, int(time.time() * 1000), 'avg', bucket_ms=bucket_ms)
+    shard = shard_router.route(key)
+    with track_redis(shard, 'TS.RANGE'):
+        ranges = read_from_shard(shard, lambda conn: [
+            fetch_planned_ranges(conn, [key], start_time, end_time, aggregation, plan)[key]
+            for aggregation in ('min', 'max', 'avg')])
+    for points in ranges:
+        if isinstance(points, Exception):
+            raise points
+    # Les trois paliers ont les mêmes buckets (ceux qui contiennent des échantillons)
+    return [[timestamp, low, high, avg, 1] for (timestamp, low), (_, high), (_, avg) in zip(*ranges)]
+
+
+def fetch_series_segment(key, start_time, end_time, downsampling, aggregation, bucket_ms):
+    """
+    Points d'une série sur des buckets entiers [start_time, end_time] et, en mode auto,
+    statistiques par bucket dont les points sont tirés : (points [[timestamp, valeur]], buckets)
+    """
+    if downsampling != 'auto':
+        points, _ = fetch_series_points(key, start_time, end_time, 'none')
+        return [list(point) for point in points], []
+    buckets = fetch_tier_bucket_stats(key, start_time, end_time, bucket_ms)
+    return [[bucket[0], bucket_value(bucket, aggregation)] for bucket in buckets], buckets
+
+
+def bucket_value(bucket, aggregation):
+    """Valeur agrégée d'un bucket à partir de ses statistiques [timestamp, min, max, somme, nombre]"""
+    if aggregation == 'min':
+        return bucket[1]
+    if aggregation == 'max':
+        return bucket[2]
+    return bucket[3] / bucket[4]
+
+
+def plan_series_query(key, start_time, end_time, downsampling='auto', aggregation='avg',
+                      max_points=DEFAULT_MAX_POINTS):
+    """
+    Résolution, plage alignée sur les buckets, clés de cache et ETag d'une requête de série.
+    Un seul TS.GET (dernier timestamp de la série), sans lecture de plage : suffit pour
+    répondre 304 à un client dont le graphique est à jour.
+    """
+    bucket_ms = choose_bucket_ms(start_time, end_time, max_points)
+    plan = None
+    if downsampling == 'auto':
+        plan = plan_query(start_time, end_time, int(time.time() * 1000), aggregation, bucket_ms=bucket_ms)
+        bucket_ms = plan['bucket_ms']
+    aligned_start, open_start, open_end = align_range(start_time, end_time, bucket_ms)
+
+    shard = shard_router.route(key)
+    with track_redis(shard, 'TS.GET'):
+        last = read_from_shard(shard, lambda conn: conn.execute_command('TS.GET', key))
+    last_timestamp = int(last[0]) if last else 0
+
+    series_key = f"{key}|{downsampling}|{aggregation}|{bucket_ms}"
+    response_key = f"{series_key}|{aligned_start}|{open_start}|{last_timestamp}"
+    return {
+        'bucket_ms': bucket_ms,
+        'plan': plan,
+        'aligned_start': aligned_start,
+        'open_start': open_start,
+        'open_end': open_end,
+        'series_key': series_key,
+        'response_key': response_key,
+        'etag': range_etag(response_key)
+    }
+
+
+def query_series(key, start_time, end_time, downsampling='auto', aggregation='avg', max_points=DEFAULT_MAX_POINTS,
+                 query=None):
+    """
+    Points et statistiques d'une série sur une plage alignée sur les buckets, à travers le cache :
+    les buckets fermés (immuables) viennent du segment en cache, seuls les buckets fermés depuis
+    et le bucket en cours sont lus dans Redis. Une réponse encore fraîche est servie sans Redis.
+    query : plan déjà calculé par plan_series_query. Renvoie (résultat, etag, état du cache :
+    hit, partial ou miss).
+    """
+    query = query or plan_series_query(key, start_time, end_time, downsampling, aggregation, max_points)
+    bucket_ms, plan = query['bucket_ms'], query['plan']
+    aligned_start, open_start, open_end = query['aligned_start'], query['open_start'], query['open_end']
+    series_key, response_key = query['series_key'], query['response_key']
+
+    cached = query_cache.get_response(response_key)
+    if cached is not None:
+        return cached + ('hit',)
+
+    # Buckets fermés : segment en cache raccourci au début de la plage et prolongé jusqu'au bucket en cours
+    segment = query_cache.get_segment(series_key)
+    if segment is None or not segment['from'] <= aligned_start <= segment['to'] <= open_start:
+        cache_state = 'miss'
+        segment = {'from': aligned_start, 'to': aligned_start, 'points': [], 'buckets': []}
+    else:
+        cache_state = 'partial'
+    if segment['from'] != aligned_start or segment['to'] != open_start:
+        points, buckets = [], []
+        if segment['to'] < open_start:
+            points, buckets = fetch_series_segment(key, segment['to'], open_start - 1, downsampling,
+                                                   aggregation, bucket_ms)
+        segment = {
+            'from': aligned_start,
+            'to': open_start,
+            'points': trim_before(segment['points'], aligned_start) + points,
+            'buckets': trim_before(segment['buckets'], aligned_start) + buckets
+        }
+        query_cache.put_segment(series_key, segment)
+
+    # Bucket en cours : toujours relu
+    if downsampling == 'auto':
+        # Ramené à un bucket compté pour un, comme les buckets fermés lus dans les paliers
+        open_buckets = [[bucket[0], bucket[1], bucket[2], bucket[3] / bucket[4], 1]
+                        for bucket in fetch_bucket_stats(key, open_start, open_end, bucket_ms)]
+        open_points = [[bucket[0], bucket_value(bucket, aggregation)] for bucket in open_buckets]
+    else:
+        open_points, _ = fetch_series_segment(key, open_start, open_end, downsampling, aggregation, bucket_ms)
+
+    points = segment['points'] + open_points
+    meta = {'mode': downsampling, 'max_points': max_points, 'start': aligned_start}
+    if downsampling == 'auto':
+        # Statistiques de toute la plage à partir des statistiques par bucket (nombre = buckets)
+        stats = combine_bucket_stats(segment['buckets'] + open_buckets)
+        meta.update({'aggregation': aggregation, 'bucket_ms': bucket_ms, 'tier': plan['tier']})
+    else:
+        # Statistiques calculées sur les données brutes, avant décimation
+        values = [point[1] for point in points]
+        stats = {
+            'min': min(values),
+            'max': max(values),
+            'avg': sum(values) / len(values),
+            'count': len(values)
+        } if values else {}
+        meta['raw_points'] = len(points)
+        if downsampling == 'lttb':
+            points = lttb(points, max_points)
+    meta['points'] = len(points)
+
+    result = {'key': key, 'points': points, 'stats': stats, 'meta': meta}
+    return result, query_cache.put_response(response_key, result, etag=query['etag']), cache_state
+
+
+def build_binary_response(points, stats, downsampling_meta):
+    """
+    Encode les points en tableaux typés little-endian :
+    en-tête de 8 octets (uint32 nombre de points + uint32 réservé),
+    puis les timestamps en Int64 (ms) et les valeurs en Float64.
+    Les statistiques sont transmises dans les en-têtes HTTP.
+    """
+    timestamps = array('q', (point[0] for point in points))
+    values = array('d', (point[1] for point in points))
+    if sys.byteorder != 'little':
+        timestamps.byteswap()
+        values.byteswap()
+
+    body = struct.pack('<II', len(points), 0) + timestamps.tobytes() + values.tobytes()
+    response = make_response(body)
+    response.headers['Content-Type'] = 'application/octet-stream'
+    response.headers['X-Sensor-Stats'] = json.dumps(stats)
+    response.headers['X-Sensor-Downsampling'] = json.dumps(downsampling_meta)
+    return response
+
+
 @app.route('/get_sensor_data', methods=['POST'])
 def get_sensor_data():
     data = request.json
@@ -32,63 +531,256 @@ def get_sensor_data():
     sensor_type = data.get('sensor_type')
     sensor_id = data.get('sensor_id', 1)
     time_range = data.get('time_range', '1h')  # 1h, 24h, 7d, 30d
+    downsampling = data.get('downsampling', 'auto')  # auto, lttb, none
+    aggregation = data.get('aggregation', 'avg')  # avg, min, max
+    response_format = data.get('format', 'plotly')  # plotly, columnar, binary
+    try:
+        max_points = parse_max_points(data)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    if aggregation not in AGGREGATIONS:
+        aggregation = 'avg'
 
     # Calculer les timestamps de début et fin
     now = int(time.time() * 1000)
-
-    if time_range == '1h':
-        start_time = now - 3600 * 1000
-    elif time_range == '24h':
-        start_time = now - 24 * 3600 * 1000
-    elif time_range == '7d':
-        start_time = now - 7 * 24 * 3600 * 1000
-    elif time_range == '30d':
-        start_time = now - 30 * 24 * 3600 * 1000
-    else:
-        start_time = now - 3600 * 1000  # Par défaut 1h
+    start_time = time_range_to_start(now, time_range)
 
     key = f"sensor:{sensor_type}:{location}:{sensor_id}"
 
     try:
-        # Récupérer les données de la série temporelle
-        raw_data = r.execute_command('TS.RANGE', key, start_time, now)
-
-        # Traiter les données pour Plotly
-        timestamps = [datetime.fromtimestamp(int(point[0]) / 1000) for point in raw_data]
-        values = [float(point[1]) for point in raw_data]
-
-        # Créer le graphique
-        trace = go.Scatter(
-            x=timestamps,
-            y=values,
-            mode='lines+markers',
-            name=f"{sensor_type} - {location} - {sensor_id}"
-        )
-
-        layout = go.Layout(
-            title=f"{sensor_type.capitalize()} dans {location} (Capteur {sensor_id})",
-            xaxis=dict(title='Temps'),
-            yaxis=dict(title=sensor_type.capitalize())
-        )
-
-        fig = go.Figure(data=[trace], layout=layout)
-        graph_json = json.dumps(fig, cls=PlotlyJSONEncoder)
-
-        # Statistiques de base
-        if values:
-            stats = {
-                'min': min(values),
-                'max': max(values),
-                'avg': sum(values) / len(values),
-                'count': len(values)
-            }
+        # Graphique inchangé depuis la dernière réponse du client : 304 sans corps, avant toute
+        # lecture de plage (l'ETag ne dépend que de la plage alignée et du dernier timestamp)
+        query = plan_series_query(key, start_time, now, downsampling, aggregation, max_points)
+        etag = f"{query['etag']}-{response_format}"
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+            response.set_etag(etag)
+            response.headers['X-Query-Cache'] = 'not-modified'
+            return response
+
+        # Récupérer les données de la série temporelle (sous-échantillonnées), via le cache
+        result, _, cache_state = query_series(key, start_time, now, downsampling, aggregation, max_points, query)
+
+        points, stats, downsampling_meta = result['points'], result['stats'], result['meta']
+        values = [point[1] for point in points]
+
+        title = f"{sensor_type.capitalize()} dans {location} (Capteur {sensor_id})"
+        name = f"{sensor_type} - {location} - {sensor_id}"
+
+        if response_format == 'binary':
+            response = build_binary_response(points, stats, downsampling_meta)
+        elif response_format == 'columnar':
+            # Tableaux bruts (epoch ms / valeurs) : le graphique est construit côté client
+            response = jsonify({
+                'status': 'success',
+                'format': 'columnar',
+                'series': {
+                    'name': name,
+                    'title': title,
+                    't': [point[0] for point in points],
+                    'v': values
+                },
+                'stats': stats,
+                'downsampling': downsampling_meta
+            })
         else:
-            stats = {}
+            # Traiter les données pour Plotly
+            timestamps = [datetime.fromtimestamp(point[0] / 1000) for point in points]
+
+            # Créer le graphique
+            trace = go.Scatter(
+                x=timestamps,
+                y=values,
+                mode='lines+markers',
+                name=name
+            )
+
+            layout = go.Layout(
+                title=title,
+                xaxis=dict(title='Temps'),
+                yaxis=dict(title=sensor_type.capitalize())
+            )
+
+            fig = go.Figure(data=[trace], layout=layout)
+            graph_json = json.dumps(fig, cls=PlotlyJSONEncoder)
+
+            response = jsonify({
+                'status': 'success',
+                'graph': graph_json,
+                'stats': stats,
+                'downsampling': downsampling_meta
+            })
+
+        # Le client revalide à chaque fois (If-None-Match) plutôt que de garder une réponse périmée
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Query-Cache'] = cache_state
+        return response
+
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        })
+
+
+@app.route('/stream_sensor_data')
+def stream_sensor_data():
+    """
+    Flux Server-Sent Events des nouveaux échantillons d'un capteur (location, sensor_type, sensor_id)
+    ou de plusieurs séries (key=... répété), postérieurs à since (dernier timestamp affiché, en ms).
+    Seuls les nouveaux points sont envoyés (événements "samples" : key, t, v) ; un événement
+    "reset" demande au client de recharger sa fenêtre. Avec bucket_ms (graphique agrégé), les
+    échantillons sont regroupés en buckets (aggregation : avg, min, max) : le premier point d'un
+    événement peut remplacer le bucket en cours déjà affiché. Le client passe alors since = début
+    du bucket en cours - 1 pour que ce bucket soit recalculé avec tous ses échantillons.
+    """
+    keys = request.args.getlist('key') or [
+        f"sensor:{request.args.get('sensor_type')}:{request.args.get('location')}:{request.args.get('sensor_id', 1)}"]
+    # À la reconnexion automatique, le navigateur renvoie l'id du dernier événement reçu
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    bucket_ms = request.args.get('bucket_ms')
+    aggregation = request.args.get('aggregation', 'avg')
+    try:
+        since = int(since) if since else None
+        bucket_ms = int(bucket_ms) if bucket_ms else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': f"Timestamp ou bucket invalide: {since}, {bucket_ms}"}), 400
+    if bucket_ms is not None and bucket_ms <= 0:
+        return jsonify({'status': 'error', 'message': f"Bucket invalide: {bucket_ms}"}), 400
+    if aggregation not in AGGREGATIONS:
+        aggregation = 'avg'
+    folder = BucketFolder(bucket_ms, lambda bucket: bucket_value(bucket, aggregation)) if bucket_ms else None
+
+    subscription = live_hub.subscribe(keys, since)
+
+    def events():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                item = subscription.get(timeout=LIVE_HEARTBEAT_SECONDS)
+                if item is None:
+                    yield ": keepalive\n\n"
+                    continue
+                event, payload = item
+                if event == 'samples' and folder is not None:
+                    payload = folder.fold(payload)
+                    if not payload['t']:
+                        continue
+                # L'id (dernier timestamp, ou début du bucket en cours - 1) ne permet de reprendre
+                # le flux que pour une seule série
+                event_id = ""
+                if event == 'samples' and len(keys) == 1:
+                    event_id = f"id: {payload['t'][-1] - 1 if folder is not None else payload['t'][-1]}\n"
+                yield f"{event_id}event: {event}\ndata: {json.dumps(payload)}\n\n"
+                if event == 'reset':
+                    return
+        finally:
+            live_hub.unsubscribe(subscription)
+
+    response = app.response_class(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Pas de mise en mémoire tampon par un éventuel proxy (nginx)
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def parse_label_filters(filters):
+    """Normalise les filtres de labels (liste 'label=valeur' ou dictionnaire) pour TS.MRANGE"""
+    if isinstance(filters, dict):
+        return [f"{label}={value}" for label, value in filters.items()]
+    if isinstance(filters, str):
+        return [filters]
+    return [str(f) for f in filters or []]
+
+
+def mrange_shard(conn, start_time, end_time, filters, bucket_ms=None, aggregation='avg',
+                 groupby=None, reducer=None):
+    """Exécute un TS.MRANGE sur un shard et renvoie les séries au format colonnes"""
+    args = ['TS.MRANGE', start_time, end_time]
+    if bucket_ms:
+        args += ['AGGREGATION', aggregation, bucket_ms]
+    args += ['FILTER', *filters]
+    if groupby:
+        args += ['GROUPBY', groupby, 'REDUCE', reducer or 'avg']
+
+    series = []
+    for key, _labels, samples in conn.execute_command(*args):
+        series.append({
+            'key': key,
+            't': [int(point[0]) for point in samples],
+            'v': [float(point[1]) for point in samples]
+        })
+    return series
+
+
+@app.route('/get_sensor_data_batch', methods=['POST'])
+def get_sensor_data_batch():
+    """
+    Renvoie en une seule réponse toutes les séries correspondant à un filtre de labels
+    (ex: type=temperature ou unit_measure=celsius), avec un seul TS.MRANGE par shard.
+    Avec GROUPBY/REDUCE, la réduction est faite par Redis au sein de chaque shard.
+    """
+    data = request.json
+    filters = parse_label_filters(data.get('filters'))
+    time_range = data.get('time_range', '1h')
+    downsampling = data.get('downsampling', 'auto')  # auto, none
+    aggregation = data.get('aggregation', 'avg')
+    groupby = data.get('groupby')
+    reducer = data.get('reduce', 'avg')
+    locations = data.get('locations') or list(shard_connections.keys())
+    try:
+        max_points = parse_max_points(data)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    if not filters or not any('=' in f and '!=' not in f for f in filters):
+        return jsonify({
+            'status': 'error',
+            'message': "Au moins un filtre 'label=valeur' est requis"
+        })
+
+    if aggregation not in AGGREGATIONS:
+        aggregation = 'avg'
+
+    now = int(time.time() * 1000)
+    start_time = time_range_to_start(now, time_range)
+    bucket_ms = choose_bucket_ms(start_time, now, max_points) if downsampling == 'auto' else None
+
+    try:
+        series = []
+        errors = {}
+        targets = [location for location in locations if location in shard_connections]
+
+        # Un TS.MRANGE par shard, exécutés en parallèle
+        with ThreadPoolExecutor(max_workers=max(1, len(targets))) as executor:
+            futures = {
+                location: executor.submit(read_from_shard, location,
+                                          lambda conn: mrange_shard(conn, start_time, now, filters, bucket_ms,
+                                                                    aggregation, groupby, reducer))
+                for location in targets
+            }
+            for location, future in futures.items():
+                try:
+                    for item in future.result():
+                        item['shard'] = location
+                        series.append(item)
+                except Exception as e:
+                    errors[location] = str(e)
 
         return jsonify({
             'status': 'success',
-            'graph': graph_json,
-            'stats': stats
+            'series': series,
+            'errors': errors,
+            '_metadata': {
+                'filters': filters,
+                'groupby': groupby,
+                'reduce': reducer if groupby else None,
+                'aggregation': aggregation if bucket_ms else None,
+                'bucket_ms': bucket_ms,
+                'shards': targets
+            }
         })
 
     except Exception as e:
@@ -107,58 +799,34 @@ def get_sensor_count():
     try:
         counts = []
 
-        def parse_ts_info(info):
-            """Convertit la réponse TS.INFO (liste) en dictionnaire"""
-            if isinstance(info, dict):
-                return info
-            return {info[i]: info[i + 1] for i in range(0, len(info), 2)}
-
-        if sensor_type:
-            # Recherche pour un type spécifique
-            for sensor_id in range(1, 4):
-                key = f"sensor:{sensor_type}:{location}:{sensor_id}"
-                try:
-                    raw_info = r.execute_command('TS.INFO', key)
-                    info = parse_ts_info(raw_info)
-                    counts.append({
-                        'sensor_id': sensor_id,
-                        'count': info.get('totalSamples', 0)
-                    })
-                except redis.exceptions.ResponseError:
-                    counts.append({
-                        'sensor_id': sensor_id,
-                        'count': 0,
-                        'error': 'sensor_not_found'
-                    })
-                    continue
-        else:
-            # Recherche pour tous les types
-            for st in SENSOR_TYPES:
-                for sensor_id in range(1, 4):
-                    key = f"sensor:{st}:{location}:{sensor_id}"
-                    try:
-                        raw_info = r.execute_command('TS.INFO', key)
-                        info = parse_ts_info(raw_info)
-                        counts.append({
-                            'sensor_type': st,
-                            'sensor_id': sensor_id,
-                            'count': info.get('totalSamples', 0)
-                        })
-                    except redis.exceptions.ResponseError:
-                        counts.append({
-                            'sensor_type': st,
-                            'sensor_id': sensor_id,
-                            'count': 0,
-                            'error': 'sensor_not_found'
-                        })
-                        continue
+        # Métadonnées servies depuis le cache (un seul pipeline TS.INFO par shard pour les entrées manquantes)
+        sensor_types = [sensor_type] if sensor_type else SENSOR_TYPES
+        keys = [(st, sensor_id, f"sensor:{st}:{location}:{sensor_id}")
+                for st in sensor_types for sensor_id in range(1, 4)]
+        keys_by_shard = {}
+        for _, _, key in keys:
+            keys_by_shard.setdefault(shard_router.route(key), []).append(key)
+        infos = {}
+        for shard, shard_keys in keys_by_shard.items():
+            infos.update(read_from_shard(shard, lambda conn: info_cache.get_many(conn, shard_keys)))
+
+        for st, sensor_id, key in keys:
+            info = infos[key]
+            entry = {} if sensor_type else {'sensor_type': st}
+            entry['sensor_id'] = sensor_id
+            if info is None:
+                entry.update({'count': 0, 'error': 'sensor_not_found'})
+            else:
+                entry['count'] = info['totalSamples']
+            counts.append(entry)
 
         return jsonify({
             'status': 'success',
             'counts': counts,
             '_metadata': {
                 'location': location,
-                'sensor_type_filter': sensor_type or 'all'
+                'sensor_type_filter': sensor_type or 'all',
+                'cache': info_cache.stats()
             }
         })
 
@@ -176,44 +844,43 @@ def get_sensor_count():
 @app.route('/search_data', methods=['POST'])
 def search_data():
     data = request.json
-    query = data.get('query', '').lower().strip()
+    query = data.get('query', '').strip()
 
     try:
         results = []
-        matching_keys = []
 
-        for key in r.scan_iter("sensor:*"):
-            if query in key.lower():
-                matching_keys.append(key)
-                try:
-                    # Version adaptée pour les réponses en liste
-                    info = r.execute_command('TS.INFO', key)
-
-                    # Transformation de la liste en dictionnaire
-                    info_dict = {
-                        'totalSamples': info[1],
-                        'firstTimestamp': info[3],
-                        'lastTimestamp': info[5]
-                    }
-
-                    parts = key.split(':')
-                    results.append({
-                        'key': key,
-                        'sensor_type': parts[1],
-                        'location': parts[2],
-                        'sensor_id': parts[3],
-                        'samples': info_dict['totalSamples'],
-                        'first_timestamp': datetime.fromtimestamp(int(info_dict['firstTimestamp']) / 1000).strftime(
-                            '%Y-%m-%d %H:%M:%S'),
-                        'last_timestamp': datetime.fromtimestamp(int(info_dict['lastTimestamp']) / 1000).strftime(
-                            '%Y-%m-%d %H:%M:%S')
-                    })
-                except IndexError as e:
-                    print(f"Structure incorrecte pour {key}: {info}")
-                    continue
-                except Exception as e:
-                    print(f"Erreur traitement {key}: {str(e)}")
-                    continue
+        # Recherche dans l'index local (préfixe*, sous-chaîne ou label=valeur) au lieu d'un SCAN
+        ensure_series_index()
+        matching_keys = series_index.search(query)
+
+        # Métadonnées servies depuis le cache, un pipeline par shard. Le shard vient du routeur
+        # courant et non de l'index, qui peut encore désigner l'ancien shard après une migration
+        keys_by_location = {}
+        for key in matching_keys:
+            keys_by_location.setdefault(shard_router.route(key), []).append(key)
+        infos = {}
+        for location, keys in keys_by_location.items():
+            infos.update(read_from_shard(location, lambda conn: info_cache.get_many(conn, keys)))
+        for key in matching_keys:
+            info = infos[key]
+            if info is None:
+                continue
+            try:
+                parts = key.split(':')
+                results.append({
+                    'key': key,
+                    'sensor_type': parts[1],
+                    'location': parts[2],
+                    'sensor_id': parts[3],
+                    'samples': info['totalSamples'],
+                    'first_timestamp': datetime.fromtimestamp(info['firstTimestamp'] / 1000).strftime(
+                        '%Y-%m-%d %H:%M:%S'),
+                    'last_timestamp': datetime.fromtimestamp(info['lastTimestamp'] / 1000).strftime(
+                        '%Y-%m-%d %H:%M:%S')
+                })
+            except IndexError:
+                print(f"Structure incorrecte pour {key}: {info}")
+                continue
 
         return jsonify({
             'status': 'success',
@@ -221,7 +888,9 @@ def search_data():
             '_debug': {
                 'query': query,
                 'keys_found': len(matching_keys),
-                'keys_processed': len(results)
+                'keys_processed': len(results),
+                'index_size': len(series_index),
+                'cache': info_cache.stats()
             }
         })
 
@@ -0,0 +1,366 @@
+import asyncio
+import random
+import time
+
+import redis.asyncio
+
+from generate_sharding_data import ShardingLayout
+from metrics import POOL_IN_USE, POOL_MAX, REGISTRY, track_redis
+from rollups import (RAW_RETENTION_MS, backfill_ranges, backfill_writes, missing_rollups, rollup_commands,
+                     rollup_pair)
+from series_info_cache import parse_ts_info
+from shard_router import location_of_key
+
+
+class AsyncRedisTrueShardingSystem(ShardingLayout):
+    """
+    Variante asyncio du client de true sharding : même routage clé -> shard,
+    mais chaque shard est servi par un pool de connexions redis.asyncio borné.
+    Le nombre d'opérations simultanées par shard est limité (contre-pression) :
+    au-delà, les appelants attendent au lieu d'ouvrir de nouvelles connexions.
+    """
+
+    def __init__(self, connections=None, pool_size=50, pool_timeout=5, max_in_flight=None,
+                 health_check_interval=30, socket_timeout=5, router=None):
+        super().__init__(router)
+        self.pool_size = pool_size
+        self.max_in_flight = max_in_flight or pool_size
+        self.query_timeout = 5.0
+        self.last_query_report = None
+        self.pools = {}
+        self.semaphores = {}
+        self.in_flight = {}
+        self.peak_in_flight = {}
+
+        if connections is not None:
+            self.connections = dict(connections)
+        else:
+            for location, config in self.shards.items():
+                # Pool bloquant : une requête attend (jusqu'à pool_timeout) qu'une connexion se libère
+                pool = redis.asyncio.BlockingConnectionPool(
+                    max_connections=pool_size,
+                    timeout=pool_timeout,
+                    host=config["host"],
+                    port=config["port"],
+                    password=self.redis_password,
+                    decode_responses=True,
+                    health_check_interval=health_check_interval,
+                    socket_timeout=socket_timeout
+                )
+                self.pools[location] = pool
+                self.connections[location] = redis.asyncio.Redis(connection_pool=pool)
+
+    async def connect(self):
+        """Vérifie tous les shards en parallèle et écarte ceux qui sont indisponibles ou réplicas"""
+        async def check(location):
+            conn = self.connections[location]
+            try:
+                if not await conn.ping():
+                    raise Exception("Le serveur ne répond pas au ping")
+                if (await conn.info("replication")).get("role") == "slave":
+                    raise Exception("Ce serveur est un réplica en lecture seule")
+                config = self.shards.get(location, {})
+                print(f"Connecté au shard {location}: {config.get('host')}:{config.get('port')} "
+                      f"({config.get('container')})")
+                return None
+            except Exception as e:
+                print(f"Erreur de connexion au shard {location}: {e}")
+                return location
+
+        failed = await asyncio.gather(*(check(location) for location in list(self.connections)))
+        for location in failed:
+            if location is not None:
+                del self.connections[location]
+
+        for location in self.connections:
+            self.semaphores[location] = asyncio.Semaphore(self.max_in_flight)
+            self.in_flight[location] = 0
+            self.peak_in_flight[location] = 0
+        REGISTRY.add_collector(self._collect_pool_metrics)
+        return self
+
+    async def close(self):
+        for conn in self.connections.values():
+            await conn.close()
+        for pool in self.pools.values():
+            await pool.disconnect()
+
+    # --- Exécution avec contre-pression -------------------------------------
+
+    async def _limited(self, location, coroutine_factory):
+        semaphore = self.semaphores.get(location)
+        if semaphore is None:
+            self.semaphores[location] = semaphore = asyncio.Semaphore(self.max_in_flight)
+            self.in_flight[location] = 0
+            self.peak_in_flight[location] = 0
+        async with semaphore:
+            self.in_flight[location] += 1
+            self.peak_in_flight[location] = max(self.peak_in_flight[location], self.in_flight[location])
+            try:
+                return await coroutine_factory()
+            finally:
+                self.in_flight[location] -= 1
+
+    async def execute(self, location, *args):
+        """Exécute une commande sur le shard d'un emplacement"""
+        conn = self.get_connection_for_location(location)
+        with track_redis(location, str(args[0]).upper()):
+            return await self._limited(location, lambda: conn.execute_command(*args))
+
+    async def execute_pipeline(self, location, commands):
+        """Envoie une liste de commandes en un seul aller-retour sur un shard"""
+        conn = self.get_connection_for_location(location)
+
+        async def run():
+            pipe = conn.pipeline(transaction=False)
+            for args in commands:
+                pipe.execute_command(*args)
+            return await pipe.execute(raise_on_error=False)
+
+        with track_redis(location, str(commands[0][0]).upper() if commands else "PIPELINE"):
+            return await self._limited(location, run)
+
+    def _collect_pool_metrics(self):
+        """Collecteur de métriques : opérations en cours par shard et limite de contre-pression"""
+        for location, stats in self.pool_stats().items():
+            POOL_IN_USE.labels(shard=location).set(stats["in_flight"])
+            POOL_MAX.labels(shard=location).set(stats["max_in_flight"])
+
+    def pool_stats(self):
+        """Utilisation des pools : opérations en cours et pic par shard"""
+        return {
+            location: {
+                "in_flight": self.in_flight.get(location, 0),
+                "peak_in_flight": self.peak_in_flight.get(location, 0),
+                "max_in_flight": self.max_in_flight,
+                "pool_size": self.pool_size
+            }
+            for location in self.connections
+        }
+
+    # --- Séries et ingestion -------------------------------------------------
+
+    async def create_time_series(self):
+        """
+        Crée les séries manquantes et leurs paliers agrégés (règles de compaction),
+        un pipeline par shard, tous les shards en parallèle. Les paliers manquants d'une
+        série existante sont d'abord remplis avec son historique brut.
+        """
+        commands_by_shard = {}
+        for location, sensor_type, sensor_id, key in self.series_keys():
+            shard = self.shard_for_key(key)
+            if shard in self.connections:
+                commands_by_shard.setdefault(shard, []).append((
+                    "TS.CREATE", key, "RETENTION", RAW_RETENTION_MS, "LABELS",
+                    "sensorId", str(sensor_id), "type", sensor_type,
+                    "location", location, "unit_measure", self.unit_measures[sensor_type]))
+
+        async def create_for_shard(shard, commands):
+            created = rules = 0
+            followups = []
+            for command, reply in zip(commands, await self.execute_pipeline(shard, commands)):
+                if not isinstance(reply, Exception):
+                    created += 1
+                    followups.extend(rollup_commands(command[1]))
+                elif "already" in str(reply):
+                    followups.append(("TS.INFO", command[1]))
+                else:
+                    print(f"Erreur lors de la création de {command[1]}: {reply}")
+            if not followups:
+                return created, rules
+
+            infos = {}
+            for command, reply in zip(followups, await self.execute_pipeline(shard, followups)):
+                if isinstance(reply, Exception):
+                    if "already" not in str(reply):
+                        print(f"Erreur lors de la création de {command[1]}: {reply}")
+                elif command[0] == "TS.INFO":
+                    infos[command[1]] = reply
+                elif command[0] == "TS.CREATERULE":
+                    rules += 1
+            rules += await self._complete_rollups(shard, infos)
+            return created, rules
+
+        results = await asyncio.gather(*(create_for_shard(shard, commands)
+                                         for shard, commands in commands_by_shard.items()))
+        print(f"{sum(created for created, _ in results)} série(s) temporelle(s) et "
+              f"{sum(rules for _, rules in results)} règle(s) de compaction créée(s) "
+              f"sur {len(self.connections)} shards")
+
+    async def _complete_rollups(self, shard, infos):
+        """
+        Équivalent de create_rollups(..., backfill=True) pour les séries existantes {clé: TS.INFO}
+        d'un shard, en quelques pipelines : paliers manquants créés et remplis avec l'historique
+        brut, puis leurs règles de compaction. Renvoie le nombre de règles créées.
+        """
+        creates, rules, ranges = [], [], []
+        for key, info in infos.items():
+            missing = missing_rollups(key, info)
+            for tier, aggregation in missing:
+                create, rule = rollup_pair(key, tier, aggregation)
+                creates.append(create)
+                rules.append(rule)
+            info = parse_ts_info(info)
+            if missing and info["totalSamples"]:
+                ranges.extend(backfill_ranges(key, missing, info["lastTimestamp"]))
+        if not rules:
+            return 0
+
+        replies = await self.execute_pipeline(shard, creates + [command for _, command in ranges])
+        for command, reply in zip(creates, replies):
+            if isinstance(reply, Exception) and "already" not in str(reply):
+                print(f"Erreur lors de la création de {command[1]}: {reply}")
+        writes, failed = [], set()
+        for (destination, command), reply in zip(ranges, replies[len(creates):]):
+            if isinstance(reply, Exception):
+                # Sans historique, pas de règle : le palier resterait vide jusqu'ici
+                print(f"Erreur lors du remplissage de {destination}: {reply}")
+                failed.add(command[1])
+                continue
+            writes.extend(backfill_writes(destination, reply))
+        if writes:
+            await self.execute_pipeline(shard, writes)
+
+        rules = [rule for rule in rules if rule[1] not in failed]
+        created = 0
+        for command, reply in zip(rules, await self.execute_pipeline(shard, rules) if rules else []):
+            if not isinstance(reply, Exception):
+                created += 1
+            elif "already" not in str(reply):
+                print(f"Erreur lors de la création de la règle {command[2]}: {reply}")
+        return created
+
+    async def add_samples(self, location, samples):
+        """Ajoute des échantillons (clé, timestamp, valeur) sur un shard avec un seul TS.MADD"""
+        args = ["TS.MADD"]
+        for key, timestamp_ms, value in samples:
+            args.extend((key, timestamp_ms, value))
+        replies = await self.execute(location, *args)
+        return sum(1 for reply in replies if not isinstance(reply, Exception))
+
+    def generate_sensor_value(self, sensor_type):
+        """Génération de valeurs réalistes selon le type de capteur"""
+        if sensor_type == "temperature":
+            return round(random.uniform(15.0, 30.0), 1)
+        elif sensor_type == "humidity":
+            return round(random.uniform(30.0, 70.0), 1)
+        elif sensor_type == "air_quality":
+            return round(random.uniform(20.0, 150.0), 1)
+
+    async def generate_live_tick(self):
+        """Génère un échantillon par capteur, un TS.MADD par shard, tous les shards en parallèle"""
+        # Prendre en compte une bascule de routage ou une migration lancée entre deux itérations
+        self.reload_routing()
+        timestamp_ms = int(time.time() * 1000)
+
+        samples_by_shard = {}
+        for _, sensor_type, _, key in self.series_keys():
+            if self.shard_for_key(key) not in self.connections:
+                continue
+            sample = (key, timestamp_ms, self.generate_sensor_value(sensor_type))
+            # Pendant une migration, le même échantillon est aussi écrit sur le shard cible
+            for shard in self.write_shards_for_key(key):
+                if shard in self.connections:
+                    samples_by_shard.setdefault(shard, []).append(sample)
+
+        async def tick_shard(shard, samples):
+            try:
+                return await self.add_samples(shard, samples)
+            except Exception as e:
+                print(f"Erreur d'ajout sur le shard {shard}: {e}")
+                return 0
+
+        added = await asyncio.gather(*(tick_shard(shard, samples) for shard, samples in samples_by_shard.items()))
+        return sum(added)
+
+    # --- Requêtes ----------------------------------------------------------------
+
+    async def _fan_out_range(self, keys_by_location, start_ts, end_ts, timeout=None):
+        """Un pipeline TS.RANGE par shard, en parallèle, avec délai maximal par shard"""
+        timeout = self.query_timeout if timeout is None else timeout
+        report = {"complete": [], "timed_out": [], "failed": {}, "latency_ms": {}}
+
+        async def fetch(location, keys):
+            started = time.perf_counter()
+            try:
+                replies = await asyncio.wait_for(
+                    self.execute_pipeline(location, [("TS.RANGE", key, start_ts, end_ts) for key in keys]),
+                    timeout)
+            except asyncio.TimeoutError:
+                report["timed_out"].append(location)
+                return location, None
+            except Exception as e:
+                report["failed"][location] = str(e)
+                return location, None
+            report["latency_ms"][location] = (time.perf_counter() - started) * 1000
+            report["complete"].append(location)
+            return location, dict(zip(keys, replies))
+
+        results = await asyncio.gather(*(fetch(location, keys) for location, keys in keys_by_location.items() if keys))
+        self.last_query_report = report
+        return {location: replies for location, replies in results if replies is not None}, report
+
+    async def query_location_data(self, location, sensor_type, start_time, end_time, timeout=None):
+        """Interroge les données d'un type de capteur pour un emplacement spécifique"""
+        keys = [f"sensor:{sensor_type}:{location}:{sensor_id}" for sensor_id in range(1, self.num_sensors + 1)]
+        keys_by_shard = self.group_keys_by_shard(keys)
+        if location not in self.locations or not keys_by_shard:
+            return f"Emplacement {location} non trouvé ou connexion non disponible"
+
+        start_ts = int(start_time.timestamp() * 1000)
+        end_ts = int(end_time.timestamp() * 1000)
+        replies_by_shard, report = await self._fan_out_range(keys_by_shard, start_ts, end_ts, timeout)
+        return {f"sensor_{sensor_id}": self._range_reply_or_error(self.shard_for_key(key), key, replies_by_shard, report)
+                for sensor_id, key in enumerate(keys, start=1)}
+
+    async def query_by_unit_measure(self, unit_measure, start_time, end_time, timeout=None):
+        """Interroge toutes les séries d'une unité de mesure à travers tous les shards"""
+        sensor_types_with_unit = [st for st, um in self.unit_measures.items() if um == unit_measure]
+        if not sensor_types_with_unit:
+            return f"Aucun capteur avec l'unité de mesure '{unit_measure}' trouvé"
+
+        start_ts = int(start_time.timestamp() * 1000)
+        end_ts = int(end_time.timestamp() * 1000)
+        keys_by_shard = self.group_keys_by_shard(
+            key for _, _, _, key in self.series_keys(sensor_types=sensor_types_with_unit))
+        replies_by_shard, report = await self._fan_out_range(keys_by_shard, start_ts, end_ts, timeout)
+
+        queried_locations = {location_of_key(key) for keys in keys_by_shard.values() for key in keys}
+        results = {}
+        for location in self.locations:
+            if location not in queried_locations:
+                continue
+            results[location] = {
+                sensor_type: {
+                    f"sensor_{sensor_id}": self._range_reply_or_error(
+                        self.shard_for_key(key), key, replies_by_shard, report)
+                    for sensor_id in range(1, self.num_sensors + 1)
+                    for key in [f"sensor:{sensor_type}:{location}:{sensor_id}"]
+                }
+                for sensor_type in sensor_types_with_unit
+            }
+        return results
+
+
+async def main():
+    sharding_system = AsyncRedisTrueShardingSystem()
+    await sharding_system.connect()
+    if not sharding_system.connections:
+        print("ERREUR: Aucune connexion valide aux shards Redis.")
+        return
+    try:
+        await sharding_system.create_time_series()
+        while True:
+            added = await sharding_system.generate_live_tick()
+            print(f"Données générées à {time.strftime('%H:%M:%S')} - {added} points ajoutés "
+                  f"sur {len(sharding_system.connections)} shards")
+            await asyncio.sleep(30)
+    finally:
+        await sharding_system.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\nArrêt de la génération de données en direct.")
@@ -0,0 +1,335 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from timeseries_stand_in import FakeInfluxWriteServer, create_stand_in_system
+
+RESULTS_DIR = "benchmark_results"
+QUERY_RANGES = ("1h", "6h", "24h", "7d")
+
+
+def percentiles(samples_ms):
+    """Résumé d'une série de latences (ms) : moyenne, p50, p95, p99, max"""
+    if not samples_ms:
+        return {}
+    ordered = sorted(samples_ms)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": ordered[-1]
+    }
+
+
+def peak_rss_mb():
+    """Pic de mémoire résidente du processus depuis son démarrage (Mo)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss est en octets sous macOS, en kilo-octets sous Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+@contextlib.contextmanager
+def scenario(name, results, trace_memory=False):
+    """
+    Chronomètre un scénario et relève la mémoire : pic tracemalloc optionnel, hausse du pic RSS
+    pendant le scénario (0 s'il n'a pas dépassé le pic des scénarios précédents) et pic RSS
+    du processus depuis son démarrage
+    """
+    print(f"▶ {name}...")
+    entry = results.setdefault(name, {})
+    if trace_memory:
+        tracemalloc.start()
+    peak_before = peak_rss_mb()
+    started = time.perf_counter()
+    try:
+        # Les scripts du projet sont bavards : leur sortie est masquée pendant la mesure
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield entry
+    finally:
+        entry["elapsed_seconds"] = time.perf_counter() - started
+        if trace_memory:
+            entry["tracemalloc_peak_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            tracemalloc.stop()
+        entry["process_peak_rss_mb"] = peak_rss_mb()
+        entry["peak_rss_growth_mb"] = entry["process_peak_rss_mb"] - peak_before
+        print(f"  terminé en {entry['elapsed_seconds']:.2f}s")
+
+
+# --- Scénarios -------------------------------------------------------------------
+
+def bench_ingestion(system, days, batch_size, live_ticks, results, trace_memory):
+    with scenario("ingestion_bulk", results, trace_memory) as entry:
+        system.create_time_series()
+        stats = system.generate_historical_data_bulk(days_back=days, batch_size=batch_size)
+        entry.update({"points": stats["points"], "errors": stats["errors"],
+                      "points_per_second": stats["points_per_second"]})
+
+    with scenario("ingestion_live", results, trace_memory) as entry:
+        latencies = []
+        points = 0
+        for _ in range(live_ticks):
+            started = time.perf_counter()
+            points += system.generate_live_tick()
+            latencies.append((time.perf_counter() - started) * 1000)
+            # Timestamps distincts d'une itération à l'autre (politique de doublons BLOCK)
+            time.sleep(0.002)
+        entry.update({"points": points, "tick_latency_ms": percentiles(latencies)})
+
+
+def bench_queries(system, iterations, results, trace_memory):
+    import app
+
+    # Le tableau de bord interroge les shards simulés
+    app.r = next(iter(system.connections.values()))
+    app.shard_connections.clear()
+    app.shard_connections.update(system.connections)
+    app.pending_shards.clear()
+    app.shard_endpoints.clear()
+    app.shard_endpoints.update(system.read_endpoints)
+    app.shard_router = system.router
+    client = app.app.test_client()
+    rng = random.Random(42)
+
+    # Première requête hors mesure (imports paresseux, compilation des gabarits Flask)
+    client.post("/get_sensor_data", json={"location": system.locations[0], "sensor_type": system.sensor_types[0]})
+
+    # Cache de résultats vidé avant chaque requête mesurée sans cache, puis même requête rejouée
+    # avec le cache chaud : les deux latences sont rapportées séparément
+    with scenario("query_dashboard", results, trace_memory) as entry:
+        for time_range in QUERY_RANGES:
+            for response_format in ("plotly", "columnar"):
+                latencies = {"uncached": [], "cached": []}
+                for _ in range(iterations):
+                    payload = {"location": rng.choice(system.locations), "sensor_type": rng.choice(system.sensor_types),
+                               "time_range": time_range, "format": response_format}
+                    app.query_cache.invalidate()
+                    for state in ("uncached", "cached"):
+                        started = time.perf_counter()
+                        response = client.post("/get_sensor_data", json=payload)
+                        latencies[state].append((time.perf_counter() - started) * 1000)
+                        if response.status_code != 200 or response.get_json().get("status") != "success":
+                            entry.setdefault("errors", 0)
+                            entry["errors"] += 1
+                entry[f"{time_range}_{response_format}_ms"] = percentiles(latencies["uncached"])
+                entry[f"{time_range}_{response_format}_cached_ms"] = percentiles(latencies["cached"])
+
+    with scenario("query_scatter_gather", results, trace_memory) as entry:
+        now = datetime.now()
+        for time_range, delta in (("1h", timedelta(hours=1)), ("24h", timedelta(days=1))):
+            latencies = []
+            for _ in range(max(1, iterations // 5)):
+                started = time.perf_counter()
+                system.query_by_unit_measure("celsius", now - delta, now)
+                latencies.append((time.perf_counter() - started) * 1000)
+            entry[f"{time_range}_ms"] = percentiles(latencies)
+
+
+def bench_archive(system, days, influx_latency_ms, results, trace_memory):
+    import influxdb_archiver
+
+    fake = FakeInfluxWriteServer(latency_ms=influx_latency_ms).start()
+    try:
+        with scenario("archive", results, trace_memory) as entry:
+            archiver = influxdb_archiver.InfluxDBArchiver(token="benchmark", url=fake.url, write_mode="async")
+            try:
+                archiver.archive_redis_data(system, days_back=days, verify=False)
+            finally:
+                archiver.close()
+            stats = archiver.last_archive_stats or {}
+            entry.update({
+                "points": stats.get("points", 0),
+                "points_per_second": stats.get("points_per_second", 0.0),
+                "lines_received": fake.lines_received,
+                "requests": fake.requests,
+                "bytes_received": fake.bytes_received,
+                "write_latency_ms": stats.get("writer", {}).get("write_latency_ms")
+            })
+    finally:
+        fake.stop()
+
+
+def bench_failover(latency_ms, detection_seconds, election_seconds, write_interval_ms, results, trace_memory):
+    """
+    Bascule Sentinel simulée du shard salon pendant une génération en direct, avec et sans
+    tampon d'écriture : fenêtre d'indisponibilité en écriture et échantillons perdus
+    """
+    from sentinel_failover import DEFAULT_WRITE_BUFFER_SIZE
+
+    for label, buffer_size in (("buffered", DEFAULT_WRITE_BUFFER_SIZE), ("unbuffered", 0)):
+        with scenario(f"failover_{label}", results, trace_memory) as entry:
+            # Cas "unbuffered" : ni tampon mémoire ni spool disque, les écritures pendant la bascule sont perdues
+            system = create_stand_in_system(latency_ms=latency_ms, sentinel=True, write_buffer_size=buffer_size,
+                                            spool_dir="sharding_metadata/spool" if buffer_size else None)
+            system.create_time_series()
+            shard_keys = system.group_keys_by_shard(key for _, _, _, key in system.series_keys())["salon"]
+            ticks = 0
+            stop = threading.Event()
+
+            def write_loop():
+                nonlocal ticks
+                while not stop.is_set():
+                    system.generate_live_tick()
+                    ticks += 1
+                    time.sleep(write_interval_ms / 1000)
+
+            writer = threading.Thread(target=write_loop, daemon=True)
+            writer.start()
+            time.sleep(0.5)
+            system.stand_in_sentinel.failover(system.shards["salon"]["sentinel"]["master_name"],
+                                              detection_seconds, election_seconds).join()
+            # Laisser le rejeu se terminer puis écrire encore un peu sur le nouveau master
+            deadline = time.monotonic() + 10
+            while "salon" in system.failovers and time.monotonic() < deadline:
+                time.sleep(0.05)
+            time.sleep(0.5)
+            stop.set()
+            writer.join()
+
+            stored = sum(len(system.connections["salon"].execute_command("TS.RANGE", key, "-", "+"))
+                         for key in shard_keys)
+            history = [failover for failover in system.failover_history if failover["shard"] == "salon"]
+            attempted = ticks * len(shard_keys)
+            entry.update({
+                "samples_attempted": attempted,
+                "samples_stored": stored,
+                "samples_lost": attempted - stored,
+                "samples_replayed": sum(failover["replayed"] for failover in history),
+                "write_unavailable_seconds": history[-1]["window_seconds"] if history else None,
+                "replay_seconds": history[-1]["replay_seconds"] if history else None
+            })
+            for watcher in system.watchers.values():
+                watcher.stop()
+
+
+# --- Résultats -------------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def flatten(results, prefix=""):
+    """Aplatit les résultats en {chemin.métrique: valeur} pour la comparaison"""
+    flat = {}
+    for name, value in results.items():
+        path = f"{prefix}{name}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)):
+            flat[path] = value
+    return flat
+
+
+def compare(previous_path, current):
+    """Affiche l'évolution des débits, latences p95 et pics mémoire par rapport à une exécution précédente"""
+    with open(previous_path) as f:
+        previous = flatten(json.load(f)["results"])
+    current = flatten(current["results"])
+    print(f"\nComparaison avec {previous_path}:")
+    for path in sorted(current):
+        if path in previous and path.endswith(("points_per_second", ".p95", "peak_rss_growth_mb",
+                                               "tracemalloc_peak_mb", "samples_lost", "write_unavailable_seconds")):
+            before, after = previous[path], current[path]
+            change = (after - before) / before * 100 if before else 0.0
+            print(f"  {path}: {before:.2f} -> {after:.2f} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks d'ingestion, de requêtes et d'archivage sur shards simulés")
+    parser.add_argument("--days", type=float, default=7, help="Jours d'historique générés (par défaut: 7)")
+    parser.add_argument("--latency-ms", type=float, default=0.2, help="Latence simulée par aller-retour Redis")
+    parser.add_argument("--influx-latency-ms", type=float, default=2.0, help="Latence simulée des écritures InfluxDB")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Échantillons par TS.MADD")
+    parser.add_argument("--replicas", type=int, default=0, help="Réplicas simulés par shard servant les lectures")
+    parser.add_argument("--live-ticks", type=int, default=50, help="Itérations de génération en direct")
+    parser.add_argument("--queries", type=int, default=50, help="Requêtes par plage et par format")
+    parser.add_argument("--scenarios", type=str, default="ingestion,query,archive",
+                        help="Scénarios à exécuter (ingestion,query,archive,failover)")
+    parser.add_argument("--failover-detection-seconds", type=float, default=5.0,
+                        help="Délai de détection de la panne par Sentinel (down-after-milliseconds)")
+    parser.add_argument("--failover-election-seconds", type=float, default=1.0,
+                        help="Durée de l'élection et de la promotion du réplica")
+    parser.add_argument("--failover-write-interval-ms", type=float, default=20,
+                        help="Intervalle entre deux écritures de tous les capteurs pendant la bascule")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Mesurer le pic d'allocation Python par scénario (ralentit les mesures)")
+    parser.add_argument("--output-dir", type=str, default=RESULTS_DIR, help="Répertoire des résultats JSON")
+    parser.add_argument("--compare", type=str, help="Fichier de résultats précédent à comparer")
+    args = parser.parse_args()
+
+    scenarios = set(args.scenarios.split(","))
+    output_dir = os.path.abspath(args.output_dir)
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Les scripts écrivent dans sharding_metadata : exécution dans un répertoire temporaire
+    # pour ne pas toucher à la configuration ni aux points de reprise réels
+    work_dir = tempfile.mkdtemp(prefix="benchmark_")
+    os.chdir(work_dir)
+    os.makedirs("sharding_metadata", exist_ok=True)
+
+    run = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": vars(args),
+        "results": {}
+    }
+
+    if scenarios & {"ingestion", "query", "archive"}:
+        system = create_stand_in_system(latency_ms=args.latency_ms, replicas=args.replicas)
+        # Les requêtes et l'archivage ont besoin des données générées : sans le scénario
+        # d'ingestion, elles sont chargées hors mesure
+        if "ingestion" in scenarios:
+            bench_ingestion(system, args.days, args.batch_size, args.live_ticks, run["results"], args.trace_memory)
+        else:
+            with contextlib.redirect_stdout(io.StringIO()):
+                system.create_time_series()
+                system.generate_historical_data_bulk(days_back=args.days, batch_size=args.batch_size)
+        if "query" in scenarios:
+            bench_queries(system, args.queries, run["results"], args.trace_memory)
+        if "archive" in scenarios:
+            bench_archive(system, args.days, args.influx_latency_ms, run["results"], args.trace_memory)
+    if "failover" in scenarios:
+        bench_failover(args.latency_ms, args.failover_detection_seconds, args.failover_election_seconds,
+                       args.failover_write_interval_ms, run["results"], args.trace_memory)
+
+    path = os.path.join(output_dir, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump(run, f, indent=2)
+    print(f"\nRésultats sauvegardés: {path}")
+
+    for name, entry in run["results"].items():
+        if "points_per_second" in entry:
+            print(f"  {name}: {entry['points_per_second']:.0f} points/s")
+        if "samples_lost" in entry:
+            print(f"  {name}: écritures indisponibles {entry['write_unavailable_seconds'] or 0:.2f}s, "
+                  f"{entry['samples_lost']}/{entry['samples_attempted']} échantillons perdus")
+    if compare_path:
+        compare(compare_path, run)
+
+
+if __name__ == "__main__":
+    main()
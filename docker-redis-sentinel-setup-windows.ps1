@@ -7,8 +7,9 @@ docker network rm redis-net 2>$null
 # Supprimer les anciens volumes
 docker volume ls -q --filter "name=redis-*" | ForEach-Object { docker volume rm $_ }
 
-# Créer un réseau Docker
-docker network create redis-net
+# Créer un réseau Docker avec un sous-réseau fixe : les adresses des conteneurs, annoncées
+# par les Sentinels, correspondent à l'address_map de la configuration des shards (ShardingLayout)
+docker network create --subnet 172.28.0.0/16 redis-net
 
 # Liste des emplacements
 $locations = @("salon", "chambre1", "chambre2", "cuisine", "salle-de-bain")
@@ -17,6 +18,9 @@ $locations = @("salon", "chambre1", "chambre2", "cuisine", "salle-de-bain")
 $baseRedisPort = 6379
 $baseSentinelPort = 26379
 
+# Adresses fixes : master en 172.28.0.10, 12, 14..., réplica à l'adresse suivante
+$baseIP = 10
+
 # Dictionnaire pour stocker les IPs des masters
 $masterIPs = @{}
 
@@ -29,8 +33,12 @@ foreach ($loc in $locations) {
     $redisPortReplica = $baseRedisPort
     $baseRedisPort++
 
+    $masterIP = "172.28.0.$baseIP"
+    $replicaIP = "172.28.0.$($baseIP + 1)"
+    $baseIP += 2
+
     # --- Maître ---
-    docker run -d --name "redis-$loc-master" --network redis-net -p "${redisPortMaster}:6379" `
+    docker run -d --name "redis-$loc-master" --network redis-net --ip $masterIP -p "${redisPortMaster}:6379" `
         -v "redis-$loc-master-data:/data" `
         -e "REDIS_ARGS=--requirepass strongpassword --masterauth strongpassword --appendonly yes" `
         redis/redis-stack
@@ -38,13 +46,12 @@ foreach ($loc in $locations) {
     # Attendre que le conteneur soit prêt
     Start-Sleep -Seconds 3
 
-    # Récupérer l'adresse IP du master
-    $masterIP = docker inspect -f '{{range.NetworkSettings.Networks}}{{.IPAddress}}{{end}}' "redis-$loc-master"
+    # Adresse IP du master, surveillée par les Sentinels
     $masterIPs[$loc] = $masterIP
     Write-Host "Master $loc IP: $masterIP"
 
     # --- Réplica ---
-    docker run -d --name "redis-$loc-replica" --network redis-net -p "${redisPortReplica}:6379" `
+    docker run -d --name "redis-$loc-replica" --network redis-net --ip $replicaIP -p "${redisPortReplica}:6379" `
         -v "redis-$loc-replica-data:/data" `
         -e "REDIS_ARGS=--requirepass strongpassword --masterauth strongpassword --appendonly yes --replicaof redis-$loc-master 6379" `
         redis/redis-stack
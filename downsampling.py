@@ -0,0 +1,69 @@
+import math
+
+# Tailles de bucket "lisibles" (en ms) parmi lesquelles choisir l'agrégation
+BUCKET_SIZES_MS = [
+    1000, 5000, 10_000, 30_000,
+    60_000, 5 * 60_000, 10 * 60_000, 15 * 60_000, 30 * 60_000,
+    3600_000, 2 * 3600_000, 3 * 3600_000, 6 * 3600_000, 12 * 3600_000,
+    24 * 3600_000, 7 * 24 * 3600_000,
+]
+
+AGGREGATIONS = ("avg", "min", "max")
+
+# Nombre de points visé par graphique
+DEFAULT_MAX_POINTS = 1000
+
+
+def choose_bucket_ms(start_ms, end_ms, max_points=DEFAULT_MAX_POINTS):
+    """
+    Choisit la plus petite taille de bucket qui garde au plus max_points points
+    sur la plage [start_ms, end_ms]
+    """
+    span = max(1, end_ms - start_ms)
+    minimum = math.ceil(span / max(1, max_points))
+    for bucket in BUCKET_SIZES_MS:
+        if bucket >= minimum:
+            return bucket
+    return minimum
+
+
+def lttb(points, threshold):
+    """
+    Décimation Largest-Triangle-Three-Buckets : conserve threshold points
+    en préservant la forme visuelle de la courbe (pics et creux).
+    points est une liste de (timestamp, valeur) triée par timestamp.
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Moyenne du bucket suivant (troisième sommet du triangle)
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_count = avg_end - avg_start
+        avg_x = sum(points[j][0] for j in range(avg_start, avg_end)) / avg_count
+        avg_y = sum(points[j][1] for j in range(avg_start, avg_end)) / avg_count
+
+        # Point du bucket courant formant le plus grand triangle avec a et la moyenne
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        point_ax, point_ay = points[a]
+        max_area = -1.0
+        next_a = range_start
+        for j in range(range_start, range_end):
+            area = abs((point_ax - avg_x) * (points[j][1] - point_ay)
+                       - (point_ax - points[j][0]) * (avg_y - point_ay))
+            if area > max_area:
+                max_area = area
+                next_a = j
+
+        sampled.append(points[next_a])
+        a = next_a
+
+    sampled.append(points[-1])
+    return sampled
@@ -4,17 +4,44 @@ import random
 from datetime import datetime, timedelta
 import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 
+from metrics import FAILOVER_SAMPLES, FAILOVER_WINDOW, REDIS_SAMPLES_WRITTEN, export_metrics, track_redis
+from replica_routing import DEFAULT_MAX_LAG_BYTES, endpoints_from_config
+from rollups import RAW_RETENTION_MS, create_rollups, fetch_planned_ranges, plan_query
+from sentinel_failover import (DEFAULT_WRITE_BUFFER_SIZE, SentinelWatcher, WriteBuffer, is_failover_error,
+                               sentinel_from_config)
+from series_index import SeriesIndex
+from series_info_cache import parse_ts_info
+from shard_router import location_of_key, router_from_config
+from write_spool import DEFAULT_REPLAY_RATE, DEFAULT_SPOOL_MAX_BYTES, SPOOL_DIR, ShardSpool, SpoolReplayer
 
-class RedisTrueShardingSystem:
-    def __init__(self):
+SHARDING_CONFIG_PATH = "sharding_metadata/true_sharding_config.json"
+
+
+def load_sharding_config(path=SHARDING_CONFIG_PATH):
+    """Charge la configuration de true sharding (None si elle n'existe pas)"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class ShardingLayout:
+    """Configuration du true sharding et routage clé -> shard, commune aux clients sync et async"""
+
+    def __init__(self, router=None):
         # Configuration pour le true sharding - une instance Redis par emplacement
         self.locations = ["salon", "chambre1", "chambre2", "cuisine", "salle_de_bain"]
 
         # Mot de passe pour l'authentification Redis
         self.redis_password = "strongpassword"
 
-        # Configuration des shards - uniquement les masters pour éviter les erreurs "read only replica"
+        # Configuration des shards : les écritures vont au master (découvert via Sentinel,
+        # sinon l'adresse statique), les lectures aux réplicas (voir replica_routing)
         self.shards = {
             "salon": {"host": "localhost", "port": 6379, "container": "redis-salon-master"},
             "chambre1": {"host": "localhost", "port": 6381, "container": "redis-chambre1-master"},
@@ -22,6 +49,27 @@ class RedisTrueShardingSystem:
             "cuisine": {"host": "localhost", "port": 6385, "container": "redis-cuisine-master"},
             "salle_de_bain": {"host": "localhost", "port": 6387, "container": "redis-salle-de-bain-master"}
         }
+        # Réplica et Sentinels de chaque shard (docker-redis-sentinel-setup-windows.ps1) :
+        # réplica sur le port suivant celui du master, trois Sentinels par emplacement.
+        # Les Sentinels annoncent les adresses du réseau Docker (172.28.0.10, 11, 12...),
+        # traduites vers les ports publiés sur l'hôte par address_map
+        sentinel_names = {"salle_de_bain": "sdb-master"}
+        for index, (location, config) in enumerate(self.shards.items()):
+            config["replicas"] = [{"host": "localhost", "port": config["port"] + 1,
+                                   "container": config["container"].replace("-master", "-replica")}]
+            config["sentinel"] = {
+                "master_name": sentinel_names.get(location, f"{location}-master"),
+                "sentinels": [["localhost", 26379 + 3 * index + i] for i in range(3)]
+            }
+            config["address_map"] = {
+                f"172.28.0.{10 + 2 * index}:6379": f"localhost:{config['port']}",
+                f"172.28.0.{11 + 2 * index}:6379": f"localhost:{config['port'] + 1}"
+            }
+
+        # Lectures : stratégie de choix du réplica et retard de réplication toléré (octets d'offset)
+        self.read_strategy = os.environ.get("REDIS_READ_STRATEGY", "least_latency")
+        self.max_replica_lag_bytes = int(os.environ.get("REDIS_MAX_REPLICA_LAG_BYTES", DEFAULT_MAX_LAG_BYTES))
+        self.read_endpoints = {}
 
         # Paramètres de simulation
         self.sensor_types = ["temperature", "humidity", "air_quality"]
@@ -34,92 +82,301 @@ class RedisTrueShardingSystem:
             "air_quality": "aqi"
         }
 
-        # Connexion aux instances Redis
+        # Connexions par shard, ouvertes par les sous-classes
         self.connections = {}
-        for location, config in self.shards.items():
-            try:
-                # Utilisation explicite de l'option decode_responses pour éviter les problèmes de bytes vs string
-                self.connections[location] = redis.Redis(
-                    host=config["host"],
-                    port=config["port"],
-                    password=self.redis_password,
-                    decode_responses=True
-                )
-                # Vérification que le serveur répond et n'est pas en lecture seule
-                if not self.connections[location].ping():
-                    raise Exception("Le serveur ne répond pas au ping")
 
-                # Vérifier si le serveur est en lecture seule
-                if self.connections[location].info("replication").get("role") == "slave":
-                    raise Exception("Ce serveur est un réplica en lecture seule")
+        # Routeur clé -> shard : celui fourni, sinon celui de la configuration sauvegardée
+        # (par défaut : un shard par emplacement)
+        config = load_sharding_config() or {}
+        self.router = router or router_from_config(config.get("router"), list(self.shards))
+
+        # Séries en cours de migration (clé -> shard cible) : les écritures sont doublées
+        # vers le shard cible jusqu'à la bascule du routage
+        self.migrating = {}
+        self._apply_migration(config.get("migration"))
+        self.routing_mtime = self._config_mtime()
+
+    def get_connection_for_location(self, location):
+        """Récupère la connexion Redis pour une localisation (ou un shard) spécifique"""
+        if location in self.connections:
+            return self.connections[location]
+        else:
+            raise ValueError(f"Location '{location}' non prise en charge ou connexion non disponible")
+
+    def shard_for_key(self, key):
+        """Nom du shard qui héberge une série selon le routeur"""
+        return self.router.route(key)
+
+    def get_connection_for_key(self, key):
+        """Récupère la connexion Redis du shard qui héberge une série"""
+        return self.get_connection_for_location(self.shard_for_key(key))
 
-                print(f"Connecté au shard {location}: {config['host']}:{config['port']} ({config['container']})")
+    def read_from_shard(self, location, func):
+        """
+        Exécute une lecture func(connexion) sur un réplica du shard s'il y en a un assez à jour,
+        sinon (ou en cas d'échec du réplica) sur le master
+        """
+        endpoints = self.read_endpoints.get(location)
+        if endpoints is None:
+            return func(self.get_connection_for_location(location))
+        return endpoints.execute_read(func)
+
+    def series_keys(self, locations=None, sensor_types=None):
+        """Énumère (emplacement, type, id, clé) pour toutes les séries connues"""
+        for location in locations or self.locations:
+            for sensor_type in sensor_types or self.sensor_types:
+                for sensor_id in range(1, self.num_sensors + 1):
+                    yield location, sensor_type, sensor_id, f"sensor:{sensor_type}:{location}:{sensor_id}"
+
+    def write_shards_for_key(self, key):
+        """Shards qui reçoivent les écritures d'une série (deux pendant une migration)"""
+        shard = self.shard_for_key(key)
+        target = self.migrating.get(key)
+        return [shard, target] if target and target != shard else [shard]
+
+    @staticmethod
+    def _config_mtime():
+        try:
+            return os.stat(SHARDING_CONFIG_PATH).st_mtime_ns
+        except OSError:
+            return None
+
+    def _apply_migration(self, migration):
+        self.migrating = {key: shards[1] for key, shards in (migration or {}).get("moves", {}).items()}
+
+    def reload_routing(self):
+        """
+        Relit le routage et les migrations en cours si la configuration a changé
+        (bascule lancée par l'outil d'administration pendant l'ingestion)
+        """
+        mtime = self._config_mtime()
+        if mtime is None or mtime == self.routing_mtime:
+            return False
+        config = load_sharding_config()
+        if config is None:
+            return False
+        self.routing_mtime = mtime
+        self.router = router_from_config(config.get("router"), list(self.shards))
+        self._apply_migration(config.get("migration"))
+        return True
+
+    def group_keys_by_shard(self, keys):
+        """Regroupe des clés par shard connecté (les clés des shards indisponibles sont ignorées)"""
+        keys_by_shard = {}
+        for key in keys:
+            shard = self.shard_for_key(key)
+            if shard in self.connections:
+                keys_by_shard.setdefault(shard, []).append(key)
+        return keys_by_shard
+
+    def _range_reply_or_error(self, location, key, replies_by_location, report):
+        """Renvoie les données d'une clé ou un message d'erreur (shard lent, en échec...)"""
+        if location in replies_by_location:
+            data = replies_by_location[location].get(key)
+            if isinstance(data, Exception):
+                return f"Erreur: {data}"
+            return data
+        if location in report["timed_out"]:
+            return "Erreur: délai dépassé pour ce shard"
+        return f"Erreur: {report['failed'].get(location, 'shard indisponible')}"
+
+
+class RedisTrueShardingSystem(ShardingLayout):
+    def __init__(self, connections=None, info_cache=None, series_index=None, router=None, sentinels=None,
+                 connect=None, write_buffer_size=DEFAULT_WRITE_BUFFER_SIZE, spool_dir=SPOOL_DIR,
+                 spool_max_bytes=DEFAULT_SPOOL_MAX_BYTES, replay_rate=DEFAULT_REPLAY_RATE):
+        super().__init__(router)
+
+        # Délai maximal (en secondes) accordé à chaque shard lors des requêtes parallèles
+        self.query_timeout = 5.0
+        self.last_query_report = None
+
+        # Cache optionnel des métadonnées de séries (TS.INFO), tenu à jour lors des écritures
+        self.info_cache = info_cache
+
+        # Index local optionnel des séries (clés et labels), tenu à jour à la création des séries
+        self.series_index = series_index
+
+        # Connexion aux instances Redis (ou utilisation de connexions fournies, ex: shards simulés)
+        self.connections = dict(connections) if connections is not None else {}
+        if connections is None:
+            for location, config in self.shards.items():
+                try:
+                    # Master découvert via Sentinel (adresse statique à défaut) et réplicas pour les lectures
+                    endpoints = endpoints_from_config(location, config, self.redis_password,
+                                                      self.read_strategy, self.max_replica_lag_bytes)
+                    self.connections[location] = endpoints.master
+                    # Vérification que le serveur répond et n'est pas en lecture seule
+                    if not self.connections[location].ping():
+                        raise Exception("Le serveur ne répond pas au ping")
+
+                    # Vérifier si le serveur est en lecture seule
+                    if self.connections[location].info("replication").get("role") == "slave":
+                        raise Exception("Ce serveur est un réplica en lecture seule")
+
+                    self.read_endpoints[location] = endpoints
+                    master_address = endpoints.master.connection_pool.connection_kwargs
+                    print(f"Connecté au shard {location}: {master_address['host']}:{master_address['port']} "
+                          f"({config['container']}, {len(endpoints.replicas)} réplica(s) pour les lectures)")
+                except Exception as e:
+                    print(f"Erreur de connexion au shard {location}: {e}")
+                    # Si la connexion échoue, retirer ce shard de la liste des connexions
+                    if location in self.connections:
+                        del self.connections[location]
+
+        # Bascule Sentinel : adresse des masters en cache, abonnement aux événements de bascule
+        # et tampon borné des écritures pendant l'élection d'un nouveau master
+        self.connect = connect or (lambda host, port: redis.Redis(
+            host=host, port=port, password=self.redis_password, decode_responses=True, socket_timeout=5))
+        self.failover_lock = threading.Lock()
+        self.failovers = {}
+        self.failover_history = []
+        # Au-delà du tampon mémoire, les écritures différées passent dans le spool disque du shard
+        self.write_buffers = {location: WriteBuffer(location, write_buffer_size,
+                                                    lambda samples, shard=location: self._spool_samples(shard, samples))
+                              for location in self.shards}
+        self.master_addresses = {}
+        self.watchers = {}
+        if sentinels is None and connections is None:
+            sentinels = {location: sentinel_from_config(config)
+                         for location, config in self.shards.items() if config.get("sentinel")}
+        for location, sentinel in (sentinels or {}).items():
+            watcher = SentinelWatcher(location, self.shards[location]["sentinel"]["master_name"], sentinel,
+                                      self._begin_failover, self._switch_master,
+                                      self.shards[location].get("address_map"))
+            try:
+                self.master_addresses[location] = watcher.discover()
             except Exception as e:
-                print(f"Erreur de connexion au shard {location}: {e}")
-                # Si la connexion échoue, retirer ce shard de la liste des connexions
-                if location in self.connections:
-                    del self.connections[location]
+                print(f"⚠️ Sentinels de {location} injoignables ({e}), suivi des bascules en attente")
+            self.watchers[location] = watcher.start()
+
+        # Spools disque (un fichier par shard) des écritures différées, rejoués en arrière-plan
+        # à débit limité ; les spools laissés par une exécution précédente sont repris
+        self.spool_dir = spool_dir
+        self.spool_max_bytes = spool_max_bytes
+        self.spools = {}
+        self.spool_lock = threading.Lock()
+        self.spool_replayer = SpoolReplayer(self, replay_rate)
+        if spool_dir and os.path.isdir(spool_dir):
+            for location in self.shards:
+                if os.path.exists(self._spool_path(location)) and len(self._spool(location)):
+                    print(f"📼 Spool de {location}: {len(self.spools[location])} échantillon(s) à rejouer")
+                    self.spool_replayer.notify()
 
         # Création d'un répertoire pour stocker la configuration et les méta-données
         os.makedirs("sharding_metadata", exist_ok=True)
 
-        # Sauvegarder la configuration du sharding
-        self.save_sharding_config()
+        # Sauvegarder la configuration du sharding (en conservant une migration en cours)
+        self.save_sharding_config((load_sharding_config() or {}).get("migration"))
 
-    def save_sharding_config(self):
-        """Sauvegarde la configuration de sharding dans un fichier JSON"""
+    def save_sharding_config(self, migration=None):
+        """
+        Sauvegarde la configuration de sharding dans un fichier JSON (écriture atomique :
+        les autres processus voient l'ancien ou le nouveau routage, jamais un fichier partiel)
+        """
         config = {
             "shards": {loc: {k: v for k, v in cfg.items() if k != "password"}
                        for loc, cfg in self.shards.items()},  # Ne pas inclure le mot de passe
             "locations": self.locations,
             "sensor_types": self.sensor_types,
-            "unit_measures": self.unit_measures
+            "unit_measures": self.unit_measures,
+            "router": self.router.describe()
         }
-        with open("sharding_metadata/true_sharding_config.json", "w") as f:
+        if migration:
+            config["migration"] = migration
+        tmp_path = f"{SHARDING_CONFIG_PATH}.tmp"
+        with open(tmp_path, "w") as f:
             json.dump(config, f, indent=2)
+        os.replace(tmp_path, SHARDING_CONFIG_PATH)
+        self._apply_migration(migration)
+        self.routing_mtime = self._config_mtime()
         print("Configuration de true sharding sauvegardée")
 
-    def get_connection_for_location(self, location):
-        """Récupère la connexion Redis pour une localisation spécifique"""
-        if location in self.connections:
-            return self.connections[location]
-        else:
-            raise ValueError(f"Location '{location}' non prise en charge ou connexion non disponible")
+    def _record_write(self, key, timestamp_ms, count=1):
+        """Signale une écriture au cache de métadonnées (s'il est configuré)"""
+        if self.info_cache is not None:
+            self.info_cache.record_write(key, timestamp_ms, count)
+
+    def _invalidate_series(self, key):
+        """Invalide les métadonnées en cache d'une série (s'il y a un cache)"""
+        if self.info_cache is not None:
+            self.info_cache.invalidate(key)
+
+    def _index_series(self, location, key, labels):
+        """Ajoute une série à l'index local (s'il est configuré)"""
+        if self.series_index is not None:
+            self.series_index.add(location, key, labels)
 
     def create_time_series(self):
-        """Crée les séries temporelles pour chaque capteur dans son shard dédié"""
-        # Utiliser uniquement les emplacements pour lesquels nous avons une connexion valide
-        for location in list(self.connections.keys()):
-            conn = self.get_connection_for_location(location)
-            for sensor_type in self.sensor_types:
-                unit_measure = self.unit_measures[sensor_type]
-                for sensor_id in range(1, self.num_sensors + 1):
-                    key = f"sensor:{sensor_type}:{location}:{sensor_id}"
-                    try:
-                        # Vérifier si la série existe déjà
-                        conn.execute_command("TS.INFO", key)
-                        print(f"La série temporelle existe déjà : {key} dans le shard {location}")
-                    except redis.exceptions.ResponseError as e:
-                        # Si l'erreur n'est pas due à l'absence de la clé, propager l'erreur
-                        if not str(e).startswith("TSDB: key does not exist"):
-                            print(f"Erreur lors de la vérification de la série {key}: {e}")
-                            continue
-
-                        try:
-                            # Créer la série temporelle avec une rétention de 30 jours
-                            retention = 30 * 24 * 60 * 60 * 1000  # 30 jours en millisecondes
-                            conn.execute_command(
-                                "TS.CREATE", key,
-                                "RETENTION", retention,
-                                "LABELS",
-                                "sensorId", str(sensor_id),
-                                "type", sensor_type,
-                                "location", location,
-                                "unit_measure", unit_measure
-                            )
-                            print(f"Série temporelle créée : {key} (unité: {unit_measure}) dans le shard {location}")
-                        except Exception as create_error:
-                            print(f"Erreur lors de la création de la série {key}: {create_error}")
+        """
+        Crée les séries temporelles pour chaque capteur dans le shard choisi par le routeur,
+        avec leurs paliers agrégés (1m, 1h, 1d en avg/min/max) et les règles de compaction
+        """
+        for location, sensor_type, sensor_id, key in self.series_keys():
+            shard = self.shard_for_key(key)
+            # Utiliser uniquement les shards pour lesquels nous avons une connexion valide
+            if shard not in self.connections:
+                continue
+            self._create_series(self.get_connection_for_location(shard), shard, location, sensor_type, sensor_id, key)
+
+        if self.series_index is not None:
+            self.series_index.save()
+
+    def create_shard_series(self, shard, conn=None):
+        """Crée les séries d'un shard (ex: injoignable lors de create_time_series), sur conn si fournie"""
+        conn = conn or self.get_connection_for_location(shard)
+        for location, sensor_type, sensor_id, key in self.series_keys():
+            if self.shard_for_key(key) == shard:
+                self._create_series(conn, shard, location, sensor_type, sensor_id, key)
+        if self.series_index is not None:
+            self.series_index.save()
+
+    def _create_series(self, conn, shard, location, sensor_type, sensor_id, key):
+        """Crée une série et ses paliers agrégés, ou complète les paliers d'une série existante"""
+        unit_measure = self.unit_measures[sensor_type]
+        labels = {"sensorId": str(sensor_id), "type": sensor_type,
+                  "location": location, "unit_measure": unit_measure}
+        try:
+            # Vérifier si la série existe déjà
+            conn.execute_command("TS.INFO", key)
+            print(f"La série temporelle existe déjà : {key} dans le shard {shard}")
+            self._index_series(shard, key, labels)
+            # Séries créées avant les paliers agrégés : ajouter les règles manquantes
+            self._ensure_rollups(conn, key, shard)
+        except redis.exceptions.ResponseError as e:
+            # Si l'erreur n'est pas due à l'absence de la clé, propager l'erreur
+            if not str(e).startswith("TSDB: key does not exist"):
+                print(f"Erreur lors de la vérification de la série {key}: {e}")
+                return
+
+            try:
+                # Créer la série temporelle avec une rétention de 30 jours
+                conn.execute_command(
+                    "TS.CREATE", key,
+                    "RETENTION", RAW_RETENTION_MS,
+                    "LABELS",
+                    "sensorId", str(sensor_id),
+                    "type", sensor_type,
+                    "location", location,
+                    "unit_measure", unit_measure
+                )
+                print(f"Série temporelle créée : {key} (unité: {unit_measure}) dans le shard {shard}")
+                self._invalidate_series(key)
+                self._index_series(shard, key, labels)
+            except Exception as create_error:
+                print(f"Erreur lors de la création de la série {key}: {create_error}")
+                return
+            self._ensure_rollups(conn, key, shard)
+
+    @staticmethod
+    def _ensure_rollups(conn, key, shard):
+        """Crée les paliers agrégés d'une série s'ils n'existent pas encore"""
+        try:
+            created = create_rollups(conn, key, backfill=True)
+            if created:
+                print(f"  {created} règles de compaction créées pour {key} dans le shard {shard}")
+        except Exception as e:
+            print(f"Erreur lors de la création des paliers agrégés de {key}: {e}")
 
     def generate_sensor_value(self, sensor_type):
         """Génération de valeurs réalistes selon le type de capteur"""
@@ -144,20 +401,24 @@ class RedisTrueShardingSystem:
         with open("sharding_metadata/historical_data_log.txt", "w") as log_file:
             while current_time <= end_time:
                 timestamp_ms = int(current_time.timestamp() * 1000)
-
-                for location in list(self.connections.keys()):
-                    conn = self.get_connection_for_location(location)
-                    for sensor_type in self.sensor_types:
-                        for sensor_id in range(1, self.num_sensors + 1):
-                            key = f"sensor:{sensor_type}:{location}:{sensor_id}"
-                            value = self.generate_sensor_value(sensor_type)
-                            try:
-                                conn.execute_command("TS.ADD", key, timestamp_ms, value)
-                                total_points += 1
-                            except Exception as e:
-                                log_message = f"Erreur d'ajout pour {key} à {current_time}: {e}"
-                                print(log_message)
-                                log_file.write(log_message + "\n")
+                unreachable = {}
+
+                for location, sensor_type, sensor_id, key in self.series_keys():
+                    value = self.generate_sensor_value(sensor_type)
+                    if self.shard_for_key(key) not in self.connections:
+                        # Shard injoignable : l'échantillon attend dans le spool disque
+                        unreachable.setdefault(self.shard_for_key(key), []).append((key, timestamp_ms, value))
+                        continue
+                    try:
+                        self._add_sample(key, timestamp_ms, value)
+                        total_points += 1
+                        self._record_write(key, timestamp_ms)
+                    except Exception as e:
+                        log_message = f"Erreur d'ajout pour {key} à {current_time}: {e}"
+                        print(log_message)
+                        log_file.write(log_message + "\n")
+                for shard, samples in unreachable.items():
+                    self._spool_samples(shard, samples)
 
                 current_time += interval
                 # Afficher et logger la progression
@@ -169,58 +430,491 @@ class RedisTrueShardingSystem:
 
         print(f"Génération historique terminée - {total_points} points de données générés")
 
+    def generate_historical_data_bulk(self, days_back=7, batch_size=1000, pipeline_depth=8):
+        """
+        Génère des données historiques en masse : les échantillons sont regroupés
+        par shard en lots TS.MADD envoyés via des pipelines Redis, et tous les
+        shards sont remplis en parallèle.
+        """
+        end_time = datetime.now()
+        start_time = end_time - timedelta(days=days_back)
+
+        # Intervalle de 5 minutes
+        interval_ms = 5 * 60 * 1000
+        start_ms = int(start_time.timestamp() * 1000)
+        end_ms = int(end_time.timestamp() * 1000)
+        timestamps = range(start_ms, end_ms + 1, interval_ms)
+
+        # Séries regroupées par shard selon le routeur
+        keys_by_shard = self.group_keys_by_shard(key for _, _, _, key in self.series_keys())
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, len(keys_by_shard))) as executor:
+            shard_results = dict(zip(keys_by_shard, executor.map(
+                lambda shard: self._ingest_shard_bulk(shard, keys_by_shard[shard], timestamps,
+                                                      batch_size, pipeline_depth), keys_by_shard)))
+        elapsed = time.perf_counter() - started
+
+        total_points = sum(result["points"] for result in shard_results.values())
+        total_errors = sum(result["errors"] for result in shard_results.values())
+        points_per_second = total_points / elapsed if elapsed > 0 else 0.0
+
+        # Fichier de log pour le suivi
+        with open("sharding_metadata/historical_data_log.txt", "w") as log_file:
+            for location, result in shard_results.items():
+                log_message = (f"Shard {location}: {result['points']} points, {result['errors']} erreurs, "
+                               f"{result['round_trips']} allers-retours")
+                print(log_message)
+                log_file.write(log_message + "\n")
+                for error in result["error_samples"]:
+                    log_file.write(error + "\n")
+
+        print(f"Génération historique (bulk) terminée - {total_points} points de données générés "
+              f"en {elapsed:.2f}s ({points_per_second:.0f} points/s, {total_errors} erreurs)")
+
+        return {
+            "points": total_points,
+            "errors": total_errors,
+            "elapsed_seconds": elapsed,
+            "points_per_second": points_per_second,
+            "shards": shard_results
+        }
+
+    def _ingest_shard_bulk(self, location, shard_keys, timestamps, batch_size, pipeline_depth):
+        """Remplit un shard avec des valeurs simulées pour chaque timestamp"""
+        # Le type de capteur est le deuxième segment de la clé sensor:<type>:<emplacement>:<id>
+        keys = [(key, key.split(":")[1]) for key in shard_keys]
+        samples = ((key, timestamp_ms, self.generate_sensor_value(sensor_type))
+                   for timestamp_ms in timestamps for key, sensor_type in keys)
+        result = self._write_with_migration(location, samples, batch_size, pipeline_depth)
+
+        # Les métadonnées en cache de ce shard ne sont plus à jour
+        for key, _ in keys:
+            self._invalidate_series(key)
+        return result
+
+    def _write_with_migration(self, location, samples, batch_size, pipeline_depth):
+        """
+        _write_shard_samples, puis écriture sur le shard cible des échantillons des séries en migration
+        (comme _add_sample), pour que rien ne soit perdu entre la copie et la bascule.
+        Le rejeu d'un tampon de bascule ne passe pas ici : la copie a déjà été écrite à l'origine.
+        """
+        if not self.migrating:
+            return self._write_shard_samples(location, samples, batch_size, pipeline_depth)
+        copies = {}
+
+        def mirrored():
+            for sample in samples:
+                for target in self.write_shards_for_key(sample[0])[1:]:
+                    copies.setdefault(target, []).append(sample)
+                yield sample
+
+        result = self._write_shard_samples(location, mirrored(), batch_size, pipeline_depth)
+        for target, target_samples in copies.items():
+            if target not in self.connections:
+                continue
+            copy = self._write_shard_samples(target, target_samples, batch_size, pipeline_depth)
+            result["errors"] += copy["errors"]
+            result["round_trips"] += copy["round_trips"]
+            result["error_samples"].extend(copy["error_samples"])
+        return result
+
+    def _write_shard_samples(self, location, samples, batch_size, pipeline_depth, replaying=False):
+        """
+        Écrit des échantillons (clé, timestamp, valeur) sur un shard en lots TS.MADD envoyés par pipeline.
+        Pendant une bascule du master, les lots sont mis en tampon puis rejoués sur le nouveau master.
+        """
+        result = {"points": 0, "errors": 0, "round_trips": 0, "buffered": 0, "error_samples": []}
+        batches = []
+
+        def defer(pending, reason=None):
+            deferred = [tuple(args[i:i + 3]) for args in pending for i in range(0, len(args), 3)]
+            if self._defer_writes(location, deferred, reason):
+                result["buffered"] += len(deferred)
+                return True
+            return False
+
+        def flush():
+            pending = list(batches)
+            batches.clear()
+            # Bascule en cours : inutile d'attendre l'échec de l'ancien master
+            if not replaying and location in self.failovers and defer(pending):
+                return
+            # Connexion relue à chaque envoi : le master peut avoir changé depuis le lot précédent
+            pipe = self.get_connection_for_location(location).pipeline(transaction=False)
+            for args in pending:
+                pipe.execute_command("TS.MADD", *args)
+            try:
+                with track_redis(location, "TS.MADD"):
+                    replies = pipe.execute(raise_on_error=False)
+            except Exception as e:
+                if is_failover_error(e):
+                    defer(pending, f"{type(e).__name__}: {e}")
+                    return
+                result["errors"] += 1
+                result["error_samples"].append(f"Erreur de pipeline sur {location}: {e}")
+                return
+            result["round_trips"] += 1
+            points_before = result["points"]
+            for args, reply in zip(pending, replies):
+                if isinstance(reply, Exception) and is_failover_error(reply):
+                    # Master rétrogradé en réplica (READONLY) : le lot attend le nouveau master
+                    defer([args], str(reply))
+                    continue
+                if isinstance(reply, Exception):
+                    result["errors"] += 1
+                    if len(result["error_samples"]) < 10:
+                        result["error_samples"].append(f"Erreur TS.MADD sur {location}: {reply}")
+                    continue
+                for item in reply:
+                    if isinstance(item, Exception):
+                        result["errors"] += 1
+                        if len(result["error_samples"]) < 10:
+                            result["error_samples"].append(f"Erreur d'ajout sur {location}: {item}")
+                    else:
+                        result["points"] += 1
+            REDIS_SAMPLES_WRITTEN.labels(shard=location).inc(result["points"] - points_before)
+
+        args = []
+        for sample in samples:
+            args.extend(sample)
+            if len(args) >= batch_size * 3:
+                batches.append(args)
+                args = []
+                if len(batches) >= pipeline_depth:
+                    flush()
+
+        if args:
+            batches.append(args)
+        if batches:
+            flush()
+        return result
+
+    def ingest_samples(self, samples_by_shard, batch_size=1000, pipeline_depth=8):
+        """
+        Chemin d'ingestion par lots pour des échantillons déjà produits (générateur de charge...) :
+        {shard: itérable de (clé, timestamp, valeur)}, tous les shards écrits en parallèle.
+        Le cache de métadonnées n'est pas mis à jour.
+        """
+        shards = [shard for shard in samples_by_shard if shard in self.connections]
+        with ThreadPoolExecutor(max_workers=max(1, len(shards))) as executor:
+            futures = {shard: executor.submit(self._write_with_migration, shard, samples_by_shard[shard],
+                                              batch_size, pipeline_depth)
+                       for shard in shards}
+        results = {}
+        for shard, future in futures.items():
+            try:
+                results[shard] = future.result()
+            except Exception as e:
+                results[shard] = {"points": 0, "errors": 1, "round_trips": 0, "buffered": 0,
+                                  "error_samples": [str(e)]}
+        return results
+
+    def _add_sample(self, key, timestamp_ms, value):
+        """
+        TS.ADD sur le shard de la série, doublé vers le shard cible si elle est en migration.
+        Si le master est en cours de bascule, l'échantillon est mis en tampon.
+        """
+        shards = self.write_shards_for_key(key)
+        sample = [(key, timestamp_ms, value)]
+        if shards[0] in self.failovers and self._defer_writes(shards[0], sample):
+            return
+        try:
+            with track_redis(shards[0], "TS.ADD"):
+                self.get_connection_for_location(shards[0]).execute_command("TS.ADD", key, timestamp_ms, value)
+        except Exception as e:
+            if not is_failover_error(e):
+                raise
+            self._defer_writes(shards[0], sample, f"{type(e).__name__}: {e}")
+            return
+        REDIS_SAMPLES_WRITTEN.labels(shard=shards[0]).inc()
+        for target in shards[1:]:
+            try:
+                with track_redis(target, "TS.ADD"):
+                    self.get_connection_for_location(target).execute_command("TS.ADD", key, timestamp_ms, value)
+            except Exception as e:
+                # La copie en cours et la vérification rattraperont ce point
+                print(f"Erreur de double écriture pour {key} vers {target}: {e}")
+
+    # --- Spool disque des écritures différées ----------------------------------------
+
+    def _spool_path(self, shard):
+        return os.path.join(self.spool_dir, f"{shard}.spool")
+
+    def _spool(self, shard):
+        with self.spool_lock:
+            if shard not in self.spools:
+                self.spools[shard] = ShardSpool(shard, self._spool_path(shard), self.spool_max_bytes)
+            return self.spools[shard]
+
+    def _spool_samples(self, shard, samples):
+        """
+        Écrit des échantillons dans le spool disque du shard (rejoués quand il sera joignable) ;
+        renvoie False s'ils sont perdus (spool désactivé ou plein)
+        """
+        if not self.spool_dir or not samples:
+            return False
+        spool = self._spool(shard)
+        if not len(spool):
+            print(f"📼 Shard {shard} indisponible : écritures conservées dans {spool.path}")
+        stored = spool.append(samples)
+        if not stored:
+            print(f"❌ Spool de {shard} plein : {len(samples)} échantillon(s) perdu(s)")
+        self.spool_replayer.notify()
+        return stored
+
+    def spool_pending_writes(self):
+        """Avant l'arrêt : les échantillons encore en mémoire (bascule en cours) passent dans le spool disque"""
+        for shard, buffer in self.write_buffers.items():
+            samples = buffer.drain()
+            if samples and self._spool_samples(shard, samples):
+                print(f"📼 {len(samples)} échantillon(s) en attente pour {shard} conservés dans le spool")
+
+    def writable_connection(self, shard):
+        """
+        Connexion d'écriture d'un shard joignable et hors bascule, None sinon. Un shard absent
+        des connexions (injoignable au démarrage) est recherché via Sentinel ou son adresse statique,
+        puis ses séries sont créées.
+        """
+        if shard in self.failovers:
+            return None
+        if shard not in self.connections:
+            config = self.shards.get(shard)
+            watcher = self.watchers.get(shard)
+            try:
+                address = watcher.discover() if watcher else (config["host"], config["port"])
+                conn = self.connect(*address)
+                if conn.info("replication").get("role") != "master":
+                    return None
+            except Exception:
+                return None
+            print(f"✅ Shard {shard} de nouveau joignable ({address[0]}:{address[1]})")
+            # Séries et paliers agrégés non créés pendant l'absence du shard : créés avant que
+            # le shard ne reçoive les écritures en direct et le rejeu du spool
+            self.create_shard_series(shard, conn)
+            self.connections[shard] = conn
+        return self.connections[shard]
+
+    # --- Bascule du master (Sentinel) ----------------------------------------------
+
+    def _defer_writes(self, shard, samples, reason=None):
+        """
+        Met des échantillons en tampon pendant la bascule d'un shard. Avec une raison (erreur
+        d'écriture, événement Sentinel), la bascule est démarrée si elle ne l'est pas déjà ;
+        sans raison, rien n'est mis en tampon hors bascule. Renvoie True si les échantillons sont en tampon.
+        """
+        with self.failover_lock:
+            failing_over = shard in self.failovers
+            if not failing_over and reason is None:
+                return False
+            self.write_buffers[shard].add(samples)
+            if not failing_over:
+                self.failovers[shard] = {"reason": reason, "started": time.monotonic(),
+                                         "dropped_before": self.write_buffers[shard].dropped}
+        if not failing_over:
+            print(f"⚠️ Bascule en cours sur le shard {shard} ({reason}) : écritures mises en tampon")
+            threading.Thread(target=self._await_new_master, args=(shard,), daemon=True).start()
+        return True
+
+    def _begin_failover(self, shard, reason):
+        """Début de bascule annoncé par Sentinel (+odown, +try-failover)"""
+        self._defer_writes(shard, [], reason)
+
+    def _await_new_master(self, shard, poll_interval=0.5):
+        """
+        Cherche le master du shard jusqu'à en trouver un qui accepte les écritures : l'adresse
+        annoncée par Sentinel, ou le master actuel sans Sentinel (simple coupure réseau).
+        L'événement +switch-master, quand il arrive, termine la bascule plus tôt.
+        """
+        while shard in self.failovers and not self.failovers[shard].get("switched"):
+            watcher = self.watchers.get(shard)
+            try:
+                address = watcher.discover() if watcher else None
+                conn = self.connect(*address) if address else self.get_connection_for_location(shard)
+                if conn.info("replication").get("role") == "master":
+                    self._switch_master(shard, address, conn)
+                    return
+            except Exception:
+                pass
+            time.sleep(poll_interval)
+
+    def _switch_master(self, shard, address=None, conn=None):
+        """Bascule les écritures du shard vers son (nouveau) master puis rejoue le tampon"""
+        with self.failover_lock:
+            failover = self.failovers.get(shard)
+            if failover is None:
+                # +switch-master sans erreur d'écriture préalable (ou -odown hors bascule)
+                if address is None or address == self.master_addresses.get(shard):
+                    return
+                failover = self.failovers[shard] = {"reason": "+switch-master", "started": time.monotonic(),
+                                                    "dropped_before": self.write_buffers[shard].dropped}
+            if failover.get("switched"):
+                return
+            failover["switched"] = time.monotonic()
+
+        if conn is None:
+            conn = self.connect(*address) if address else self.get_connection_for_location(shard)
+        self.connections[shard] = conn
+        if address:
+            self.master_addresses[shard] = address
+        if shard in self.read_endpoints:
+            self.read_endpoints[shard].master = conn
+        window = failover["switched"] - failover["started"]
+        FAILOVER_WINDOW.labels(shard=shard).set(window)
+        print(f"🔁 Master de {shard}: {address or 'inchangé'} (écritures indisponibles pendant {window:.2f}s)")
+        self._replay_buffer(shard, failover)
+
+    def _replay_buffer(self, shard, failover, batch_size=1000, pipeline_depth=8):
+        """Rejoue les échantillons en tampon sur le nouveau master, puis termine la bascule"""
+        buffer = self.write_buffers[shard]
+        replayed = 0
+        while True:
+            samples = buffer.drain()
+            if samples:
+                result = self._write_shard_samples(shard, samples, batch_size, pipeline_depth, replaying=True)
+                replayed += result["points"]
+                FAILOVER_SAMPLES.labels(shard=shard, outcome="replayed").inc(result["points"])
+                if result["buffered"]:
+                    # Nouveau master déjà indisponible : attendre le suivant
+                    with self.failover_lock:
+                        failover.pop("switched", None)
+                    threading.Thread(target=self._await_new_master, args=(shard,), daemon=True).start()
+                    return
+                continue
+            with self.failover_lock:
+                # Les écritures arrivées pendant le rejeu sont encore en tampon : les rejouer aussi
+                if len(buffer):
+                    continue
+                del self.failovers[shard]
+                entry = {"shard": shard, "reason": failover["reason"],
+                         "window_seconds": failover["switched"] - failover["started"],
+                         "replay_seconds": time.monotonic() - failover["switched"],
+                         "replayed": replayed, "dropped": buffer.dropped - failover["dropped_before"]}
+                self.failover_history.append(entry)
+            print(f"✅ Bascule de {shard} terminée : {replayed} échantillon(s) rejoué(s), "
+                  f"{entry['dropped']} perdu(s) (tampon plein)")
+            return
+
+    def generate_live_tick(self):
+        """Génère un échantillon pour chaque capteur (une itération de la génération en direct)"""
+        # Prendre en compte une bascule de routage ou une migration lancée entre deux itérations
+        self.reload_routing()
+        timestamp_ms = int(time.time() * 1000)  # Timestamp actuel en ms
+        points_added = 0
+        unreachable = {}
+
+        for location, sensor_type, sensor_id, key in self.series_keys():
+            value = self.generate_sensor_value(sensor_type)
+            if self.shard_for_key(key) not in self.connections:
+                # Shard injoignable : l'échantillon attend dans le spool disque
+                unreachable.setdefault(self.shard_for_key(key), []).append((key, timestamp_ms, value))
+                continue
+            try:
+                self._add_sample(key, timestamp_ms, value)
+                points_added += 1
+                self._record_write(key, timestamp_ms)
+            except Exception as e:
+                print(f"Erreur d'ajout pour {key}: {e}")
+        for shard, samples in unreachable.items():
+            self._spool_samples(shard, samples)
+
+        print(
+            f"Données générées à {datetime.now()} - {points_added} points ajoutés sur {len(self.connections)} shards")
+        return points_added
+
     def generate_live_data(self, interval_seconds=30):
         """Génère des données en continu pour chaque capteur dans son shard dédié"""
         try:
             while True:
-                timestamp_ms = int(time.time() * 1000)  # Timestamp actuel en ms
-                points_added = 0
-
-                for location in list(self.connections.keys()):
-                    conn = self.get_connection_for_location(location)
-                    for sensor_type in self.sensor_types:
-                        for sensor_id in range(1, self.num_sensors + 1):
-                            key = f"sensor:{sensor_type}:{location}:{sensor_id}"
-                            value = self.generate_sensor_value(sensor_type)
-                            try:
-                                conn.execute_command("TS.ADD", key, timestamp_ms, value)
-                                points_added += 1
-                            except Exception as e:
-                                print(f"Erreur d'ajout pour {key}: {e}")
-
-                print(
-                    f"Données générées à {datetime.now()} - {points_added} points ajoutés sur {len(self.connections)} shards")
+                self.generate_live_tick()
+                export_metrics("generate_sharding_data")
                 time.sleep(interval_seconds)
         except KeyboardInterrupt:
+            self.spool_pending_writes()
             print("\nArrêt de la génération de données en direct.")
 
-    def query_location_data(self, location, sensor_type, start_time, end_time):
-        """Interroge les données d'un type de capteur pour un emplacement spécifique"""
-        if location not in self.connections:
+    def _fan_out_range(self, keys_by_location, start_ts, end_ts, timeout=None, plan=None, aggregation="avg"):
+        """
+        Moteur scatter-gather : envoie en parallèle une requête par shard (toutes les
+        clés d'un shard dans un seul pipeline TS.RANGE) et fusionne les réponses au fur
+        et à mesure. Les shards qui dépassent le délai sont signalés sans bloquer les autres.
+        Avec un plan (voir rollups.plan_query), les séries sont lues dans le palier agrégé choisi.
+        """
+        timeout = self.query_timeout if timeout is None else timeout
+        replies_by_location = {}
+        report = {"complete": [], "timed_out": [], "failed": {}, "latency_ms": {}, "plan": plan}
+
+        def read_ranges(conn, keys):
+            if plan is not None:
+                return fetch_planned_ranges(conn, keys, start_ts, end_ts, aggregation, plan)
+            pipe = conn.pipeline(transaction=False)
+            for key in keys:
+                pipe.execute_command("TS.RANGE", key, start_ts, end_ts)
+            return dict(zip(keys, pipe.execute(raise_on_error=False)))
+
+        def fetch(location, keys):
+            started = time.perf_counter()
+            # Lecture sur un réplica à jour du shard, le master en repli
+            with track_redis(location, "TS.RANGE"):
+                replies = self.read_from_shard(location, lambda conn: read_ranges(conn, keys))
+            return replies, (time.perf_counter() - started) * 1000
+
+        executor = ThreadPoolExecutor(max_workers=max(1, len(keys_by_location)))
+        futures = {executor.submit(fetch, location, keys): location
+                   for location, keys in keys_by_location.items() if keys}
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                location = futures[future]
+                try:
+                    replies_by_location[location], report["latency_ms"][location] = future.result()
+                    report["complete"].append(location)
+                except Exception as e:
+                    report["failed"][location] = str(e)
+        except FuturesTimeoutError:
+            report["timed_out"] = [location for future, location in futures.items() if not future.done()]
+        finally:
+            # Ne pas attendre les shards lents : leurs résultats seront ignorés
+            executor.shutdown(wait=False)
+
+        self.last_query_report = report
+        return replies_by_location, report
+
+    @staticmethod
+    def _plan_range(start_ts, end_ts, resolution_ms, aggregation):
+        """Plan de requête (palier agrégé) si une résolution est demandée, données brutes sinon"""
+        if not resolution_ms:
+            return None
+        return plan_query(start_ts, end_ts, int(time.time() * 1000), aggregation, bucket_ms=resolution_ms)
+
+    def query_location_data(self, location, sensor_type, start_time, end_time, timeout=None, resolution_ms=None,
+                            aggregation="avg"):
+        """
+        Interroge les données d'un type de capteur pour un emplacement spécifique
+        (agrégées à resolution_ms si elle est donnée, depuis le palier le plus adapté)
+        """
+        keys = [f"sensor:{sensor_type}:{location}:{sensor_id}" for sensor_id in range(1, self.num_sensors + 1)]
+        keys_by_shard = self.group_keys_by_shard(keys)
+        if location not in self.locations or not keys_by_shard:
             return f"Emplacement {location} non trouvé ou connexion non disponible"
 
-        conn = self.get_connection_for_location(location)
-        results = {}
-
         # Convertir les dates en timestamp milliseconds
         start_ts = int(start_time.timestamp() * 1000)
         end_ts = int(end_time.timestamp() * 1000)
 
-        for sensor_id in range(1, self.num_sensors + 1):
-            key = f"sensor:{sensor_type}:{location}:{sensor_id}"
-            try:
-                # Récupérer les données de la plage temporelle
-                data = conn.execute_command("TS.RANGE", key, start_ts, end_ts)
-                results[f"sensor_{sensor_id}"] = data
-            except Exception as e:
-                results[f"sensor_{sensor_id}"] = f"Erreur: {e}"
+        plan = self._plan_range(start_ts, end_ts, resolution_ms, aggregation)
+        replies_by_shard, report = self._fan_out_range(keys_by_shard, start_ts, end_ts, timeout, plan, aggregation)
+
+        results = {}
+        for sensor_id, key in enumerate(keys, start=1):
+            results[f"sensor_{sensor_id}"] = self._range_reply_or_error(
+                self.shard_for_key(key), key, replies_by_shard, report)
 
         return results
 
-    def query_by_unit_measure(self, unit_measure, start_time, end_time):
+    def query_by_unit_measure(self, unit_measure, start_time, end_time, timeout=None, resolution_ms=None,
+                              aggregation="avg"):
         """
         Interroge toutes les séries temporelles ayant une unité de mesure spécifique
-        à travers tous les shards
+        à travers tous les shards (en parallèle, un pipeline par shard)
         """
         results = {}
 
@@ -236,68 +930,100 @@ class RedisTrueShardingSystem:
         if not sensor_types_with_unit:
             return f"Aucun capteur avec l'unité de mesure '{unit_measure}' trouvé"
 
-        # Pour chaque emplacement
-        for location in list(self.connections.keys()):
+        # Préparer toutes les clés à interroger, regroupées par shard
+        keys_by_shard = self.group_keys_by_shard(
+            key for _, _, _, key in self.series_keys(sensor_types=sensor_types_with_unit))
+        plan = self._plan_range(start_ts, end_ts, resolution_ms, aggregation)
+        replies_by_shard, report = self._fan_out_range(keys_by_shard, start_ts, end_ts, timeout, plan, aggregation)
+
+        # Fusionner les réponses par emplacement et type de capteur
+        # (emplacements dont au moins une série est sur un shard connecté)
+        queried_locations = {location_of_key(key) for keys in keys_by_shard.values() for key in keys}
+        for location in self.locations:
+            if location not in queried_locations:
+                continue
             location_results = {}
-            conn = self.get_connection_for_location(location)
-
-            # Pour chaque type de capteur ayant l'unité demandée
             for sensor_type in sensor_types_with_unit:
                 sensor_results = {}
-
                 for sensor_id in range(1, self.num_sensors + 1):
                     key = f"sensor:{sensor_type}:{location}:{sensor_id}"
-                    try:
-                        data = conn.execute_command("TS.RANGE", key, start_ts, end_ts)
-                        sensor_results[f"sensor_{sensor_id}"] = data
-                    except Exception as e:
-                        sensor_results[f"sensor_{sensor_id}"] = f"Erreur: {e}"
-
+                    sensor_results[f"sensor_{sensor_id}"] = self._range_reply_or_error(
+                        self.shard_for_key(key), key, replies_by_shard, report)
                 location_results[sensor_type] = sensor_results
-
             results[location] = location_results
 
         return results
 
-    def get_shards_status(self):
-        """Vérifie le statut de tous les shards"""
-        status = {}
-        for location, config in self.shards.items():
+    def _for_each_shard(self, func, shards):
+        """Exécute func(shard) sur tous les shards en parallèle : {shard: résultat ou exception}"""
+        results = {}
+        with ThreadPoolExecutor(max_workers=max(1, len(shards))) as executor:
+            futures = {shard: executor.submit(func, shard) for shard in shards}
+        for shard, future in futures.items():
             try:
-                # Vérifier si nous avons une connexion active pour ce shard
-                if location not in self.connections:
-                    status[location] = {
-                        "status": "offline",
-                        "error": "Pas de connexion disponible",
-                        "container": config["container"]
-                    }
-                    continue
+                results[shard] = future.result()
+            except Exception as e:
+                results[shard] = e
+        return results
 
-                conn = self.connections[location]
-                # Vérifier si le serveur répond
-                ping_result = conn.ping()
-                # Obtenir des informations sur la mémoire et la réplication
-                info_memory = conn.info("memory")
-                info_replication = conn.info("replication")
-                # Compter les séries temporelles pour ce shard
-                keys = conn.keys("sensor:*")
+    def _shard_status(self, location):
+        """Statut d'un shard en un seul aller-retour (PING, INFO memory/replication/keyspace, DBSIZE)"""
+        pipe = self.get_connection_for_location(location).pipeline(transaction=False)
+        pipe.execute_command("PING")
+        pipe.execute_command("INFO", "memory")
+        pipe.execute_command("INFO", "replication")
+        pipe.execute_command("INFO", "keyspace")
+        pipe.execute_command("DBSIZE")
+        ping_result, info_memory, info_replication, info_keyspace, dbsize = pipe.execute()
+        return {
+            "status": "online" if ping_result else "offline",
+            "role": info_replication.get("role", "unknown"),
+            "used_memory": info_memory.get("used_memory_human", "N/A"),
+            "keys": int(dbsize),
+            "keyspace": info_keyspace
+        }
 
+    def get_shards_status(self):
+        """Vérifie le statut de tous les shards (en parallèle, un pipeline par shard)"""
+        results = self._for_each_shard(self._shard_status, list(self.connections))
+        status = {}
+        for location, config in self.shards.items():
+            # Vérifier si nous avons une connexion active pour ce shard
+            if location not in results:
                 status[location] = {
-                    "status": "online" if ping_result else "offline",
-                    "role": info_replication.get("role", "unknown"),
-                    "used_memory": info_memory.get("used_memory_human", "N/A"),
-                    "keys": len(keys),
+                    "status": "offline",
+                    "error": "Pas de connexion disponible",
                     "container": config["container"]
                 }
-            except Exception as e:
+            elif isinstance(results[location], Exception):
                 status[location] = {
                     "status": "offline",
-                    "error": str(e),
+                    "error": str(results[location]),
                     "container": config["container"]
                 }
+            else:
+                status[location] = dict(results[location], container=config["container"])
+            if location in self.spools:
+                status[location]["spool_pending"] = len(self.spools[location])
+            if location in self.read_endpoints:
+                # Retard et latence des réplicas mesurés à l'instant du statut
+                endpoints = self.read_endpoints[location]
+                endpoints.refresh()
+                status[location]["reads"] = endpoints.describe()
 
         return status
 
+    def _shard_series_info(self, location, keys):
+        """TS.INFO de toutes les séries d'un shard en un seul pipeline, réponses converties en dict"""
+        def read_infos(conn):
+            pipe = conn.pipeline(transaction=False)
+            for key in keys:
+                pipe.execute_command("TS.INFO", key)
+            return pipe.execute(raise_on_error=False)
+
+        return {key: reply if isinstance(reply, Exception) else parse_ts_info(reply)
+                for key, reply in zip(keys, self.read_from_shard(location, read_infos))}
+
     def get_shard_distribution_metrics(self):
         """Calcule des métriques sur la distribution des données entre les shards"""
         metrics = {
@@ -307,33 +1033,25 @@ class RedisTrueShardingSystem:
             "total_data_points": 0
         }
 
-        for location in list(self.connections.keys()):
-            conn = self.get_connection_for_location(location)
+        keys_by_shard = self.group_keys_by_shard(key for _, _, _, key in self.series_keys())
+        results = self._for_each_shard(
+            lambda location: self._shard_series_info(location, keys_by_shard.get(location, [])),
+            list(self.connections))
+
+        for location, infos in results.items():
             sensor_count = 0
             data_points = 0
-
-            for sensor_type in self.sensor_types:
-                for sensor_id in range(1, self.num_sensors + 1):
-                    key = f"sensor:{sensor_type}:{location}:{sensor_id}"
-                    try:
-                        # Vérifier si la série existe
-                        info = conn.execute_command("TS.INFO", key)
-                        sensor_count += 1
-
-                        # Obtenir le nombre de points dans cette série
-                        # Recherche de "totalSamples" ou b"totalSamples" dans la réponse
-                        total_samples = None
-                        for i, item in enumerate(info):
-                            if isinstance(item, (str, bytes)):
-                                item_str = item.decode() if isinstance(item, bytes) else item
-                                if item_str == "totalSamples" and i + 1 < len(info):
-                                    total_samples = int(info[i + 1])
-                                    break
-
-                        if total_samples is not None:
-                            data_points += total_samples
-                    except Exception as e:
-                        print(f"Erreur lors de la récupération des métriques pour {key}: {e}")
+            if isinstance(infos, Exception):
+                print(f"Erreur lors de la récupération des métriques du shard {location}: {infos}")
+                infos = {}
+
+            for key, info in infos.items():
+                # Les séries absentes (ou en erreur) ne sont pas comptées
+                if isinstance(info, Exception):
+                    print(f"Erreur lors de la récupération des métriques pour {key}: {info}")
+                    continue
+                sensor_count += 1
+                data_points += info["totalSamples"]
 
             metrics["sensors_per_shard"][location] = sensor_count
             metrics["data_points_per_shard"][location] = data_points
@@ -380,7 +1098,7 @@ def print_distribution_metrics(sharding_system):
 if __name__ == "__main__":
     try:
         print("Initialisation du système de true sharding (un shard par emplacement)...")
-        sharding_system = RedisTrueShardingSystem()
+        sharding_system = RedisTrueShardingSystem(series_index=SeriesIndex.load())
 
         # Vérifier si nous avons au moins une connexion valide
         if not sharding_system.connections:
@@ -394,7 +1112,8 @@ if __name__ == "__main__":
         print_shard_status(sharding_system)
 
         print("\nGénération de données historiques (7 derniers jours)...")
-        sharding_system.generate_historical_data(days_back=7)
+        sharding_system.generate_historical_data_bulk(days_back=7)
+        export_metrics("generate_sharding_data")
 
         # Afficher les métriques de distribution après la génération historique
         print_distribution_metrics(sharding_system)
@@ -0,0 +1,193 @@
+import gzip
+import queue
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import deque
+
+
+class InfluxBatchWriter:
+    """
+    Écrivain InfluxDB en arrière-plan : les lignes (line protocol) sont placées dans
+    une file bornée puis regroupées en lots envoyés à /api/v2/write par un thread
+    dédié, avec compression gzip et nouvelles tentatives (backoff exponentiel + jitter).
+    La lecture Redis peut ainsi se poursuivre pendant l'écriture dans InfluxDB.
+    """
+
+    def __init__(self, url, token, org, bucket, batch_size=5000, flush_interval=1.0, max_queue_size=16,
+                 use_gzip=True, max_retries=5, retry_base_delay=0.5, retry_max_delay=30.0, timeout=30.0):
+        self.write_url = f"{url.rstrip('/')}/api/v2/write?" + urllib.parse.urlencode(
+            {"org": org, "bucket": bucket, "precision": "ns"})
+        self.token = token
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.use_gzip = use_gzip
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.timeout = timeout
+
+        # File bornée : write() bloque quand InfluxDB ne suit pas (contre-pression)
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+
+        self.lines_written = 0
+        self.batches_written = 0
+        self.batches_failed = 0
+        self.lines_dropped = 0
+        # Un lot abandonné rend l'exécution en échec : plus aucune confirmation jusqu'à reset_failure()
+        self.failed = False
+        self.retries = 0
+        self.bytes_sent = 0
+        self.latencies_ms = deque(maxlen=1000)
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name="influx-batch-writer", daemon=True)
+            self.thread.start()
+        return self
+
+    def write(self, lines, on_success=None):
+        """
+        Met en file un lot de lignes. on_success est appelé (dans le thread d'écriture)
+        une fois ces lignes confirmées par InfluxDB, jamais en cas d'échec définitif ni
+        après l'abandon d'un lot précédent : un point de reprise avancé par un lot ultérieur
+        de la même série passerait par-dessus les points perdus.
+        """
+        if lines:
+            self.queue.put((list(lines), on_success))
+
+    def flush(self):
+        """Attend que toutes les lignes en file aient été traitées ; False si un lot a été abandonné"""
+        self.queue.join()
+        return not self.failed
+
+    def reset_failure(self):
+        """Début d'une nouvelle exécution : les confirmations reprennent"""
+        with self.lock:
+            self.failed = False
+
+    def close(self):
+        """Vide la file puis arrête le thread d'écriture"""
+        if self.thread is not None:
+            self.flush()
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+    # --- Thread d'écriture ---------------------------------------------------
+
+    def _run(self):
+        pending = []
+        callbacks = []
+        taken = 0
+        deadline = time.monotonic() + self.flush_interval
+
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                lines, on_success = self.queue.get(timeout=timeout)
+                pending.extend(lines)
+                taken += 1
+                if on_success is not None:
+                    callbacks.append(on_success)
+            except queue.Empty:
+                pass
+
+            # Envoi quand le lot est plein, à l'échéance de l'intervalle, ou si la file est vide
+            # (pour que flush() n'attende pas l'intervalle complet)
+            due = time.monotonic() >= deadline
+            if pending and (len(pending) >= self.batch_size or due or self.queue.empty()):
+                for start in range(0, len(pending), self.batch_size):
+                    if not self._send(pending[start:start + self.batch_size]):
+                        # Échec définitif : pas de confirmation pour les lignes du lot
+                        with self.lock:
+                            self.lines_dropped += len(pending) - start
+                            self.failed = True
+                        break
+                if not self.failed:
+                    for callback in callbacks:
+                        callback()
+                pending = []
+                callbacks = []
+            if not pending:
+                for _ in range(taken):
+                    self.queue.task_done()
+                taken = 0
+            if due:
+                deadline = time.monotonic() + self.flush_interval
+            if self.stop_event.is_set() and self.queue.empty() and not pending:
+                return
+
+    def _send(self, lines):
+        body = "\n".join(lines).encode()
+        headers = {
+            "Authorization": f"Token {self.token}",
+            "Content-Type": "text/plain; charset=utf-8"
+        }
+        if self.use_gzip:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            retry_after = None
+            try:
+                request = urllib.request.Request(self.write_url, data=body, headers=headers, method="POST")
+                with urllib.request.urlopen(request, timeout=self.timeout):
+                    pass
+                with self.lock:
+                    self.latencies_ms.append((time.perf_counter() - started) * 1000)
+                    self.lines_written += len(lines)
+                    self.batches_written += 1
+                    self.bytes_sent += len(body)
+                return True
+            except urllib.error.HTTPError as e:
+                # Erreurs définitives (données invalides, authentification...) : inutile de réessayer
+                if e.code not in (408, 429) and e.code < 500:
+                    print(f"❌ Écriture InfluxDB refusée ({e.code}): {e.read()[:200]!r}")
+                    break
+                retry_after = e.headers.get("Retry-After")
+                error = e
+            except (urllib.error.URLError, OSError) as e:
+                error = e
+
+            if attempt == self.max_retries:
+                print(f"❌ Écriture InfluxDB abandonnée après {attempt + 1} tentative(s): {error}")
+                break
+            with self.lock:
+                self.retries += 1
+            # Backoff exponentiel avec jitter complet (ou délai imposé par Retry-After)
+            delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            time.sleep(delay)
+
+        with self.lock:
+            self.batches_failed += 1
+        return False
+
+    def metrics(self):
+        """Profondeur de file, latence d'écriture et compteurs de tentatives"""
+        with self.lock:
+            latencies = sorted(self.latencies_ms)
+            return {
+                "queue_depth": self.queue.qsize(),
+                "lines_written": self.lines_written,
+                "batches_written": self.batches_written,
+                "batches_failed": self.batches_failed,
+                "lines_dropped": self.lines_dropped,
+                "retries": self.retries,
+                "bytes_sent": self.bytes_sent,
+                "write_latency_ms": {
+                    "avg": sum(latencies) / len(latencies) if latencies else 0.0,
+                    "p95": latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+                    "max": latencies[-1] if latencies else 0.0
+                }
+            }
@@ -5,16 +5,32 @@ import time
 import subprocess
 import json
 import os
+import threading
 
 import generate_sharding_data
+from influx_batch_writer import InfluxBatchWriter
+from metrics import (ARCHIVER_BATCH_LINES, ARCHIVER_LAG, ARCHIVER_POINTS, ARCHIVER_QUEUE_DEPTH, ARCHIVER_RETRIES,
+                     REGISTRY, export_metrics)
+from scheduler import TaskScheduler
+from series_info_cache import parse_ts_info
+
+CHECKPOINTS_PATH = "sharding_metadata/archive_checkpoints.json"
 
 
 class InfluxDBArchiver:
-    def __init__(self, token=None, url="http://localhost:8086", org="tp_iot", bucket="sensors_archive"):
+    def __init__(self, token=None, url="http://localhost:8086", org="tp_iot", bucket="sensors_archive",
+                 write_mode="sync", batch_options=None):
         # Configuration
         self.url = url
         self.org = org
         self.bucket = bucket
+        self.last_archive_stats = None
+        self.checkpoints = ArchiveCheckpoints.load()
+        # Mode d'écriture : "sync" (write_api bloquant) ou "async" (écrivain en arrière-plan)
+        self.write_mode = write_mode
+        self.batch_writer = None
+        # Nouvelles tentatives de l'écrivain déjà reportées dans le compteur Prometheus
+        self.reported_retries = 0
 
         # Obtenir le token
         if token:
@@ -57,12 +73,24 @@ class InfluxDBArchiver:
             self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
             self.query_api = self.client.query_api()
 
+            if self.write_mode == "async":
+                self.batch_writer = InfluxBatchWriter(self.url, self.token, self.org, self.bucket,
+                                                      **(batch_options or {})).start()
+                REGISTRY.add_collector(self._collect_writer_metrics)
+                print("✅ Écriture asynchrone par lots activée")
+
             print("✅ Client InfluxDB initialisé avec succès")
 
         except Exception as e:
             print(f"❌ Erreur d'initialisation du client InfluxDB: {e}")
             raise
 
+    def close(self):
+        """Vide les écritures en attente et ferme les clients"""
+        if self.batch_writer is not None:
+            self.batch_writer.close()
+        self.client.close()
+
     def get_influxdb_token(self):
         """Tente de récupérer automatiquement un token valide pour InfluxDB"""
         print("Tentative de récupération automatique du token InfluxDB...")
@@ -122,8 +150,16 @@ class InfluxDBArchiver:
             print(f"❌ Erreur lors de la vérification/création du bucket: {e}")
             return False
 
-    def archive_redis_data(self, redis_system, days_back=7):
-        """Archive les données Redis vers InfluxDB"""
+    def archive_redis_data(self, redis_system, days_back=7, page_size=5000, batch_size=5000, incremental=False,
+                           lookback_ms=0, verify=True):
+        """
+        Archive les données Redis vers InfluxDB en flux : chaque série est lue par pages
+        (TS.RANGE ... COUNT), encodée directement en line protocol et écrite par lots
+        de taille fixe, ce qui borne la mémoire quelle que soit la fenêtre archivée.
+        En mode incrémental, chaque série ne relit que les points postérieurs à son
+        dernier timestamp archivé (points de reprise persistés localement) ; lookback_ms
+        permet de relire une marge pour rattraper les points arrivés en retard.
+        """
         try:
             if not self.ensure_bucket_exists():
                 print("❌ Impossible de continuer l'archivage sans bucket valide")
@@ -133,53 +169,236 @@ class InfluxDBArchiver:
             start_time = end_time - timedelta(days=days_back)
             print(f"\nArchivage des données du {start_time} au {end_time}...")
 
-            points = []
-            for location in redis_system.locations:
-                if location not in redis_system.connections:
+            start_ms = int(start_time.timestamp() * 1000)
+            end_ms = int(end_time.timestamp() * 1000)
+            started = time.perf_counter()
+            if self.batch_writer is not None:
+                self.batch_writer.reset_failure()
+            batch = []
+            # Plus grand timestamp de chaque série présent dans le lot en cours
+            batch_high_water = {}
+            total_points = 0
+            batches_written = 0
+
+            def flush():
+                # Les points de reprise n'avancent qu'une fois le lot écrit : après un crash,
+                # les points non confirmés sont relus (réécriture idempotente dans InfluxDB)
+                on_success = None
+                if incremental:
+                    high_water = dict(batch_high_water)
+                    on_success = lambda: self.checkpoints.advance_many(high_water, save=True)
+                ARCHIVER_BATCH_LINES.labels().observe(len(batch))
+                if not self.write_lines(batch, on_success):
+                    return False
+                ARCHIVER_POINTS.labels().inc(len(batch))
+                batch_high_water.clear()
+                return True
+
+            for location, sensor_type, sensor_id, key in redis_system.series_keys():
+                # Uniquement les séries hébergées par un shard connecté
+                if redis_system.shard_for_key(key) not in redis_system.connections:
                     continue
 
-                conn = redis_system.get_connection_for_location(location)
-                for sensor_type in redis_system.sensor_types:
-                    for sensor_id in range(1, redis_system.num_sensors + 1):
-                        key = f"sensor:{sensor_type}:{location}:{sensor_id}"
-                        try:
-                            data = conn.execute_command("TS.RANGE", key,
-                                                        int(start_time.timestamp() * 1000),
-                                                        int(end_time.timestamp() * 1000))
-                            for timestamp_ms, value in data:
-                                point = influxdb_client.Point(sensor_type) \
-                                    .tag("location", location) \
-                                    .tag("sensor_id", str(sensor_id)) \
-                                    .field("value", float(value)) \
-                                    .time(int(timestamp_ms) * 1_000_000)  # Conversion ms -> ns
-                                points.append(point)
-
-                        except Exception as e:
-                            print(f"⚠️ Erreur sur {key}: {str(e)[:100]}...")
-
-            if points:
-                print(f"Tentative d'écriture de {len(points)} points...")
+                conn = redis_system.get_connection_for_key(key)
+                # Préfixe line protocol commun à tous les points de la série
+                prefix = (f"{escape_measurement(sensor_type)},location={escape_tag(location)},"
+                          f"sensor_id={sensor_id} value=")
+                series_start_ms = start_ms
+                if incremental:
+                    checkpoint = self.checkpoints.get(key)
+                    if checkpoint is not None:
+                        # Reprise au point de reprise même s'il précède la fenêtre days_back
+                        series_start_ms = checkpoint + 1 - lookback_ms
                 try:
-                    self.write_api.write(bucket=self.bucket, org=self.org, record=points)
-                    print("✅ Données écrites avec succès")
-
-                    # Vérification
-                    query = f'from(bucket:"{self.bucket}") |> range(start:-1h) |> limit(n:1)'
-                    result = self.query_api.query(query)
-                    print(f"Vérification : {len(result)} tables trouvées")
-
-                    return True
-                except Exception as write_error:
-                    print(f"❌ Erreur d'écriture: {write_error}")
+                    for page in read_series_pages(conn, key, series_start_ms, end_ms, page_size):
+                        for timestamp_ms, value in page:
+                            # Conversion ms -> ns
+                            batch.append(f"{prefix}{float(value)!r} {int(timestamp_ms) * 1_000_000}")
+                        batch_high_water[key] = int(page[-1][0])
+                        if len(batch) >= batch_size:
+                            if not flush():
+                                return False
+                            total_points += len(batch)
+                            batches_written += 1
+                            batch = []
+
+                except Exception as e:
+                    print(f"⚠️ Erreur sur {key}: {str(e)[:100]}...")
+
+            if batch:
+                if not flush():
                     return False
-            else:
+                total_points += len(batch)
+                batches_written += 1
+
+            # Attendre la fin des écritures en arrière-plan
+            written = self.batch_writer is None or self.batch_writer.flush()
+
+            elapsed = time.perf_counter() - started
+            self.last_archive_stats = {
+                "points": total_points,
+                "batches": batches_written,
+                "elapsed_seconds": elapsed,
+                "points_per_second": total_points / elapsed if elapsed > 0 else 0.0
+            }
+            if self.batch_writer is not None:
+                self.last_archive_stats["writer"] = self.batch_writer.metrics()
+            oldest_checkpoint = self.checkpoints.oldest()
+            if incremental and oldest_checkpoint is not None:
+                ARCHIVER_LAG.labels().set(max(0.0, time.time() - oldest_checkpoint / 1000))
+
+            if total_points:
+                print(f"✅ {total_points} points écrits en {batches_written} lot(s) "
+                      f"({elapsed:.2f}s, {self.last_archive_stats['points_per_second']:.0f} points/s)")
+                if self.batch_writer is not None:
+                    writer = self.last_archive_stats["writer"]
+                    print(f"   Écrivain: {writer['lines_written']} lignes confirmées, {writer['retries']} nouvelle(s) "
+                          f"tentative(s), {writer['lines_dropped']} lignes abandonnées, "
+                          f"latence p95 {writer['write_latency_ms']['p95']:.1f} ms")
+
+            if not written:
+                # Points de reprise gelés depuis le premier lot abandonné : ils seront relus
+                print("❌ Archivage incomplet : lot(s) abandonné(s), points de reprise non avancés")
+                return False
+            if total_points and verify:
+                # Vérification
+                query = f'from(bucket:"{self.bucket}") |> range(start:-1h) |> limit(n:1)'
+                result = self.query_api.query(query)
+                print(f"Vérification : {len(result)} tables trouvées")
+            elif not total_points:
                 print("⚠️ Aucune donnée à archiver")
-                return True
+            return True
 
         except Exception as e:
             print(f"❌ Erreur lors de l'archivage: {e}")
             return False
 
+    def apply_redis_retention(self, redis_system, keep_days=30):
+        """
+        Fait expirer de Redis les échantillons bruts plus anciens que keep_days, uniquement
+        s'ils ont déjà été archivés (jamais au-delà du point de reprise de la série), en ajustant
+        la rétention brute (TS.ALTER RETENTION). Pas de TS.DEL : refusé au-delà de la rétention
+        sur une série avec règles de compaction, il recalculerait aussi les buckets agrégés.
+        """
+        cutoff_ms = int((datetime.now() - timedelta(days=keep_days)).timestamp() * 1000)
+        altered = 0
+        for location, sensor_type, sensor_id, key in redis_system.series_keys():
+            if redis_system.shard_for_key(key) not in redis_system.connections:
+                continue
+            checkpoint = self.checkpoints.get(key)
+            if checkpoint is None:
+                continue
+            try:
+                conn = redis_system.get_connection_for_key(key)
+                info = parse_ts_info(conn.execute_command("TS.INFO", key))
+                # Rétention relative au dernier timestamp : allongée si l'archivage a du retard
+                retention_ms = max(1, info["lastTimestamp"] - min(cutoff_ms, checkpoint))
+                if info["totalSamples"] and retention_ms != info["retentionTime"]:
+                    conn.execute_command("TS.ALTER", key, "RETENTION", retention_ms)
+                    altered += 1
+            except Exception as e:
+                print(f"⚠️ Erreur de rétention sur {key}: {str(e)[:100]}...")
+        print(f"🧹 Rétention Redis: rétention brute ajustée sur {altered} série(s) "
+              f"(échantillons archivés de plus de {keep_days} jours)")
+        return altered
+
+    def _collect_writer_metrics(self):
+        """Collecteur de métriques : file d'attente et nouvelles tentatives de l'écrivain asynchrone"""
+        if self.batch_writer is not None:
+            writer = self.batch_writer.metrics()
+            ARCHIVER_QUEUE_DEPTH.labels().set(writer["queue_depth"])
+            # Le compteur ne fait qu'augmenter : seules les nouvelles tentatives depuis la dernière collecte
+            ARCHIVER_RETRIES.labels().inc(writer["retries"] - self.reported_retries)
+            self.reported_retries = writer["retries"]
+
+    def write_lines(self, lines, on_success=None):
+        """
+        Écrit un lot de lignes au format line protocol. En mode asynchrone, le lot est
+        mis en file et on_success est appelé lorsque InfluxDB l'a confirmé
+        """
+        if self.batch_writer is not None:
+            self.batch_writer.write(lines, on_success)
+            return True
+        try:
+            self.write_api.write(bucket=self.bucket, org=self.org, record=lines)
+            if on_success is not None:
+                on_success()
+            return True
+        except Exception as write_error:
+            print(f"❌ Erreur d'écriture: {write_error}")
+            return False
+
+
+class ArchiveCheckpoints:
+    """Dernier timestamp archivé (ms) par série, persisté dans sharding_metadata"""
+
+    def __init__(self, path=CHECKPOINTS_PATH, checkpoints=None):
+        self.path = path
+        self.checkpoints = dict(checkpoints or {})
+        # Les points de reprise peuvent être avancés depuis le thread d'écriture asynchrone
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=CHECKPOINTS_PATH):
+        try:
+            with open(path) as f:
+                return cls(path, json.load(f))
+        except (OSError, ValueError):
+            return cls(path)
+
+    def get(self, key):
+        return self.checkpoints.get(key)
+
+    def oldest(self):
+        """Plus ancien point de reprise (série la plus en retard), None s'il n'y en a aucun"""
+        with self.lock:
+            return min(self.checkpoints.values(), default=None)
+
+    def advance_many(self, high_water, save=False):
+        """Avance les points de reprise (jamais en arrière)"""
+        with self.lock:
+            for key, timestamp_ms in high_water.items():
+                if timestamp_ms > self.checkpoints.get(key, -1):
+                    self.checkpoints[key] = timestamp_ms
+            if save:
+                self._save()
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        """Écriture atomique : un crash pendant la sauvegarde conserve l'ancien fichier"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.checkpoints, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+def escape_measurement(value):
+    """Échappe un nom de mesure pour le line protocol"""
+    return str(value).replace(",", "\\,").replace(" ", "\\ ")
+
+
+def escape_tag(value):
+    """Échappe une clé ou valeur de tag pour le line protocol"""
+    return str(value).replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def read_series_pages(conn, key, start_ms, end_ms, page_size):
+    """Lit une série par pages de page_size points (TS.RANGE ... COUNT)"""
+    while start_ms <= end_ms:
+        page = conn.execute_command("TS.RANGE", key, start_ms, end_ms, "COUNT", page_size)
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        start_ms = int(page[-1][0]) + 1
+
 
 def main():
     try:
@@ -188,34 +407,41 @@ def main():
         redis_system = generate_sharding_data.RedisTrueShardingSystem()
 
         # Initialisation de l'archiveur InfluxDB avec récupération automatique du token
-        influx_archiver = InfluxDBArchiver()
+        # (écriture asynchrone par lots : lecture Redis et écriture InfluxDB se recouvrent)
+        influx_archiver = InfluxDBArchiver(write_mode="async")
 
         # Test initial d'archivage
         print("\nTest initial d'archivage (1 jour de données)...")
-        success = influx_archiver.archive_redis_data(redis_system, days_back=1)
+        success = influx_archiver.archive_redis_data(redis_system, days_back=1, incremental=True)
 
         if not success:
             print("\n❌ Le test initial d'archivage a échoué. Vérifiez les paramètres et recommencez.")
             return
 
-        print("\n✅ Test initial réussi! Démarrage de la boucle principale...")
+        print("\n✅ Test initial réussi! Démarrage des tâches périodiques...")
         print("Appuyez sur Ctrl+C pour arrêter le programme")
 
-        # Boucle principale
-        try:
-            while True:
-                # Générer des données en direct
-                redis_system.generate_live_data(interval_seconds=30)
-
-                # Archivage périodique toutes les 5 minutes
-                current_time = datetime.now()
-                if current_time.minute % 5 == 0 and current_time.second < 30:
-                    print(f"\n⏰ {current_time} - Archivage périodique...")
-                    influx_archiver.archive_redis_data(redis_system, days_back=0.1)  # ~2.4 heures
-                    time.sleep(60)  # Éviter les doubles exécutions
-
-        except KeyboardInterrupt:
-            print("\n\n🛑 Interruption détectée. Arrêt propre du système...")
+        # Génération, archivage et rétention tournent comme des tâches indépendantes ;
+        # archivage et rétention partagent un verrou (tous deux utilisent les points de reprise)
+        scheduler = TaskScheduler()
+        archive_lock = threading.Lock()
+        scheduler.add_task("generation", 30, redis_system.generate_live_tick)
+        # Seuls les points postérieurs aux points de reprise sont relus (~2.4 heures au maximum)
+        scheduler.add_task("archivage", 5 * 60,
+                           lambda: influx_archiver.archive_redis_data(redis_system, days_back=0.1,
+                                                                      incremental=True, verify=False),
+                           run_immediately=False, lock=archive_lock)
+        scheduler.add_task("retention", 60 * 60,
+                           lambda: influx_archiver.apply_redis_retention(redis_system, keep_days=30),
+                           run_immediately=False, lock=archive_lock)
+        # Export périodique des métriques (Pushgateway ou fichier texte, selon l'environnement)
+        scheduler.add_task("metriques", 60, lambda: export_metrics("influxdb_archiver"), run_immediately=False)
+        # À l'arrêt, les échantillons en tampon (bascule en cours) passent dans le spool disque
+        # et les lots en cours d'écriture sont envoyés avant de quitter
+        scheduler.add_shutdown_hook(redis_system.spool_pending_writes)
+        scheduler.add_shutdown_hook(influx_archiver.close)
+        scheduler.add_shutdown_hook(lambda: export_metrics("influxdb_archiver"))
+        scheduler.run_forever()
 
     except KeyboardInterrupt:
         print("\n🛑 Arrêt du système")
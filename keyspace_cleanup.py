@@ -0,0 +1,130 @@
+import fnmatch
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rollups import rollup_keys
+from series_info_cache import parse_ts_info
+from shard_router import series_key_of
+
+
+def scan_key_batches(conn, match="sensor:*", count=1000):
+    """Parcourt le keyspace par lots avec SCAN (contrairement à KEYS, ne bloque pas le serveur)"""
+    cursor = 0
+    while True:
+        cursor, keys = conn.scan(cursor=cursor, match=match, count=count)
+        if keys:
+            yield keys
+        if int(cursor) == 0:
+            return
+
+
+def count_keys(conn, match="sensor:*", count=1000):
+    """Compte les clés correspondant à un motif par SCAN incrémental"""
+    return sum(len(keys) for keys in scan_key_batches(conn, match, count))
+
+
+class KeyspaceCleaner:
+    """
+    Suppression en masse non bloquante, tous les shards en parallèle :
+    - sélection des séries par SCAN incrémental (motif) ou TS.QUERYINDEX (filtres de labels)
+    - suppression des séries entières (et de leurs paliers agrégés) par UNLINK (mémoire
+      libérée en arrière-plan) ou suppression ponctuelle des échantillons bruts anciens par
+      TS.DEL ; commandes envoyées par lots dans des pipelines
+    La rétention des séries n'est pas modifiée : raccourcir RETENTION ferait d'une suppression
+    ponctuelle une politique permanente, et Redis n'élague qu'à la prochaine écriture. TS.DEL
+    recalcule les buckets agrégés touchés ; il est refusé au-delà de la rétention, où les
+    échantillons sont de toute façon expirés.
+    """
+
+    def __init__(self, connections, scan_count=1000, batch_size=500, progress_every=10_000):
+        self.connections = connections
+        self.scan_count = scan_count
+        self.batch_size = batch_size
+        self.progress_every = progress_every
+
+    def _candidate_batches(self, conn, match, filters):
+        if not filters:
+            yield from scan_key_batches(conn, match, self.scan_count)
+            return
+        # Index secondaire de RedisTimeSeries : pas de parcours du keyspace
+        keys = [key for key in conn.execute_command("TS.QUERYINDEX", *filters) if fnmatch.fnmatchcase(key, match)]
+        for start in range(0, len(keys), self.scan_count):
+            yield keys[start:start + self.scan_count]
+
+    @staticmethod
+    def _deletion_ranges(conn, keys, older_than_ms, result):
+        """
+        Plage TS.DEL de chaque série brute : de la limite de sa rétention (au-delà, Redis refuse
+        TS.DEL sur une série avec règles, et ces échantillons expirent à la prochaine écriture)
+        jusqu'à older_than_ms exclu. Les séries sans échantillon dans cette plage sont ignorées.
+        """
+        keys = [key for key in keys if series_key_of(key) == key]
+        pipe = conn.pipeline(transaction=False)
+        for key in keys:
+            pipe.execute_command("TS.INFO", key)
+        for key, reply in zip(keys, pipe.execute(raise_on_error=False)):
+            if isinstance(reply, Exception):
+                result["errors"] += 1
+                continue
+            info = parse_ts_info(reply)
+            if not info["totalSamples"]:
+                continue
+            from_ts = info["firstTimestamp"]
+            if info["retentionTime"]:
+                from_ts = max(from_ts, info["lastTimestamp"] - info["retentionTime"])
+            if from_ts < older_than_ms:
+                yield key, from_ts, older_than_ms - 1
+
+    def _clean_shard(self, shard, match, filters, older_than_ms, dry_run):
+        conn = self.connections[shard]
+        result = {"matched": 0, "deleted_keys": 0, "trimmed_series": 0, "errors": 0, "keys": []}
+        started = time.perf_counter()
+        next_progress = self.progress_every
+
+        for keys in self._candidate_batches(conn, match, filters):
+            result["matched"] += len(keys)
+            if not dry_run:
+                pipe = conn.pipeline(transaction=False)
+                if older_than_ms is None:
+                    # Les paliers agrégés d'une série brute supprimée disparaissent avec elle
+                    targets = list(dict.fromkeys(
+                        keys + [rollup for key in keys if series_key_of(key) == key for rollup in rollup_keys(key)]))
+                    for start in range(0, len(targets), self.batch_size):
+                        pipe.execute_command("UNLINK", *targets[start:start + self.batch_size])
+                else:
+                    for key, from_ts, to_ts in self._deletion_ranges(conn, keys, older_than_ms, result):
+                        pipe.execute_command("TS.DEL", key, from_ts, to_ts)
+                for reply in pipe.execute(raise_on_error=False):
+                    if isinstance(reply, Exception):
+                        result["errors"] += 1
+                    elif older_than_ms is None:
+                        result["deleted_keys"] += int(reply)
+                    elif int(reply):
+                        # Seules les séries dont des échantillons ont réellement été supprimés
+                        result["trimmed_series"] += 1
+            if older_than_ms is None:
+                result["keys"].extend(keys)
+
+            if result["matched"] >= next_progress:
+                print(f"  {shard}: {result['matched']} série(s) traitée(s)...")
+                next_progress += self.progress_every
+
+        result["elapsed_seconds"] = time.perf_counter() - started
+        return result
+
+    def run(self, match="sensor:*", filters=None, older_than_ms=None, dry_run=False):
+        """
+        Supprime les séries correspondant au motif et aux filtres de labels (ex: ["location=cuisine"]),
+        ou seulement leurs échantillons antérieurs à older_than_ms (TS.DEL). Renvoie un résultat par shard.
+        """
+        shards = list(self.connections)
+        with ThreadPoolExecutor(max_workers=max(1, len(shards))) as executor:
+            futures = {shard: executor.submit(self._clean_shard, shard, match, filters or [], older_than_ms, dry_run)
+                       for shard in shards}
+        results = {}
+        for shard, future in futures.items():
+            try:
+                results[shard] = future.result()
+            except Exception as e:
+                results[shard] = {"error": str(e)}
+        return results
@@ -0,0 +1,252 @@
+import queue
+import threading
+import time
+
+from metrics import LIVE_SAMPLES, LIVE_SUBSCRIBERS, track_redis
+
+# Intervalle de scrutation des nouveaux échantillons par shard (secondes)
+DEFAULT_POLL_INTERVAL = 1.0
+
+# Événements en attente par client avant de le considérer comme trop lent
+DEFAULT_QUEUE_SIZE = 256
+
+
+def samples_event(key, reply):
+    """Événement "samples" d'une série à partir d'une réponse TS.RANGE : tableaux t (epoch ms) et v"""
+    return {"key": key, "t": [int(point[0]) for point in reply], "v": [float(point[1]) for point in reply]}
+
+
+class BucketFolder:
+    """
+    Regroupe les échantillons du flux en buckets alignés sur l'epoch (comme TS.RANGE ... AGGREGATION),
+    pour un graphique agrégé : chaque événement contient les buckets touchés, le premier pouvant être
+    le bucket en cours déjà envoyé (même t, valeur mise à jour). value(stats) calcule la valeur d'un
+    bucket à partir de ses statistiques [timestamp, min, max, somme, nombre].
+    """
+
+    def __init__(self, bucket_ms, value):
+        self.bucket_ms = bucket_ms
+        self.value = value
+        self.open = {}
+
+    def fold(self, event):
+        key = event["key"]
+        touched = []
+        stats = self.open.get(key)
+        for timestamp, sample in zip(event["t"], event["v"]):
+            bucket = timestamp - timestamp % self.bucket_ms
+            if stats is None or bucket > stats[0]:
+                stats = [bucket, sample, sample, 0.0, 0]
+                touched.append(stats)
+            elif bucket < stats[0]:
+                # Échantillon antérieur au bucket en cours : déjà compté dans un bucket fermé
+                continue
+            elif not touched:
+                touched.append(stats)
+            stats[1] = min(stats[1], sample)
+            stats[2] = max(stats[2], sample)
+            stats[3] += sample
+            stats[4] += 1
+        if stats is not None:
+            self.open[key] = stats
+        return {"key": key, "t": [bucket[0] for bucket in touched], "v": [self.value(bucket) for bucket in touched]}
+
+
+class LiveSubscription:
+    """
+    Abonnement d'un client au flux temps réel : file d'événements (type, données) alimentée par
+    les suiveurs des shards. Un client trop lent (file pleine) reçoit un unique événement "reset"
+    et doit recharger sa fenêtre avant de se réabonner.
+    """
+
+    def __init__(self, keys, since, max_queue=DEFAULT_QUEUE_SIZE):
+        self.keys = list(keys)
+        self.since = since
+        self.events = queue.Queue(max_queue)
+        self.lock = threading.Lock()
+        self.overflowed = False
+
+    def push(self, event, data):
+        with self.lock:
+            if self.overflowed:
+                return
+            try:
+                self.events.put_nowait((event, data))
+            except queue.Full:
+                # Remplacer les événements en attente par la demande de rechargement
+                self.overflowed = True
+                while not self.events.empty():
+                    self.events.get_nowait()
+                self.events.put_nowait(("reset", {"reason": "client trop lent"}))
+
+    def get(self, timeout=None):
+        """Prochain événement (type, données), ou None si rien n'est arrivé avant timeout"""
+        try:
+            return self.events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class ShardTailer:
+    """
+    Suiveur d'un shard : une seule boucle de scrutation partagée par tous les clients abonnés à
+    des séries de ce shard. À chaque tour, un seul pipeline avec un TS.RANGE <clé> <dernier
+    timestamp vu + 1> + par série suivie : le coût est proportionnel aux nouveaux échantillons,
+    pas à la fenêtre affichée ni au nombre de clients. Un client qui s'abonne avec un timestamp
+    antérieur au curseur de la série reçoit d'abord le rattrapage, lu dans le même pipeline.
+    Les échantillons arrivés en retard (antérieurs au dernier timestamp vu) ne sont pas transmis.
+    La boucle s'arrête d'elle-même quand il n'y a plus d'abonnés.
+    """
+
+    def __init__(self, shard, read, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.shard = shard
+        self.read = read
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.cursors = {}
+        self.catch_up = []
+        self.failing = False
+        self.polls = 0
+        self.samples = 0
+        self.thread = None
+
+    def add(self, subscription, key, since):
+        with self.lock:
+            self.subscribers.setdefault(key, set()).add(subscription)
+            if key not in self.cursors:
+                self.cursors[key] = since
+            elif since < self.cursors[key]:
+                self.catch_up.append((subscription, key, since))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name=f"live-tail-{self.shard}", daemon=True)
+                self.thread.start()
+            count = self._subscription_count()
+        LIVE_SUBSCRIBERS.labels(shard=self.shard).set(count)
+
+    def remove(self, subscription, key):
+        with self.lock:
+            subscribers = self.subscribers.get(key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[key]
+                    del self.cursors[key]
+            self.catch_up = [entry for entry in self.catch_up if entry[0] is not subscription]
+            count = self._subscription_count()
+        LIVE_SUBSCRIBERS.labels(shard=self.shard).set(count)
+
+    def _subscription_count(self):
+        return len(set().union(*self.subscribers.values())) if self.subscribers else 0
+
+    def describe(self):
+        with self.lock:
+            return {
+                "series": len(self.cursors),
+                "subscribers": self._subscription_count(),
+                "polls": self.polls,
+                "samples": self.samples,
+                "running": self.thread is not None
+            }
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            with self.lock:
+                if not self.subscribers:
+                    self.thread = None
+                    return
+                cursors = dict(self.cursors)
+                catch_up, self.catch_up = self.catch_up, []
+            try:
+                self._poll(cursors, catch_up)
+                if self.failing:
+                    print(f"✅ Suivi temps réel de {self.shard} rétabli")
+                    self.failing = False
+            except Exception as e:
+                # Shard injoignable : les curseurs n'ont pas avancé, on reprend au tour suivant
+                if not self.failing:
+                    print(f"⚠️ Suivi temps réel de {self.shard} interrompu: {e}")
+                    self.failing = True
+                with self.lock:
+                    self.catch_up = catch_up + self.catch_up
+            time.sleep(max(0.0, self.poll_interval - (time.monotonic() - started)))
+
+    def _poll(self, cursors, catch_up):
+        keys = list(cursors)
+
+        def read_new(conn):
+            pipe = conn.pipeline(transaction=False)
+            for key in keys:
+                pipe.execute_command("TS.RANGE", key, cursors[key] + 1, "+")
+            for _, key, since in catch_up:
+                pipe.execute_command("TS.RANGE", key, since + 1, cursors[key])
+            return pipe.execute(raise_on_error=False)
+
+        with track_redis(self.shard, "TS.RANGE"):
+            replies = self.read(self.shard, read_new)
+        self.polls += 1
+
+        # Rattrapage d'abord, pour que chaque client reçoive ses échantillons dans l'ordre
+        for (subscription, key, _), reply in zip(catch_up, replies[len(keys):]):
+            if reply and not isinstance(reply, Exception):
+                subscription.push("samples", samples_event(key, reply))
+
+        deliveries = []
+        new_samples = 0
+        with self.lock:
+            # Les clients abonnés pendant ce tour recevront ces échantillons avec leur rattrapage
+            waiting = {(id(subscription), key) for subscription, key, _ in self.catch_up}
+            for key, reply in zip(keys, replies):
+                # Série absente (pas encore créée) ou sans nouvel échantillon
+                if not reply or isinstance(reply, Exception) or key not in self.cursors:
+                    continue
+                event = samples_event(key, reply)
+                self.cursors[key] = event["t"][-1]
+                new_samples += len(reply)
+                deliveries.extend((subscription, event) for subscription in self.subscribers[key]
+                                  if (id(subscription), key) not in waiting)
+        for subscription, event in deliveries:
+            subscription.push("samples", event)
+        if new_samples:
+            self.samples += new_samples
+            LIVE_SAMPLES.labels(shard=self.shard).inc(new_samples)
+
+
+class LiveTailHub:
+    """
+    Point d'entrée du flux temps réel : répartit les abonnements sur un suiveur par shard
+    (route(clé) -> shard, read(shard, func) -> func(connexion de lecture du shard))
+    """
+
+    def __init__(self, route, read, poll_interval=DEFAULT_POLL_INTERVAL, max_queue=DEFAULT_QUEUE_SIZE):
+        self.route = route
+        self.read = read
+        self.poll_interval = poll_interval
+        self.max_queue = max_queue
+        self.tailers = {}
+        self.lock = threading.Lock()
+
+    def _tailer(self, shard):
+        with self.lock:
+            tailer = self.tailers.get(shard)
+            if tailer is None:
+                tailer = self.tailers[shard] = ShardTailer(shard, self.read, self.poll_interval)
+            return tailer
+
+    def subscribe(self, keys, since=None):
+        """Abonne un client aux nouveaux échantillons des séries keys postérieurs à since (ms, défaut: maintenant)"""
+        since = int(time.time() * 1000) if since is None else int(since)
+        subscription = LiveSubscription(keys, since, self.max_queue)
+        for key in subscription.keys:
+            self._tailer(self.route(key)).add(subscription, key, since)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        for key in subscription.keys:
+            self._tailer(self.route(key)).remove(subscription, key)
+
+    def stats(self):
+        with self.lock:
+            tailers = dict(self.tailers)
+        return {shard: tailer.describe() for shard, tailer in tailers.items()}
@@ -0,0 +1,362 @@
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import redis
+
+from metrics import export_metrics
+from rollups import RAW_RETENTION_MS, count_created_rules, create_rollups, queue_rollups
+from shard_router import ConsistentHashRouter, LocationRouter
+
+# Valeur moyenne, amplitude des variations et bornes physiques par type de capteur
+SENSOR_PROFILES = {
+    "temperature": {"mean": 22.0, "scale": 3.0, "min": 15.0, "max": 30.0},
+    "humidity": {"mean": 50.0, "scale": 8.0, "min": 30.0, "max": 70.0},
+    "air_quality": {"mean": 60.0, "scale": 25.0, "min": 20.0, "max": 150.0},
+}
+
+
+class WorkloadGenerator:
+    """
+    Générateur de charge vectorisé (NumPy) à la cardinalité de production :
+    - des milliers d'emplacements x types x capteurs
+    - valeurs en marche aléatoire à retour à la moyenne, corrélées entre les capteurs
+      d'un même emplacement (composante commune + composante propre)
+    - gigue sur les timestamps, arrivées dans le désordre et arrivées tardives
+    - contrôle de débit en boucle ouverte : les lots partent selon un calendrier fixe
+      (points/s visés), indépendamment du temps de réponse des shards
+    Les échantillons passent par le chemin d'ingestion par lots (TS.MADD en pipeline).
+    """
+
+    def __init__(self, sharding_system, num_locations=2000, sensors_per_type=5, step_seconds=30,
+                 correlation=0.7, reversion=0.05, jitter_ms=500, out_of_order_ratio=0.01, late_ratio=0.001,
+                 late_max_seconds=300, seed=None):
+        self.system = sharding_system
+        self.num_locations = num_locations
+        self.sensors_per_type = sensors_per_type
+        self.step_ms = int(step_seconds * 1000)
+        self.correlation = correlation
+        self.reversion = reversion
+        # La gigue reste sous la demi-période : deux échantillons d'une série ne partagent jamais un timestamp
+        self.jitter_ms = min(int(jitter_ms), self.step_ms // 2 - 1)
+        self.out_of_order_ratio = out_of_order_ratio
+        self.late_ratio = late_ratio
+        self.late_max_ms = int(late_max_seconds * 1000)
+        self.rng = np.random.default_rng(seed)
+
+        self.locations = [f"site_{i:05d}" for i in range(num_locations)]
+        self.sensor_types = [sensor_type for sensor_type in self.system.sensor_types if sensor_type in SENSOR_PROFILES]
+
+        # Une ligne par série : index d'emplacement, de type et clé
+        location_index, type_index, sensor_index = np.meshgrid(
+            np.arange(num_locations), np.arange(len(self.sensor_types)), np.arange(1, sensors_per_type + 1),
+            indexing="ij")
+        self.location_index = location_index.ravel()
+        self.type_index = type_index.ravel()
+        self.keys = np.array([f"sensor:{self.sensor_types[t]}:{self.locations[loc]}:{sensor_id}"
+                              for loc, t, sensor_id in zip(self.location_index, self.type_index,
+                                                           sensor_index.ravel())], dtype=object)
+
+        profiles = [SENSOR_PROFILES[sensor_type] for sensor_type in self.sensor_types]
+        self.means = np.array([p["mean"] for p in profiles])[self.type_index]
+        self.scales = np.array([p["scale"] for p in profiles])[self.type_index]
+        self.lower = np.array([p["min"] for p in profiles])[self.type_index]
+        self.upper = np.array([p["max"] for p in profiles])[self.type_index]
+
+        # États des marches aléatoires (processus d'Ornstein-Uhlenbeck discrétisés, variance stationnaire 1)
+        self.location_state = self.rng.standard_normal(num_locations)
+        self.sensor_state = self.rng.standard_normal(len(self.keys))
+
+        # Échantillons retenus (désordre, retard) : clé (index), timestamp, valeur, instant d'émission simulé
+        self.pending = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0),
+                        np.empty(0, dtype=np.int64))
+
+        self.shard_names = []
+        self.shard_index = None
+        # Anneau de hachage en mémoire posé par apply_to_layout, à réappliquer après un rechargement du routage
+        self.layout_applied = False
+
+    @property
+    def series_count(self):
+        return len(self.keys)
+
+    # --- Préparation -------------------------------------------------------------
+
+    def apply_to_layout(self):
+        """
+        Étend la topologie du système aux emplacements générés (series_keys, requêtes et
+        archivage voient alors toute la cardinalité). Le routage par emplacement n'ayant pas
+        de shard pour ces sites, un anneau de hachage sur les shards connectés le remplace
+        en mémoire (sans modifier la configuration sauvegardée).
+        """
+        self.system.locations = list(self.locations)
+        self.system.sensor_types = list(self.sensor_types)
+        self.system.num_sensors = self.sensors_per_type
+        self.layout_applied = True
+        if self._use_hash_ring():
+            print("⚠️ Routage par emplacement : utilisation d'un anneau de hachage sur les shards connectés "
+                  "(lancer 'rebalance --router consistent_hash' pour le rendre permanent)")
+        self._route_series()
+
+    def _use_hash_ring(self):
+        """Remplace en mémoire un routage par emplacement par un anneau de hachage ; True si remplacé"""
+        if not isinstance(self.system.router, LocationRouter):
+            return False
+        self.system.router = ConsistentHashRouter(list(self.system.connections))
+        return True
+
+    def _route_series(self):
+        """Calcule une fois le shard de chaque série (recalculé si le routage change)"""
+        shards = np.array([self.system.shard_for_key(key) or "" for key in self.keys], dtype=object)
+        self.shard_names = sorted(set(shards) & set(self.system.connections))
+        self.shard_index = np.full(len(self.keys), -1, dtype=np.int64)
+        for index, shard in enumerate(self.shard_names):
+            self.shard_index[shards == shard] = index
+        unrouted = int((self.shard_index < 0).sum())
+        if unrouted:
+            print(f"⚠️ {unrouted} série(s) sans shard connecté, ignorées")
+
+    def create_series(self, retention_ms=RAW_RETENTION_MS, batch_size=1000, rollups=True):
+        """
+        Crée toutes les séries par pipelines TS.CREATE (une série existante n'est pas une erreur),
+        avec leurs paliers agrégés et règles de compaction comme create_time_series : les paliers
+        manquants d'une série existante sont d'abord remplis avec son historique brut
+        """
+        created = existing = errors = rules = 0
+        for shard, keys in self.system.group_keys_by_shard(self.keys.tolist()).items():
+            conn = self.system.get_connection_for_location(shard)
+            for start in range(0, len(keys), batch_size):
+                pipe = conn.pipeline(transaction=False)
+                batch = []
+                for key in keys[start:start + batch_size]:
+                    _, sensor_type, location, sensor_id = key.split(":")
+                    labels = {"sensorId": sensor_id, "type": sensor_type, "location": location,
+                              "unit_measure": self.system.unit_measures[sensor_type]}
+                    pipe.execute_command("TS.CREATE", key, "RETENTION", retention_ms,
+                                         "LABELS", *[item for pair in labels.items() for item in pair])
+                    batch.append((key, labels))
+
+                # Séries nouvelles : paliers vides créés tels quels ; séries existantes : TS.INFO
+                # pour ne remplir et créer que les paliers manquants
+                rollup_pipe = conn.pipeline(transaction=False)
+                pending = []
+                for (key, labels), reply in zip(batch, pipe.execute(raise_on_error=False)):
+                    if isinstance(reply, redis.exceptions.ResponseError) and "already exists" in str(reply):
+                        existing += 1
+                        is_new = False
+                    elif isinstance(reply, Exception):
+                        errors += 1
+                        continue
+                    else:
+                        created += 1
+                        is_new = True
+                    self.system._index_series(shard, key, labels)
+                    if rollups:
+                        if is_new:
+                            pending.append((key, True, queue_rollups(rollup_pipe, key)))
+                        else:
+                            rollup_pipe.execute_command("TS.INFO", key)
+                            pending.append((key, False, 1))
+                if not pending:
+                    continue
+
+                replies = rollup_pipe.execute(raise_on_error=False)
+                position = 0
+                for key, is_new, count in pending:
+                    key_replies = replies[position:position + count]
+                    position += count
+                    try:
+                        if is_new:
+                            rules += count_created_rules(key_replies)
+                        elif isinstance(key_replies[0], Exception):
+                            raise key_replies[0]
+                        else:
+                            rules += create_rollups(conn, key, backfill=True, info=key_replies[0])
+                    except Exception:
+                        errors += 1
+        if self.system.series_index is not None:
+            self.system.series_index.save()
+        print(f"Séries: {created} créées, {existing} existantes, {errors} erreurs, {rules} règles de compaction "
+              f"({self.series_count} au total sur {len(self.shard_names)} shards)")
+        return {"created": created, "existing": existing, "errors": errors, "rules": rules}
+
+    # --- Génération ----------------------------------------------------------------
+
+    def _step_values(self):
+        """Fait avancer les marches aléatoires d'un pas et renvoie une valeur par série"""
+        decay = 1.0 - self.reversion
+        noise = np.sqrt(1.0 - decay ** 2)
+        self.location_state = decay * self.location_state + noise * self.rng.standard_normal(self.num_locations)
+        self.sensor_state = decay * self.sensor_state + noise * self.rng.standard_normal(len(self.keys))
+        mixed = (self.correlation * self.location_state[self.location_index]
+                 + np.sqrt(1.0 - self.correlation ** 2) * self.sensor_state)
+        return np.round(np.clip(self.means + self.scales * mixed, self.lower, self.upper), 1)
+
+    def tick(self, nominal_ms):
+        """
+        Produit les échantillons d'un pas de temps simulé et renvoie ceux à émettre maintenant
+        (index de série, timestamp, valeur), y compris les échantillons retenus arrivés à échéance
+        """
+        values = self._step_values()
+        timestamps = nominal_ms + self.rng.integers(-self.jitter_ms, self.jitter_ms + 1, len(self.keys))
+
+        # Désordre : émis au pas suivant, après l'échantillon plus récent de la même série ;
+        # retard : émis jusqu'à late_max_ms plus tard
+        draw = self.rng.random(len(self.keys))
+        delays = np.zeros(len(self.keys), dtype=np.int64)
+        late = draw < self.late_ratio
+        out_of_order = ~late & (draw < self.late_ratio + self.out_of_order_ratio)
+        delays[out_of_order] = self.step_ms
+        delays[late] = self.rng.integers(self.step_ms, max(self.step_ms, self.late_max_ms) + 1, int(late.sum()))
+
+        series = np.arange(len(self.keys))
+        held = delays > 0
+        pending_series, pending_ts, pending_values, pending_due = self.pending
+        pending_series = np.concatenate([pending_series, series[held]])
+        pending_ts = np.concatenate([pending_ts, timestamps[held]])
+        pending_values = np.concatenate([pending_values, values[held]])
+        pending_due = np.concatenate([pending_due, nominal_ms + delays[held]])
+
+        due = pending_due <= nominal_ms
+        self.pending = (pending_series[~due], pending_ts[~due], pending_values[~due], pending_due[~due])
+        stats = {"out_of_order": int(out_of_order.sum()), "late": int(late.sum()),
+                 "released": int(due.sum())}
+        return (np.concatenate([series[~held], pending_series[due]]),
+                np.concatenate([timestamps[~held], pending_ts[due]]),
+                np.concatenate([values[~held], pending_values[due]]), stats)
+
+    def _samples_by_shard(self, series, timestamps, values):
+        """Regroupe un lot par shard : {shard: itérable de (clé, timestamp, valeur)}"""
+        shard_of = self.shard_index[series]
+        samples = {}
+        for index, shard in enumerate(self.shard_names):
+            mask = shard_of == index
+            if mask.any():
+                samples[shard] = zip(self.keys[series[mask]].tolist(), timestamps[mask].tolist(),
+                                     values[mask].tolist())
+        return samples
+
+    def run(self, rate, duration_seconds=None, start_time=None, chunk_size=10_000, batch_size=1000,
+            pipeline_depth=8):
+        """
+        Émet en boucle ouverte à `rate` points/s pendant duration_seconds (ou jusqu'à interruption).
+        Le temps simulé avance d'un pas par tick, à partir de start_time (maintenant par défaut) ;
+        à débit élevé il avance donc plus vite que l'horloge.
+        """
+        nominal_ms = int((start_time or datetime.now()).timestamp() * 1000)
+        report = {"points": 0, "errors": 0, "buffered": 0, "out_of_order": 0, "late": 0, "chunks": 0,
+                  "max_schedule_lag_seconds": 0.0, "shards": {}}
+        started = time.perf_counter()
+        scheduled = 0.0
+        next_report = 10.0
+        try:
+            while duration_seconds is None or time.perf_counter() - started < duration_seconds:
+                if self.system.reload_routing():
+                    # La configuration relue remet le routage par emplacement : l'anneau est réappliqué
+                    if self.layout_applied:
+                        self._use_hash_ring()
+                    self._route_series()
+                series, timestamps, values, stats = self.tick(nominal_ms)
+                report["out_of_order"] += stats["out_of_order"]
+                report["late"] += stats["late"]
+                nominal_ms += self.step_ms
+
+                for start in range(0, len(series), chunk_size):
+                    # Boucle ouverte : attendre l'instant prévu, ne jamais ralentir le calendrier si on est en retard
+                    delay = scheduled - (time.perf_counter() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        report["max_schedule_lag_seconds"] = max(report["max_schedule_lag_seconds"], -delay)
+                    end = start + chunk_size
+                    results = self.system.ingest_samples(
+                        self._samples_by_shard(series[start:end], timestamps[start:end], values[start:end]),
+                        batch_size, pipeline_depth)
+                    for shard, result in results.items():
+                        shard_report = report["shards"].setdefault(shard, {"points": 0, "errors": 0})
+                        shard_report["points"] += result["points"]
+                        shard_report["errors"] += result["errors"]
+                        report["points"] += result["points"]
+                        report["errors"] += result["errors"]
+                        # Échantillons en attente d'un nouveau master (bascule Sentinel en cours)
+                        report["buffered"] += result.get("buffered", 0)
+                    report["chunks"] += 1
+                    scheduled += len(series[start:end]) / rate
+
+                elapsed = time.perf_counter() - started
+                if elapsed >= next_report:
+                    print(f"{elapsed:.0f}s - {report['points']} points ({report['points'] / elapsed:.0f} points/s), "
+                          f"{report['errors']} erreurs, retard max {report['max_schedule_lag_seconds']:.2f}s")
+                    next_report += 10.0
+        except KeyboardInterrupt:
+            print("\nArrêt du générateur de charge.")
+
+        report["elapsed_seconds"] = time.perf_counter() - started
+        report["points_per_second"] = report["points"] / report["elapsed_seconds"] if report["elapsed_seconds"] else 0.0
+        report["pending"] = len(self.pending[0])
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Générateur de charge à la cardinalité de production")
+    parser.add_argument("--locations", type=int, default=2000, help="Nombre d'emplacements (par défaut: 2000)")
+    parser.add_argument("--sensors", type=int, default=5, help="Capteurs par type et par emplacement")
+    parser.add_argument("--rate", type=float, default=50_000, help="Débit visé en points/s (boucle ouverte)")
+    parser.add_argument("--duration", type=float, default=60, help="Durée en secondes (0 = jusqu'à Ctrl+C)")
+    parser.add_argument("--step", type=float, default=30, help="Pas de temps simulé entre deux mesures (s)")
+    parser.add_argument("--backfill-hours", type=float, default=0,
+                        help="Démarrer le temps simulé N heures dans le passé")
+    parser.add_argument("--correlation", type=float, default=0.7,
+                        help="Part commune des variations entre capteurs d'un même emplacement (0-1)")
+    parser.add_argument("--jitter-ms", type=int, default=500, help="Gigue maximale des timestamps")
+    parser.add_argument("--out-of-order", type=float, default=0.01, help="Proportion d'échantillons dans le désordre")
+    parser.add_argument("--late", type=float, default=0.001, help="Proportion d'échantillons en retard")
+    parser.add_argument("--late-max", type=float, default=300, help="Retard maximal (s)")
+    parser.add_argument("--chunk-size", type=int, default=10_000, help="Points par lot planifié")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Échantillons par TS.MADD")
+    parser.add_argument("--no-rollups", action="store_true",
+                        help="Ne pas créer les paliers agrégés (mesure sans le coût de la compaction)")
+    parser.add_argument("--seed", type=int, help="Graine aléatoire (reproductibilité)")
+    parser.add_argument("--stand-in", action="store_true", help="Utiliser des shards simulés en mémoire")
+    parser.add_argument("--latency-ms", type=float, default=0.2, help="Latence simulée (avec --stand-in)")
+    args = parser.parse_args()
+
+    if args.stand_in:
+        from timeseries_stand_in import create_stand_in_system
+        # Shards simulés : configuration et index écrits dans un répertoire temporaire
+        os.chdir(tempfile.mkdtemp(prefix="load_generator_"))
+        os.makedirs("sharding_metadata", exist_ok=True)
+        system = create_stand_in_system(latency_ms=args.latency_ms)
+    else:
+        from generate_sharding_data import RedisTrueShardingSystem
+        system = RedisTrueShardingSystem()
+    if not system.connections:
+        print("ERREUR: Aucune connexion valide aux shards Redis.")
+        exit(1)
+
+    generator = WorkloadGenerator(system, num_locations=args.locations, sensors_per_type=args.sensors,
+                                  step_seconds=args.step, correlation=args.correlation, jitter_ms=args.jitter_ms,
+                                  out_of_order_ratio=args.out_of_order, late_ratio=args.late,
+                                  late_max_seconds=args.late_max, seed=args.seed)
+    generator.apply_to_layout()
+    generator.create_series(rollups=not args.no_rollups)
+
+    start_time = datetime.now() - timedelta(hours=args.backfill_hours)
+    print(f"Génération de {args.rate:.0f} points/s sur {generator.series_count} séries...")
+    report = generator.run(args.rate, duration_seconds=args.duration or None, start_time=start_time,
+                           chunk_size=args.chunk_size, batch_size=args.batch_size)
+    export_metrics("load_generator")
+
+    print(f"\nTerminé en {report['elapsed_seconds']:.1f}s: {report['points']} points "
+          f"({report['points_per_second']:.0f} points/s pour {args.rate:.0f} visés), {report['errors']} erreurs")
+    print(f"Dans le désordre: {report['out_of_order']}, en retard: {report['late']}, "
+          f"non émis: {report['pending']}, retard max sur le calendrier: {report['max_schedule_lag_seconds']:.2f}s")
+    for shard, shard_report in sorted(report["shards"].items()):
+        print(f"  - {shard}: {shard_report['points']} points, {shard_report['errors']} erreurs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+
+# Bornes (en secondes) des histogrammes de latence
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base des métriques : une valeur (ou un histogramme) par combinaison de labels"""
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children = {}
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self.lock:
+            child = self.children.get(key)
+            if child is None:
+                child = self.children[key] = self._new_child()
+            return child
+
+    def _samples(self):
+        with self.lock:
+            children = list(self.children.items())
+        for key, child in children:
+            yield from child.samples(self.name, list(zip(self.labelnames, key)))
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}"
+                     for name, labels, value in self._samples())
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value):
+        with self.lock:
+            self.value = value
+
+    def samples(self, name, labels):
+        yield name, labels, self.value
+
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            yield f"{name}_bucket", labels + [("le", _format_value(float(bound)))], cumulative
+        yield f"{name}_bucket", labels + [("le", "+Inf")], count
+        yield f"{name}_sum", labels, total
+        yield f"{name}_count", labels, count
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+
+class MetricsRegistry:
+    """
+    Registre de métriques au format texte Prometheus/OpenMetrics, sans dépendance externe.
+    Les collecteurs enregistrés sont appelés avant chaque export pour mettre à jour
+    les jauges calculées à la demande (utilisation des pools, file d'écriture...).
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def _register(self, metric):
+        with self.lock:
+            # Plusieurs modules peuvent déclarer la même métrique : on réutilise la première
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, func):
+        self.collectors.append(func)
+
+    def render(self):
+        """Exporte toutes les métriques au format texte d'exposition Prometheus"""
+        for collector in list(self.collectors):
+            try:
+                collector()
+            except Exception as e:
+                print(f"Erreur dans un collecteur de métriques: {e}")
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# --- Métriques du projet -------------------------------------------------------
+
+REDIS_COMMANDS = REGISTRY.counter(
+    "redis_commands_total", "Commandes Redis envoyées, par shard, commande et résultat",
+    ("shard", "command", "status"))
+REDIS_COMMAND_DURATION = REGISTRY.histogram(
+    "redis_command_duration_seconds", "Latence des commandes (ou pipelines) Redis par shard", ("shard", "command"))
+REDIS_SAMPLES_WRITTEN = REGISTRY.counter(
+    "redis_samples_written_total", "Échantillons écrits dans Redis par shard", ("shard",))
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "Latence des routes Flask", ("route", "method", "status"))
+ARCHIVER_BATCH_LINES = REGISTRY.histogram(
+    "archiver_batch_lines", "Taille des lots envoyés à InfluxDB (lignes)", (),
+    buckets=(10, 100, 500, 1000, 2500, 5000, 10000, 25000, 50000))
+ARCHIVER_POINTS = REGISTRY.counter("archiver_points_total", "Points lus dans Redis et envoyés à InfluxDB")
+ARCHIVER_LAG = REGISTRY.gauge(
+    "archiver_lag_seconds", "Retard de l'archivage : âge du plus ancien point de reprise des séries")
+POOL_IN_USE = REGISTRY.gauge(
+    "redis_pool_connections_in_use", "Connexions (ou opérations) en cours par shard", ("shard",))
+POOL_MAX = REGISTRY.gauge("redis_pool_connections_max", "Taille maximale du pool de connexions par shard", ("shard",))
+ARCHIVER_QUEUE_DEPTH = REGISTRY.gauge("archiver_queue_depth", "Lots en attente d'écriture vers InfluxDB")
+ARCHIVER_RETRIES = REGISTRY.counter("archiver_write_retries_total", "Nouvelles tentatives d'écriture InfluxDB")
+REDIS_READS = REGISTRY.counter(
+    "redis_reads_total", "Lectures par shard et par cible (replica, master, fallback)", ("shard", "target"))
+REPLICA_LAG = REGISTRY.gauge(
+    "redis_replica_lag_bytes", "Retard de réplication (octets d'offset) par réplica", ("shard", "replica"))
+FAILOVER_SAMPLES = REGISTRY.counter(
+    "redis_failover_samples_total", "Échantillons écrits pendant une bascule (buffered, replayed, spooled, dropped)",
+    ("shard", "outcome"))
+WRITE_BUFFER_DEPTH = REGISTRY.gauge(
+    "redis_write_buffer_samples", "Échantillons en attente d'un nouveau master par shard", ("shard",))
+SPOOL_SAMPLES = REGISTRY.counter(
+    "redis_spool_samples_total",
+    "Échantillons du spool disque (spooled, replayed, duplicate, dead_letter, dropped, corrupted)", ("shard", "outcome"))
+SPOOL_BYTES = REGISTRY.gauge("redis_spool_bytes", "Octets en attente de rejeu dans le spool par shard", ("shard",))
+FAILOVER_WINDOW = REGISTRY.gauge(
+    "redis_failover_window_seconds", "Durée de la dernière indisponibilité en écriture par shard", ("shard",))
+LIVE_SUBSCRIBERS = REGISTRY.gauge(
+    "live_tail_subscribers", "Clients abonnés au flux temps réel (SSE) par shard", ("shard",))
+LIVE_SAMPLES = REGISTRY.counter(
+    "live_tail_samples_total", "Nouveaux échantillons lus par le suiveur d'un shard (une fois, quel que soit "
+    "le nombre de clients)", ("shard",))
+
+
+@contextmanager
+def track_redis(shard, command):
+    """Mesure une commande ou un pipeline Redis et compte les succès et les erreurs"""
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        REDIS_COMMAND_DURATION.labels(shard=shard, command=command).observe(time.perf_counter() - started)
+        REDIS_COMMANDS.labels(shard=shard, command=command, status=status).inc()
+
+
+def collect_pool_usage(connections):
+    """Collecteur : utilisation des pools redis-py (connexions empruntées / taille maximale)"""
+    def collect():
+        for shard, conn in connections.items():
+            pool = getattr(conn, "connection_pool", None)
+            if pool is None:
+                continue
+            POOL_IN_USE.labels(shard=shard).set(len(getattr(pool, "_in_use_connections", ())))
+            POOL_MAX.labels(shard=shard).set(getattr(pool, "max_connections", 0))
+    return collect
+
+
+# --- Export pour les scripts batch -------------------------------------------------
+
+def write_textfile(path, registry=REGISTRY):
+    """Écrit les métriques dans un fichier (collecteur textfile de node_exporter), de façon atomique"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+def push_to_gateway(url, job, registry=REGISTRY, timeout=10):
+    """Envoie les métriques à un Pushgateway Prometheus (PUT /metrics/job/<job>)"""
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/metrics/job/{urllib.parse.quote(job, safe='')}",
+        data=registry.render().encode(), headers={"Content-Type": CONTENT_TYPE}, method="PUT")
+    with urllib.request.urlopen(request, timeout=timeout):
+        pass
+
+
+def export_metrics(job):
+    """
+    Hook d'export des scripts batch : Pushgateway si METRICS_PUSHGATEWAY_URL est défini,
+    fichier texte si METRICS_TEXTFILE est défini (sans effet sinon)
+    """
+    try:
+        if os.environ.get("METRICS_PUSHGATEWAY_URL"):
+            push_to_gateway(os.environ["METRICS_PUSHGATEWAY_URL"], job)
+        if os.environ.get("METRICS_TEXTFILE"):
+            write_textfile(os.environ["METRICS_TEXTFILE"])
+    except Exception as e:
+        print(f"⚠️ Export des métriques impossible: {e}")
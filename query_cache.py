@@ -0,0 +1,176 @@
+import bisect
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def align_range(start_ms, end_ms, bucket_ms):
+    """
+    Aligne une plage sur les buckets : (début du premier bucket, début du bucket en cours,
+    fin du bucket en cours). Deux requêtes faites dans le même bucket ont la même plage.
+    """
+    open_start = end_ms - end_ms % bucket_ms
+    return start_ms - start_ms % bucket_ms, open_start, open_start + bucket_ms - 1
+
+
+def trim_before(rows, start_ms):
+    """Retire les lignes [timestamp, ...] antérieures à start_ms (lignes triées par timestamp)"""
+    index = bisect.bisect_left([row[0] for row in rows], start_ms)
+    return rows[index:]
+
+
+def combine_bucket_stats(buckets):
+    """Statistiques d'une plage à partir des statistiques de ses buckets [ts, min, max, somme, nombre]"""
+    count = sum(bucket[4] for bucket in buckets)
+    if not count:
+        return {}
+    return {
+        "min": min(bucket[1] for bucket in buckets),
+        "max": max(bucket[2] for bucket in buckets),
+        "avg": sum(bucket[3] for bucket in buckets) / count,
+        "count": count
+    }
+
+
+def result_etag(result):
+    """ETag d'un résultat : empreinte de son contenu (identique tant que les données ne changent pas)"""
+    encoded = json.dumps(result, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.sha1(encoded).hexdigest()[:24]
+
+
+def range_etag(response_key):
+    """
+    ETag d'une plage alignée calculé sans lire ses points, à partir de sa clé de réponse (série,
+    résolution, plage alignée et dernier timestamp de la série, lu par TS.GET) : il change quand
+    un échantillon est ajouté ou quand la plage glisse d'un bucket. Un échantillon arrivé en retard
+    (antérieur au dernier) n'est visible qu'avec l'échantillon suivant.
+    """
+    return hashlib.sha1(response_key.encode()).hexdigest()[:24]
+
+
+class QueryResultCache:
+    """
+    Cache des résultats de requêtes de séries, en deux niveaux :
+    - segments : points (et statistiques par bucket) des buckets fermés d'une série pour
+      une résolution donnée. Immuables, ils sont seulement prolongés quand un bucket se ferme
+      et raccourcis quand la plage glisse ; ils expirent après segment_ttl_seconds pour
+      prendre en compte les échantillons arrivés en retard.
+    - réponses : résultat complet (bucket en cours compris) d'une plage alignée et son ETag,
+      servis sans Redis pendant response_ttl_seconds.
+    Cache LRU en mémoire borné en nombre de points, avec un stockage partagé optionnel entre
+    processus (ex: redis.Redis avec decode_responses=True : interface get / set(ex=)).
+    """
+
+    def __init__(self, max_points=2_000_000, segment_ttl_seconds=300, response_ttl_seconds=5.0, shared=None,
+                 prefix="query_cache:"):
+        self.max_points = max_points
+        self.segment_ttl_seconds = segment_ttl_seconds
+        self.response_ttl_seconds = response_ttl_seconds
+        self.shared = shared
+        self.prefix = prefix
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.points = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _weight(value):
+        """Poids d'une entrée pour la borne mémoire : nombre de points et de buckets"""
+        value = value.get("result", value)
+        return len(value.get("points", ())) + len(value.get("buckets", ())) + 1
+
+    def _get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at >= now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+
+        if self.shared is not None:
+            try:
+                stored = self.shared.get(self.prefix + key)
+            except Exception as e:
+                # Le cache partagé est facultatif : en cas d'erreur, on se contente du cache local
+                print(f"⚠️ Cache partagé indisponible: {e}")
+                stored = None
+            if stored:
+                value, ttl = json.loads(stored)
+                self._store(key, value, ttl, share=False)
+                with self.lock:
+                    self.shared_hits += 1
+                return value
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def _remove(self, key):
+        _, value = self.entries.pop(key)
+        self.points -= self._weight(value)
+
+    def _store(self, key, value, ttl_seconds, share=True):
+        if not self.max_points or ttl_seconds <= 0:
+            return
+        weight = self._weight(value)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (time.monotonic() + ttl_seconds, value)
+            self.points += weight
+            while self.points > self.max_points and len(self.entries) > 1:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        if share and self.shared is not None:
+            try:
+                self.shared.set(self.prefix + key, json.dumps([value, ttl_seconds]), ex=max(1, int(ttl_seconds)))
+            except Exception as e:
+                print(f"⚠️ Cache partagé indisponible: {e}")
+
+    def get_segment(self, series_key):
+        return self._get(f"segment:{series_key}")
+
+    def put_segment(self, series_key, segment):
+        self._store(f"segment:{series_key}", segment, self.segment_ttl_seconds)
+
+    def get_response(self, response_key):
+        """Renvoie (résultat, etag) d'une plage alignée encore fraîche, ou None"""
+        cached = self._get(f"response:{response_key}")
+        return (cached["result"], cached["etag"]) if cached else None
+
+    def put_response(self, response_key, result, ttl_seconds=None, etag=None):
+        """Met en cache le résultat d'une plage alignée et renvoie son ETag (empreinte du résultat par défaut)"""
+        etag = result_etag(result) if etag is None else etag
+        ttl = self.response_ttl_seconds if ttl_seconds is None else min(ttl_seconds, self.response_ttl_seconds)
+        self._store(f"response:{response_key}", {"result": result, "etag": etag}, ttl)
+        return etag
+
+    def invalidate(self, prefix=None):
+        """Vide le cache local (ou les entrées dont la clé de série commence par prefix)"""
+        with self.lock:
+            for key in list(self.entries):
+                if prefix is None or key.split(":", 1)[1].startswith(prefix):
+                    self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.shared_hits + self.misses
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.shared_hits) / total if total else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "points": self.points,
+                "max_points": self.max_points
+            }
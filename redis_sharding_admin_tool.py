@@ -8,6 +8,10 @@ import numpy as np
 
 # Import notre module de sharding
 from generate_sharding_data import RedisTrueShardingSystem
+from keyspace_cleanup import KeyspaceCleaner
+from series_index import INDEX_PATH, SeriesIndex
+from shard_migration import ShardMigrator
+from shard_router import router_from_config
 
 
 class RedisShardingAdmin:
@@ -22,16 +26,19 @@ class RedisShardingAdmin:
         status = self.sharding_system.get_shards_status()
 
         # Préparer les données pour tabulate
-        headers = ["Shard", "Statut", "Container", "Clés", "Mémoire"]
+        headers = ["Shard", "Statut", "Container", "Clés", "Mémoire", "Réplicas (sains/total)"]
         rows = []
 
         for location, info in status.items():
+            replicas = info.get("reads", {}).get("replicas")
             rows.append([
                 location,
                 info["status"],
                 info["container"],
                 info.get("keys", "N/A"),
-                info.get("used_memory", "N/A")
+                info.get("used_memory", "N/A"),
+                f"{sum(state['healthy'] for state in replicas.values())}/{len(replicas)}"
+                if replicas is not None else "N/A"
             ])
 
         # Afficher le tableau
@@ -121,26 +128,58 @@ class RedisShardingAdmin:
         except Exception as e:
             print(f"Erreur lors de la création du graphique: {e}")
 
-    def query(self, unit_measure=None, location=None, sensor_type=None, hours=1):
-        """Interroge les données selon différents critères"""
+    def query(self, unit_measure=None, location=None, sensor_type=None, hours=1, timeout=None, resolution=None,
+              aggregation="avg"):
+        """
+        Interroge les données selon différents critères ; avec une résolution ('5m', '1h'...),
+        les données sont agrégées depuis le palier de compaction le plus grossier qui convient
+        """
         now = datetime.now()
         start_time = now - timedelta(hours=hours)
+        resolution_ms = int(parse_duration(resolution).total_seconds() * 1000) if resolution else None
 
         print(f"\nRequête de données du {start_time} au {now} ({hours} heure(s)):")
 
         if unit_measure:
             print(f"Filtrage par unité de mesure: {unit_measure}")
-            results = self.sharding_system.query_by_unit_measure(unit_measure, start_time, now)
+            results = self.sharding_system.query_by_unit_measure(unit_measure, start_time, now, timeout=timeout,
+                                                                  resolution_ms=resolution_ms,
+                                                                  aggregation=aggregation)
             self._display_query_summary(results, unit_measure=unit_measure)
+            self._display_query_report()
 
         elif location and sensor_type:
             print(f"Filtrage par emplacement: {location} et type de capteur: {sensor_type}")
-            results = self.sharding_system.query_location_data(location, sensor_type, start_time, now)
+            results = self.sharding_system.query_location_data(location, sensor_type, start_time, now,
+                                                                timeout=timeout, resolution_ms=resolution_ms,
+                                                                aggregation=aggregation)
             self._display_query_summary({location: {sensor_type: results}})
+            self._display_query_report()
 
         else:
             print("Veuillez spécifier soit une unité de mesure, soit un emplacement et un type de capteur.")
 
+    def _display_query_report(self):
+        """Affiche la latence par shard et signale les résultats partiels"""
+        report = self.sharding_system.last_query_report
+        if not report:
+            return
+
+        plan = report.get("plan")
+        if plan:
+            source = "séries brutes" if plan["tier"] == "raw" else f"palier {plan['tier']}"
+            print(f"\nPlan: {source}, agrégation par buckets de {plan['bucket_ms'] // 1000}s")
+
+        print("\nLatence par shard:")
+        for location, latency in sorted(report["latency_ms"].items(), key=lambda item: item[1]):
+            print(f"  - {location}: {latency:.1f} ms")
+        if report["timed_out"] or report["failed"]:
+            print("⚠️  Résultats partiels:")
+            for location in report["timed_out"]:
+                print(f"  - {location}: délai dépassé")
+            for location, error in report["failed"].items():
+                print(f"  - {location}: {error}")
+
     def _display_query_summary(self, results, unit_measure=None):
         """Affiche un résumé des résultats de requête"""
         if isinstance(results, str):
@@ -181,6 +220,45 @@ class RedisShardingAdmin:
         else:
             print("Aucune donnée trouvée pour la période spécifiée.")
 
+    def rebalance(self, router_type, vnodes=160, shards=None, dry_run=False, **migration_options):
+        """Redistribue les séries selon un nouveau routeur (location, consistent_hash, hash_tag)"""
+        shards = shards or list(self.sharding_system.shards)
+        new_router = router_from_config({"type": router_type, "shards": shards, "vnodes": vnodes}, shards)
+        migrator = ShardMigrator(self.sharding_system, **migration_options)
+        self._run_migration(migrator, new_router, migrator.plan_rebalance(new_router), dry_run)
+
+    def migrate(self, keys, target_shard, dry_run=False, **migration_options):
+        """Déplace des séries précises vers un shard (elles y restent épinglées)"""
+        if target_shard not in self.sharding_system.shards:
+            print(f"Shard inconnu: {target_shard}")
+            return
+        migrator = ShardMigrator(self.sharding_system, **migration_options)
+        new_router, moves = migrator.plan_pins(keys, target_shard)
+        self._run_migration(migrator, new_router, moves, dry_run)
+
+    def _run_migration(self, migrator, new_router, moves, dry_run):
+        """Affiche le plan de migration puis l'exécute (sauf en simulation)"""
+        flows = {}
+        for source, target in moves.values():
+            flows[(source, target)] = flows.get((source, target), 0) + 1
+        print(f"\nPlan de migration vers le routeur '{new_router.name}': {len(moves)} série(s) à déplacer")
+        if flows:
+            rows = [[source, target, count] for (source, target), count in sorted(flows.items())]
+            print(tabulate(rows, headers=["Source", "Cible", "Séries"], tablefmt="grid"))
+        if dry_run:
+            print("Simulation uniquement (--dry-run): aucune donnée déplacée.")
+            return
+
+        report = migrator.migrate(new_router, moves)
+
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        with open(f"{self.output_dir}/migration_report_{timestamp}.json", "w") as f:
+            json.dump(report, f, indent=2)
+        status = "✅ Routage basculé" if report["switched"] else "❌ Routage inchangé"
+        print(f"\n{status}: {report['verified']}/{report['moves']} série(s) vérifiée(s), "
+              f"{report['points_copied']} points copiés")
+        print(f"Rapport sauvegardé: migration_report_{timestamp}.json")
+
     def reset(self, confirm=False):
         """Réinitialise toutes les données des shards (DANGER!)"""
         if not confirm:
@@ -191,21 +269,70 @@ class RedisShardingAdmin:
                 return
 
         print("\nRéinitialisation des shards en cours...")
+        self._run_cleanup("sensor:*")
+        print("\nRéinitialisation terminée.")
+
+    def delete(self, pattern="sensor:*", location=None, sensor_type=None, labels=None, older_than=None,
+               dry_run=False, confirm=False):
+        """
+        Suppression ciblée : séries d'un motif et/ou de labels (emplacement, type...),
+        entières ou seulement leurs échantillons plus anciens que older_than (ex: 7d, 12h)
+        """
+        filters = list(labels or [])
+        if location:
+            filters.append(f"location={location}")
+        if sensor_type:
+            filters.append(f"type={sensor_type}")
+
+        older_than_ms = None
+        if older_than:
+            older_than_ms = int((datetime.now() - parse_duration(older_than)).timestamp() * 1000)
+
+        scope = f"motif '{pattern}'" + (f", filtres {' '.join(filters)}" if filters else "")
+        what = f"échantillons antérieurs à {older_than}" if older_than else "séries entières"
+        print(f"\nSuppression ({what}) - {scope}")
+        if not confirm and not dry_run:
+            confirmation = input("Tapez 'OUI' pour confirmer: ")
+            if confirmation != "OUI":
+                print("Opération annulée.")
+                return
 
-        for location in self.sharding_system.locations:
-            conn = self.sharding_system.get_connection_for_location(location)
-            try:
-                # Supprimer toutes les clés
-                keys = conn.keys("sensor:*")
-                if keys:
-                    deleted = conn.delete(*keys)
-                    print(f"Shard {location}: {deleted} clé(s) supprimée(s)")
-                else:
-                    print(f"Shard {location}: aucune clé à supprimer")
-            except Exception as e:
-                print(f"Erreur lors de la réinitialisation du shard {location}: {e}")
+        self._run_cleanup(pattern, filters, older_than_ms, dry_run)
+
+    def _run_cleanup(self, pattern, filters=None, older_than_ms=None, dry_run=False):
+        """Lance la suppression sur tous les shards en parallèle et affiche le résultat par shard"""
+        cleaner = KeyspaceCleaner(self.sharding_system.connections)
+        results = cleaner.run(pattern, filters, older_than_ms, dry_run)
+
+        rows = []
+        deleted_keys = []
+        for shard, result in results.items():
+            if "error" in result:
+                print(f"Erreur lors de la suppression sur le shard {shard}: {result['error']}")
+                continue
+            rows.append([shard, result["matched"], result["deleted_keys"], result["trimmed_series"],
+                         result["errors"], f"{result['elapsed_seconds']:.2f}s"])
+            if not dry_run:
+                deleted_keys.extend(result["keys"])
+        headers = ["Shard", "Séries trouvées", "Séries supprimées", "Séries élaguées", "Erreurs", "Durée"]
+        print(tabulate(rows, headers=headers, tablefmt="grid"))
+        if dry_run:
+            print("Simulation uniquement (--dry-run): rien n'a été supprimé.")
+
+        # Retirer les séries supprimées de l'index de recherche du tableau de bord
+        if deleted_keys and os.path.exists(INDEX_PATH):
+            series_index = SeriesIndex.load()
+            for key in deleted_keys:
+                series_index.remove(key)
+            series_index.save()
 
-        print("\nRéinitialisation terminée.")
+
+def parse_duration(text):
+    """Convertit une durée '30m', '12h' ou '7d' en timedelta"""
+    units = {"m": "minutes", "h": "hours", "d": "days"}
+    if not text or text[-1] not in units:
+        raise ValueError(f"Durée invalide '{text}' (exemples: 30m, 12h, 7d)")
+    return timedelta(**{units[text[-1]]: float(text[:-1])})
 
 
 def parse_arguments():
@@ -225,11 +352,57 @@ def parse_arguments():
     query_parser.add_argument('--location', type=str, help='Filtrer par emplacement')
     query_parser.add_argument('--type', type=str, help='Filtrer par type de capteur')
     query_parser.add_argument('--hours', type=int, default=1, help='Nombre d\'heures à considérer (par défaut: 1)')
+    query_parser.add_argument('--timeout', type=float, default=None,
+                              help='Délai maximal par shard en secondes (par défaut: 5)')
+    query_parser.add_argument('--resolution', type=str,
+                              help='Résolution des données agrégées (ex: 5m, 1h, 1d ; par défaut: brutes)')
+    query_parser.add_argument('--aggregation', choices=['avg', 'min', 'max'], default='avg',
+                              help='Agrégation utilisée avec --resolution (par défaut: avg)')
+
+    # Options communes aux commandes de migration
+    def add_migration_arguments(command_parser):
+        command_parser.add_argument('--chunk-size', type=int, default=5000,
+                                    help='Points copiés par lot TS.RANGE/TS.MADD (par défaut: 5000)')
+        command_parser.add_argument('--max-rate', type=int, default=50000,
+                                    help='Débit maximal de copie en points/s, 0 = illimité (par défaut: 50000)')
+        command_parser.add_argument('--grace-seconds', type=float, default=60,
+                                    help='Délai laissé aux générateurs pour relire le routage (par défaut: 60)')
+        command_parser.add_argument('--keep-source', action='store_true',
+                                    help='Conserver les séries sources après la bascule')
+        command_parser.add_argument('--dry-run', action='store_true',
+                                    help='Afficher le plan de migration sans déplacer de données')
+
+    # Commande rebalance
+    rebalance_parser = subparsers.add_parser('rebalance', help='Redistribuer les séries selon un nouveau routeur')
+    rebalance_parser.add_argument('--router', type=str, required=True,
+                                  choices=['location', 'consistent_hash', 'hash_tag'], help='Nouveau routeur')
+    rebalance_parser.add_argument('--vnodes', type=int, default=160,
+                                  help='Nœuds virtuels par shard sur l\'anneau (par défaut: 160)')
+    rebalance_parser.add_argument('--shards', type=str, help='Shards de l\'anneau, séparés par des virgules')
+    add_migration_arguments(rebalance_parser)
+
+    # Commande migrate
+    migrate_parser = subparsers.add_parser('migrate', help='Déplacer des séries vers un shard')
+    migrate_parser.add_argument('--keys', type=str, nargs='+', required=True, help='Clés des séries à déplacer')
+    migrate_parser.add_argument('--to', type=str, required=True, help='Shard cible')
+    add_migration_arguments(migrate_parser)
 
     # Commande reset
     reset_parser = subparsers.add_parser('reset', help='Réinitialiser toutes les données (DANGER!)')
     reset_parser.add_argument('--force', action='store_true', help='Forcer la réinitialisation sans confirmation')
 
+    # Commande delete
+    delete_parser = subparsers.add_parser('delete', help='Supprimer des séries ou des échantillons anciens')
+    delete_parser.add_argument('--pattern', type=str, default='sensor:*',
+                               help='Motif des clés (par défaut: sensor:*)')
+    delete_parser.add_argument('--location', type=str, help='Filtrer par emplacement')
+    delete_parser.add_argument('--type', type=str, help='Filtrer par type de capteur')
+    delete_parser.add_argument('--label', type=str, action='append', help='Filtre label=valeur (répétable)')
+    delete_parser.add_argument('--older-than', type=str,
+                               help='Supprimer seulement les échantillons plus anciens (TS.DEL, ex: 30m, 12h, 7d)')
+    delete_parser.add_argument('--dry-run', action='store_true', help='Compter sans supprimer')
+    delete_parser.add_argument('--force', action='store_true', help='Supprimer sans confirmation')
+
     return parser.parse_args()
 
 
@@ -242,8 +415,18 @@ if __name__ == "__main__":
     elif args.command == 'distribution':
         admin.distribution()
     elif args.command == 'query':
-        admin.query(args.unit, args.location, args.type, args.hours)
+        admin.query(args.unit, args.location, args.type, args.hours, args.timeout, args.resolution, args.aggregation)
+    elif args.command in ('rebalance', 'migrate'):
+        options = {"chunk_size": args.chunk_size, "max_points_per_second": args.max_rate,
+                   "grace_seconds": args.grace_seconds, "keep_source": args.keep_source}
+        if args.command == 'rebalance':
+            admin.rebalance(args.router, args.vnodes, args.shards.split(',') if args.shards else None,
+                            args.dry_run, **options)
+        else:
+            admin.migrate(args.keys, args.to, args.dry_run, **options)
     elif args.command == 'reset':
         admin.reset(args.force)
+    elif args.command == 'delete':
+        admin.delete(args.pattern, args.location, args.type, args.label, args.older_than, args.dry_run, args.force)
     else:
         print("Commande non reconnue. Utilisez --help pour voir les options disponibles.")
\ No newline at end of file
@@ -0,0 +1,219 @@
+import itertools
+import threading
+import time
+
+import redis
+
+from metrics import REDIS_READS, REPLICA_LAG
+
+# Retard de réplication toléré pour servir une lecture depuis un réplica (octets d'offset)
+DEFAULT_MAX_LAG_BYTES = 1_000_000
+
+# Choix du réplica : latence minimale, à tour de rôle, ou lectures sur le master uniquement
+READ_STRATEGIES = ("least_latency", "round_robin", "master")
+
+# Erreurs d'un réplica qui justifient de relire sur le master
+REPLICA_UNAVAILABLE_ERRORS = ("MASTERDOWN", "LOADING")
+
+
+def translate_address(address, address_map=None):
+    """
+    Traduit une adresse annoncée par Sentinel (IP interne au réseau Docker) en adresse
+    joignable depuis l'hôte, d'après address_map {"ip:port": "hôte:port"}
+    """
+    host, port = address
+    mapped = (address_map or {}).get(f"{host}:{port}")
+    if mapped:
+        host, port = mapped.rsplit(":", 1)
+    return host, int(port)
+
+
+class ShardEndpoints:
+    """
+    Connexions d'un shard séparées par usage :
+    - écritures : le master (découvert via Sentinel quand il est configuré)
+    - lectures : un réplica sain (lien de réplication actif et retard d'offset sous
+      max_lag_bytes), choisi par latence minimale ou à tour de rôle ; repli automatique
+      sur le master si aucun réplica ne convient ou si la lecture échoue sur le réplica
+    L'état des réplicas (INFO replication et latence) est rafraîchi en arrière-plan.
+    """
+
+    def __init__(self, shard, master, replicas=None, strategy="least_latency", max_lag_bytes=DEFAULT_MAX_LAG_BYTES,
+                 refresh_interval=1.0):
+        if strategy not in READ_STRATEGIES:
+            raise ValueError(f"Stratégie de lecture inconnue '{strategy}' ({', '.join(READ_STRATEGIES)})")
+        self.shard = shard
+        self.master = master
+        self.replicas = dict(replicas or {})
+        self.strategy = strategy
+        self.max_lag_bytes = max_lag_bytes
+        self.refresh_interval = refresh_interval
+        self.state = {name: {"healthy": False, "lag_bytes": None, "latency_ms": None, "error": None}
+                      for name in self.replicas}
+        self.lock = threading.Lock()
+        self.refreshed_at = None
+        self.refreshing = False
+        self.turn = itertools.count()
+
+    # --- État des réplicas ---------------------------------------------------------
+
+    def refresh(self):
+        """Mesure le retard (offset master - offset réplica) et la latence de chaque réplica"""
+        master_offset = master_error = None
+        try:
+            master_offset = int(self.master.info("replication").get("master_repl_offset", 0))
+        except Exception as e:
+            # Sans l'offset du master, le retard des réplicas ne peut pas être borné
+            master_error = f"master injoignable: {e}"
+
+        for name, conn in self.replicas.items():
+            started = time.perf_counter()
+            try:
+                info = conn.info("replication")
+                latency_ms = (time.perf_counter() - started) * 1000
+                previous = self.state[name]["latency_ms"]
+                if previous is not None:
+                    # Moyenne mobile : un pic isolé ne fait pas changer de réplica
+                    latency_ms = 0.7 * previous + 0.3 * latency_ms
+                lag = None if master_offset is None else max(0, master_offset - int(info.get("slave_repl_offset", 0)))
+                link_up = info.get("role") == "slave" and info.get("master_link_status") == "up"
+                state = {"healthy": link_up and lag is not None and lag <= self.max_lag_bytes,
+                         "lag_bytes": lag, "latency_ms": latency_ms, "error": master_error}
+                if not link_up:
+                    state["error"] = "lien de réplication interrompu"
+                elif lag is not None and lag > self.max_lag_bytes:
+                    state["error"] = f"retard de {lag} octets (max {self.max_lag_bytes})"
+                if lag is not None:
+                    REPLICA_LAG.labels(shard=self.shard, replica=name).set(lag)
+            except Exception as e:
+                state = {"healthy": False, "lag_bytes": None, "latency_ms": None, "error": str(e)}
+            with self.lock:
+                self.state[name] = state
+
+        self.refreshed_at = time.monotonic()
+        self.refreshing = False
+
+    def _maybe_refresh(self):
+        """Premier rafraîchissement synchrone, les suivants en arrière-plan sans bloquer les lectures"""
+        if not self.replicas or self.strategy == "master":
+            return
+        if self.refreshed_at is None:
+            self.refresh()
+            return
+        with self.lock:
+            if self.refreshing or time.monotonic() - self.refreshed_at < self.refresh_interval:
+                return
+            self.refreshing = True
+        threading.Thread(target=self.refresh, daemon=True).start()
+
+    def _mark_unhealthy(self, name, error):
+        with self.lock:
+            self.state[name] = dict(self.state[name], healthy=False, error=str(error))
+
+    # --- Lectures --------------------------------------------------------------------
+
+    def read_target(self):
+        """Renvoie (nom, connexion) de la cible de lecture : un réplica sain ou le master"""
+        self._maybe_refresh()
+        with self.lock:
+            healthy = [name for name, state in self.state.items() if state["healthy"]]
+        if not healthy or self.strategy == "master":
+            return "master", self.master
+        if self.strategy == "round_robin":
+            name = healthy[next(self.turn) % len(healthy)]
+        else:
+            name = min(healthy, key=lambda candidate: self.state[candidate]["latency_ms"])
+        return name, self.replicas[name]
+
+    def read_connection(self):
+        return self.read_target()[1]
+
+    @staticmethod
+    def _unavailable_reply(result):
+        """
+        Erreur de réplica indisponible parmi les réponses d'un pipeline exécuté avec
+        raise_on_error=False (une réponse par clé), ou None
+        """
+        if not isinstance(result, list):
+            return None
+        for reply in result:
+            if isinstance(reply, redis.exceptions.ResponseError) and str(reply).startswith(REPLICA_UNAVAILABLE_ERRORS):
+                return reply
+        return None
+
+    def execute_read(self, func):
+        """Exécute func(connexion) sur la cible de lecture, puis sur le master si le réplica est indisponible"""
+        name, conn = self.read_target()
+        if name == "master":
+            REDIS_READS.labels(shard=self.shard, target="master").inc()
+            return func(conn)
+        try:
+            result = func(conn)
+            error = self._unavailable_reply(result)
+            if error is None:
+                REDIS_READS.labels(shard=self.shard, target="replica").inc()
+                return result
+            self._mark_unhealthy(name, error)
+        except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError) as e:
+            self._mark_unhealthy(name, e)
+        except redis.exceptions.ResponseError as e:
+            if not str(e).startswith(REPLICA_UNAVAILABLE_ERRORS):
+                raise
+            self._mark_unhealthy(name, e)
+        REDIS_READS.labels(shard=self.shard, target="fallback").inc()
+        return func(self.master)
+
+    def describe(self):
+        """État des réplicas pour le statut des shards"""
+        with self.lock:
+            return {
+                "strategy": self.strategy,
+                "max_lag_bytes": self.max_lag_bytes,
+                "replicas": {name: dict(state) for name, state in self.state.items()}
+            }
+
+
+def endpoints_from_config(shard, config, password=None, strategy="least_latency",
+                          max_lag_bytes=DEFAULT_MAX_LAG_BYTES, socket_timeout=5):
+    """
+    Construit les connexions d'un shard à partir de sa configuration :
+    master découvert via Sentinel ("sentinel": {"master_name", "sentinels"}) s'il répond,
+    sinon l'adresse statique (host, port) ; réplicas déclarés ("replicas") ou, à défaut,
+    annoncés par Sentinel. Les adresses annoncées passent par "address_map" : quand elle est
+    configurée, une adresse absente de la table (IP interne au réseau Docker) n'est pas
+    joignable depuis l'hôte et n'est pas essayée. Opérations bloquantes (Sentinel, ping) :
+    à appeler au premier usage du shard, pas à l'import d'un module.
+    """
+    def connect(host, port):
+        return redis.Redis(host=host, port=port, password=password, decode_responses=True,
+                           socket_timeout=socket_timeout)
+
+    master = None
+    replicas = {}
+    address_map = config.get("address_map")
+    sentinel_config = config.get("sentinel")
+    if sentinel_config:
+        try:
+            sentinel = redis.Sentinel([tuple(address) for address in sentinel_config["sentinels"]],
+                                      socket_timeout=0.5)
+            announced = sentinel.discover_master(sentinel_config["master_name"])
+            if address_map is not None and f"{announced[0]}:{announced[1]}" not in address_map:
+                raise ValueError(f"adresse annoncée {announced[0]}:{announced[1]} absente de address_map")
+            host, port = translate_address(announced, address_map)
+            candidate = connect(host, port)
+            candidate.ping()
+            master = candidate
+            if not config.get("replicas"):
+                for address in sentinel.discover_slaves(sentinel_config["master_name"]):
+                    if address_map is None or f"{address[0]}:{address[1]}" in address_map:
+                        host, port = translate_address(address, address_map)
+                        replicas[f"{host}:{port}"] = connect(host, port)
+        except Exception as e:
+            print(f"⚠️ Master de {shard} introuvable via Sentinel ({e}), adresse statique utilisée")
+
+    if master is None:
+        master = connect(config["host"], config["port"])
+    for replica in config.get("replicas", []):
+        replicas[replica.get("container") or f"{replica['host']}:{replica['port']}"] = connect(
+            replica["host"], replica["port"])
+    return ShardEndpoints(shard, master, replicas, strategy, max_lag_bytes)
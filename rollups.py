@@ -0,0 +1,254 @@
+import redis
+
+from downsampling import choose_bucket_ms
+
+# Rétention des séries brutes
+RAW_RETENTION_MS = 30 * 24 * 3600 * 1000
+
+# Paliers d'agrégation, du plus fin au plus grossier, chacun avec sa propre rétention
+ROLLUP_TIERS = (
+    {"name": "1m", "bucket_ms": 60_000, "retention_ms": 90 * 24 * 3600 * 1000},
+    {"name": "1h", "bucket_ms": 3600_000, "retention_ms": 365 * 24 * 3600 * 1000},
+    {"name": "1d", "bucket_ms": 24 * 3600_000, "retention_ms": 5 * 365 * 24 * 3600 * 1000},
+)
+
+ROLLUP_AGGREGATIONS = ("avg", "min", "max")
+
+
+def rollup_key(key, tier, aggregation):
+    """Clé de la série agrégée : sensor:<type>:<emplacement>:<id>:<agrégation>_<palier>"""
+    return f"{key}:{aggregation}_{tier['name']}"
+
+
+def rollup_keys(key):
+    """Toutes les séries agrégées d'une série brute"""
+    return [rollup_key(key, tier, aggregation) for tier in ROLLUP_TIERS for aggregation in ROLLUP_AGGREGATIONS]
+
+
+def rollup_pair(key, tier, aggregation, duplicate_policy=None):
+    """Commandes TS.CREATE et TS.CREATERULE d'un palier agrégé d'une série brute"""
+    destination = rollup_key(key, tier, aggregation)
+    return (("TS.CREATE", destination, "RETENTION", tier["retention_ms"],
+             *(["DUPLICATE_POLICY", duplicate_policy] if duplicate_policy else []),
+             "LABELS", "rollup_of", key, "tier", tier["name"], "aggregation", aggregation),
+            ("TS.CREATERULE", key, destination, "AGGREGATION", aggregation, tier["bucket_ms"]))
+
+
+def rollup_commands(key, duplicate_policy=None):
+    """
+    Commandes de création des séries agrégées d'une série brute et de leurs règles de
+    compaction (TS.CREATERULE), une paire TS.CREATE / TS.CREATERULE par palier et agrégation.
+    Les séries agrégées portent leurs propres labels (rollup_of, tier, aggregation) :
+    les filtres type=... ou location=... ne renvoient que les séries brutes.
+    """
+    return [command for tier in ROLLUP_TIERS for aggregation in ROLLUP_AGGREGATIONS
+            for command in rollup_pair(key, tier, aggregation, duplicate_policy)]
+
+
+def queue_rollups(pipe, key, duplicate_policy=None):
+    """Ajoute au pipeline la création des paliers agrégés ; renvoie le nombre de commandes ajoutées"""
+    commands = rollup_commands(key, duplicate_policy)
+    for command in commands:
+        pipe.execute_command(*command)
+    return len(commands)
+
+
+def count_created_rules(replies):
+    """
+    Interprète les réponses de queue_rollups : nombre de règles créées. Les séries et règles
+    déjà présentes sont ignorées (création idempotente), les autres erreurs sont levées.
+    """
+    created = 0
+    for index, reply in enumerate(replies):
+        if isinstance(reply, redis.exceptions.ResponseError) and "already" in str(reply):
+            continue
+        if isinstance(reply, Exception):
+            raise reply
+        if index % 2:
+            created += 1
+    return created
+
+
+def _info_dict(info):
+    return info if isinstance(info, dict) else {info[i]: info[i + 1] for i in range(0, len(info) - 1, 2)}
+
+
+def missing_rollups(key, info):
+    """Paliers [(palier, agrégation)] d'une série sans règle de compaction, d'après sa réponse TS.INFO"""
+    existing = {rule[0] for rule in _info_dict(info).get("rules") or []}
+    return [(tier, aggregation) for tier in ROLLUP_TIERS for aggregation in ROLLUP_AGGREGATIONS
+            if rollup_key(key, tier, aggregation) not in existing]
+
+
+def create_rollups(conn, key, duplicate_policy=None, backfill=False, info=None):
+    """
+    Crée les paliers agrégés d'une série en un seul pipeline ; renvoie le nombre de règles créées.
+    Avec backfill, pour une série qui contient déjà des données : seules les règles manquantes
+    sont créées, après avoir rempli leurs paliers avec l'historique brut (une règle de compaction
+    n'agrège que les échantillons ajoutés après sa création). info : réponse TS.INFO déjà lue.
+    """
+    if not backfill:
+        pipe = conn.pipeline(transaction=False)
+        queue_rollups(pipe, key, duplicate_policy)
+        return count_created_rules(pipe.execute(raise_on_error=False))
+
+    info = _info_dict(conn.execute_command("TS.INFO", key) if info is None else info)
+    missing = missing_rollups(key, info)
+    if not missing:
+        return 0
+    pairs = [rollup_pair(key, tier, aggregation, duplicate_policy) for tier, aggregation in missing]
+
+    pipe = conn.pipeline(transaction=False)
+    for create, _ in pairs:
+        pipe.execute_command(*create)
+    for reply in pipe.execute(raise_on_error=False):
+        if isinstance(reply, Exception) and "already" not in str(reply):
+            raise reply
+    if int(info.get("totalSamples") or 0):
+        backfill_rollups(conn, key, missing, int(info["lastTimestamp"]))
+
+    pipe = conn.pipeline(transaction=False)
+    for _, rule in pairs:
+        pipe.execute_command(*rule)
+    # Réponses interprétées comme celles de queue_rollups (une paire création / règle)
+    return count_created_rules([reply for rule_reply in pipe.execute(raise_on_error=False)
+                                for reply in ("OK", rule_reply)])
+
+
+def backfill_ranges(key, rollups, last_timestamp_ms):
+    """
+    Lectures de remplissage de paliers agrégés [(palier, agrégation)] : [(série agrégée, TS.RANGE
+    ... AGGREGATION sur les buckets terminés)]. Le bucket en cours sera écrit par la règle de compaction.
+    """
+    ranges = []
+    for tier, aggregation in rollups:
+        end_ms = last_timestamp_ms - last_timestamp_ms % tier["bucket_ms"] - 1
+        if end_ms >= 0:
+            ranges.append((rollup_key(key, tier, aggregation),
+                           ("TS.RANGE", key, 0, end_ms, "AGGREGATION", aggregation, tier["bucket_ms"])))
+    return ranges
+
+
+def backfill_writes(destination, buckets, batch_size=1000):
+    """TS.MADD par lots des buckets [(timestamp, valeur)] lus par backfill_ranges"""
+    return [("TS.MADD", *[field for timestamp, value in buckets[start:start + batch_size]
+                          for field in (destination, timestamp, value)])
+            for start in range(0, len(buckets), batch_size)]
+
+
+def backfill_rollups(conn, key, rollups, last_timestamp_ms):
+    """
+    Remplit des paliers agrégés [(palier, agrégation)] à partir des données brutes de la série :
+    TS.RANGE ... AGGREGATION sur les buckets terminés, puis TS.MADD. Renvoie le nombre de buckets écrits.
+    """
+    ranges = backfill_ranges(key, rollups, last_timestamp_ms)
+    pipe = conn.pipeline(transaction=False)
+    for _, command in ranges:
+        pipe.execute_command(*command)
+
+    written = 0
+    madd = conn.pipeline(transaction=False)
+    for (destination, _), reply in zip(ranges, pipe.execute(raise_on_error=False)):
+        if isinstance(reply, Exception):
+            raise reply
+        for command in backfill_writes(destination, reply):
+            madd.execute_command(*command)
+        written += len(reply)
+    if written:
+        madd.execute(raise_on_error=False)
+    return written
+
+
+def plan_query(start_ms, end_ms, now_ms, aggregation="avg", max_points=None, bucket_ms=None):
+    """
+    Choisit la série à interroger : le palier le plus grossier dont le bucket ne dépasse
+    pas la résolution demandée (et la divise) et dont la rétention couvre le début de la plage.
+    Renvoie {"tier": nom ou "raw", "bucket_ms": résolution, "tier_bucket_ms": bucket du palier}.
+    """
+    if bucket_ms is None:
+        bucket_ms = choose_bucket_ms(start_ms, end_ms, max_points) if max_points else None
+    plan = {"tier": "raw", "bucket_ms": bucket_ms, "tier_bucket_ms": None}
+    if not bucket_ms or aggregation not in ROLLUP_AGGREGATIONS:
+        return plan
+    for tier in reversed(ROLLUP_TIERS):
+        if tier["bucket_ms"] <= bucket_ms and bucket_ms % tier["bucket_ms"] == 0 \
+                and start_ms >= now_ms - tier["retention_ms"]:
+            return dict(plan, tier=tier["name"], tier_bucket_ms=tier["bucket_ms"])
+    if start_ms < now_ms - RAW_RETENTION_MS:
+        # Plage plus ancienne que les données brutes : résolution arrondie au palier
+        # le plus fin qui couvre encore le début de la plage
+        for tier in ROLLUP_TIERS:
+            if start_ms >= now_ms - tier["retention_ms"]:
+                return {"tier": tier["name"], "bucket_ms": -(-bucket_ms // tier["bucket_ms"]) * tier["bucket_ms"],
+                        "tier_bucket_ms": tier["bucket_ms"]}
+    return plan
+
+
+def queue_planned_range(pipe, key, start_ms, end_ms, aggregation, plan):
+    """
+    Ajoute au pipeline les TS.RANGE d'une requête planifiée : le palier agrégé jusqu'au
+    dernier bucket complet, puis la fin de plage (bucket en cours, pas encore compacté)
+    agrégée depuis la série brute. Renvoie le nombre de réponses à fusionner.
+    """
+    if plan["tier"] == "raw":
+        if plan["bucket_ms"]:
+            pipe.execute_command("TS.RANGE", key, start_ms, end_ms, "AGGREGATION", aggregation, plan["bucket_ms"])
+        else:
+            pipe.execute_command("TS.RANGE", key, start_ms, end_ms)
+        return 1
+
+    tier = next(tier for tier in ROLLUP_TIERS if tier["name"] == plan["tier"])
+    # Le palier ne contient que des buckets complets ; la fin de plage est lue dans la série brute,
+    # à partir du début du bucket de requête en cours pour ne pas couper un bucket en deux
+    tail_start = max(start_ms, end_ms - end_ms % plan["bucket_ms"])
+    count = 1
+    if tail_start > start_ms:
+        # Rien à lire dans le palier si la plage tient dans un seul bucket de requête
+        pipe.execute_command("TS.RANGE", rollup_key(key, tier, aggregation), start_ms, tail_start - 1,
+                             "AGGREGATION", aggregation, plan["bucket_ms"])
+        count += 1
+    pipe.execute_command("TS.RANGE", key, tail_start, end_ms, "AGGREGATION", aggregation, plan["bucket_ms"])
+    return count
+
+
+def merge_planned_replies(replies):
+    """Fusionne les réponses d'une requête planifiée en une liste [(timestamp, valeur)]"""
+    points = []
+    for reply in replies:
+        if isinstance(reply, Exception):
+            raise reply
+        points.extend((int(point[0]), float(point[1])) for point in reply)
+    return points
+
+
+def _missing_rollup(error, plan):
+    return plan["tier"] != "raw" and isinstance(error, redis.exceptions.ResponseError) \
+        and "does not exist" in str(error)
+
+
+def fetch_planned_ranges(conn, keys, start_ms, end_ms, aggregation, plan):
+    """
+    Exécute une requête planifiée pour plusieurs séries d'un shard en un seul pipeline :
+    {clé: [(timestamp, valeur)] ou exception}. Les séries sans paliers agrégés (créées
+    avant les règles de compaction) sont relues depuis la série brute.
+    """
+    pipe = conn.pipeline(transaction=False)
+    counts = [queue_planned_range(pipe, key, start_ms, end_ms, aggregation, plan) for key in keys]
+    replies = pipe.execute(raise_on_error=False)
+
+    results = {}
+    missing = []
+    position = 0
+    for key, count in zip(keys, counts):
+        try:
+            results[key] = merge_planned_replies(replies[position:position + count])
+        except Exception as e:
+            if _missing_rollup(e, plan):
+                missing.append(key)
+            results[key] = e
+        position += count
+
+    if missing:
+        raw_plan = dict(plan, tier="raw", tier_bucket_ms=None)
+        results.update(fetch_planned_ranges(conn, missing, start_ms, end_ms, aggregation, raw_plan))
+    return results
@@ -0,0 +1,124 @@
+import signal
+import threading
+import time
+import traceback
+
+
+class PeriodicTask:
+    """
+    Tâche périodique exécutée dans son propre thread, sur une grille d'horaires fixe
+    (pas de dérive) : si une exécution déborde sur les suivantes, celles-ci sont
+    sautées au lieu de s'enchaîner ou de se chevaucher
+    """
+
+    def __init__(self, name, interval_seconds, func, run_immediately=True, lock=None):
+        self.name = name
+        self.interval_seconds = interval_seconds
+        self.func = func
+        self.run_immediately = run_immediately
+        # Verrou optionnel partagé entre tâches qui ne doivent pas s'exécuter en même temps
+        self.lock = lock
+        self.thread = None
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_duration = None
+
+    def start(self, stop_event):
+        self.thread = threading.Thread(target=self._run, args=(stop_event,), name=f"task-{self.name}", daemon=True)
+        self.thread.start()
+
+    def _run(self, stop_event):
+        next_run = time.monotonic() + (0 if self.run_immediately else self.interval_seconds)
+        while not stop_event.wait(max(0.0, next_run - time.monotonic())):
+            started = time.monotonic()
+            try:
+                if self.lock is not None:
+                    with self.lock:
+                        self.func()
+                else:
+                    self.func()
+                self.runs += 1
+            except Exception as e:
+                self.failures += 1
+                print(f"❌ Erreur dans la tâche '{self.name}': {e}")
+                traceback.print_exc()
+            self.last_duration = time.monotonic() - started
+
+            # Prochaine échéance calculée depuis la grille, pas depuis la fin de l'exécution
+            next_run += self.interval_seconds
+            now = time.monotonic()
+            if next_run <= now:
+                missed = int((now - next_run) // self.interval_seconds) + 1
+                self.skipped += missed
+                next_run += missed * self.interval_seconds
+                print(f"⚠️ Tâche '{self.name}' en retard: {missed} exécution(s) sautée(s)")
+
+    def join(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def stats(self):
+        return {
+            "interval_seconds": self.interval_seconds,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_duration_seconds": self.last_duration
+        }
+
+
+class TaskScheduler:
+    """Exécute des tâches périodiques indépendantes et gère leur arrêt propre"""
+
+    def __init__(self):
+        self.tasks = []
+        self.stop_event = threading.Event()
+        self.shutdown_hooks = []
+
+    def add_task(self, name, interval_seconds, func, run_immediately=True, lock=None):
+        task = PeriodicTask(name, interval_seconds, func, run_immediately, lock)
+        self.tasks.append(task)
+        return task
+
+    def add_shutdown_hook(self, func):
+        """Fonction appelée après l'arrêt des tâches (ex: vider les lots en cours)"""
+        self.shutdown_hooks.append(func)
+
+    def start(self):
+        for task in self.tasks:
+            task.start(self.stop_event)
+
+    def stop(self, timeout=None):
+        """Demande l'arrêt, attend la fin des exécutions en cours puis lance les hooks"""
+        self.stop_event.set()
+        for task in self.tasks:
+            task.join(timeout)
+        for hook in self.shutdown_hooks:
+            try:
+                hook()
+            except Exception as e:
+                print(f"❌ Erreur lors de l'arrêt: {e}")
+
+    def run_forever(self):
+        """Démarre les tâches et bloque jusqu'à Ctrl+C ou SIGTERM"""
+        def request_stop(signum, frame):
+            self.stop_event.set()
+
+        try:
+            signal.signal(signal.SIGTERM, request_stop)
+        except ValueError:
+            # Pas dans le thread principal : seul stop() permettra l'arrêt
+            pass
+
+        self.start()
+        try:
+            while not self.stop_event.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            print("\n\n🛑 Interruption détectée. Arrêt propre du système...")
+        finally:
+            self.stop()
+
+    def stats(self):
+        return {task.name: task.stats() for task in self.tasks}
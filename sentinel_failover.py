@@ -0,0 +1,161 @@
+import collections
+import threading
+
+import redis
+
+from metrics import FAILOVER_SAMPLES, WRITE_BUFFER_DEPTH
+from replica_routing import translate_address
+
+# Taille par défaut du tampon d'écriture d'un shard pendant une bascule (échantillons)
+DEFAULT_WRITE_BUFFER_SIZE = 50_000
+
+# Événements Sentinel : début de bascule (master déclaré objectivement hors service,
+# élection lancée) et fin (nouveau master promu, ou master revenu avant l'élection)
+FAILOVER_START_EVENTS = ("+odown", "+try-failover")
+FAILOVER_END_EVENTS = ("+switch-master", "-odown")
+
+# Réponses d'un master indisponible ou rétrogradé en réplica
+FAILOVER_RESPONSE_ERRORS = ("READONLY", "LOADING", "MASTERDOWN")
+
+
+def is_failover_error(error):
+    """Vrai si l'erreur indique que le master n'accepte plus les écritures (panne ou rétrogradation)"""
+    if isinstance(error, (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)):
+        return True
+    return isinstance(error, redis.exceptions.ResponseError) and str(error).startswith(FAILOVER_RESPONSE_ERRORS)
+
+
+def sentinel_from_config(config, socket_timeout=0.5):
+    """Client Sentinel d'un shard à partir de sa configuration ("sentinel": {"master_name", "sentinels"})"""
+    return redis.Sentinel([tuple(address) for address in config["sentinel"]["sentinels"]],
+                          socket_timeout=socket_timeout)
+
+
+class WriteBuffer:
+    """
+    File bornée des échantillons (clé, timestamp, valeur) d'un shard en attente d'un master.
+    Une fois pleine, les plus anciens échantillons passent au débordement (overflow(samples),
+    ex: spool disque, qui renvoie False s'il les refuse) ; à défaut ils sont abandonnés et comptés.
+    """
+
+    def __init__(self, shard, max_samples=DEFAULT_WRITE_BUFFER_SIZE, overflow=None):
+        self.shard = shard
+        self.max_samples = max_samples
+        self.overflow = overflow
+        self.samples = collections.deque()
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def add(self, samples):
+        """Ajoute des échantillons ; renvoie le nombre d'échantillons abandonnés faute de place"""
+        added = 0
+        overflowed = []
+        with self.lock:
+            for sample in samples:
+                self.samples.append(sample)
+                added += 1
+                if len(self.samples) > self.max_samples:
+                    overflowed.append(self.samples.popleft())
+            depth = len(self.samples)
+        FAILOVER_SAMPLES.labels(shard=self.shard, outcome="buffered").inc(added)
+        WRITE_BUFFER_DEPTH.labels(shard=self.shard).set(depth)
+        if not overflowed:
+            return 0
+        if self.overflow is not None and self.overflow(overflowed):
+            FAILOVER_SAMPLES.labels(shard=self.shard, outcome="spooled").inc(len(overflowed))
+            return 0
+        with self.lock:
+            self.dropped += len(overflowed)
+        FAILOVER_SAMPLES.labels(shard=self.shard, outcome="dropped").inc(len(overflowed))
+        return len(overflowed)
+
+    def drain(self):
+        """Vide le tampon et renvoie son contenu, du plus ancien au plus récent"""
+        with self.lock:
+            samples, self.samples = list(self.samples), collections.deque()
+        WRITE_BUFFER_DEPTH.labels(shard=self.shard).set(0)
+        return samples
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class SentinelWatcher:
+    """
+    Suit le master d'un shard auprès de ses Sentinels : adresse en cache, abonnement
+    aux événements de bascule (+odown, +try-failover, +switch-master) pour re-router
+    les écritures dès la promotion, sans attendre une erreur. Si un Sentinel ne répond
+    plus, l'abonnement passe au suivant.
+    """
+
+    def __init__(self, shard, master_name, sentinel, on_failover_start, on_switch, address_map=None):
+        self.shard = shard
+        self.master_name = master_name
+        self.sentinel = sentinel
+        self.on_failover_start = on_failover_start
+        self.on_switch = on_switch
+        self.address_map = address_map
+        self.master_address = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def discover(self):
+        """Interroge les Sentinels et met à jour l'adresse du master en cache"""
+        self.master_address = translate_address(self.sentinel.discover_master(self.master_name), self.address_map)
+        return self.master_address
+
+    def start(self):
+        self.thread = threading.Thread(target=self._listen, name=f"sentinel-{self.shard}", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def _listen(self):
+        sentinels = list(getattr(self.sentinel, "sentinels", [self.sentinel]))
+        index = 0
+        delay = 0.5
+        while not self.stopped.is_set():
+            pubsub = None
+            try:
+                pubsub = sentinels[index % len(sentinels)].pubsub()
+                pubsub.subscribe(*FAILOVER_START_EVENTS, *FAILOVER_END_EVENTS)
+                while not self.stopped.is_set():
+                    message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    delay = 0.5
+                    if message:
+                        self._handle(message)
+            except Exception as e:
+                # Un seul message par interruption, puis nouvelles tentatives espacées (jusqu'à 5s)
+                if delay == 0.5:
+                    print(f"⚠️ Abonnement Sentinel perdu pour {self.shard} ({e}), essai des Sentinels suivants")
+                index += 1
+                self.stopped.wait(delay)
+                delay = min(delay * 2, 5.0)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    @staticmethod
+    def _decode(value):
+        return value.decode() if isinstance(value, bytes) else str(value)
+
+    def _handle(self, message):
+        channel = self._decode(message["channel"])
+        fields = self._decode(message["data"]).split()
+        if channel == "+switch-master":
+            # <nom du master> <ancienne ip> <ancien port> <nouvelle ip> <nouveau port>
+            if len(fields) >= 5 and fields[0] == self.master_name:
+                self.master_address = translate_address((fields[3], fields[4]), self.address_map)
+                self.on_switch(self.shard, self.master_address)
+        elif len(fields) >= 2 and fields[0] == "master" and fields[1] == self.master_name:
+            # <type d'instance> <nom> <ip> <port> ...
+            if channel in FAILOVER_START_EVENTS:
+                self.on_failover_start(self.shard, channel)
+            elif channel == "-odown":
+                # Master revenu avant la fin de l'élection : on le reprend tel quel
+                self.on_switch(self.shard, self.master_address)
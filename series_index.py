@@ -0,0 +1,192 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+INDEX_PATH = "sharding_metadata/series_index.json"
+
+
+class SeriesIndex:
+    """
+    Index local des séries (clé -> shard et labels), persisté sur disque.
+    Permet des recherches par préfixe, sous-chaîne (index de trigrammes)
+    et label sans parcourir le keyspace Redis avec SCAN.
+    """
+
+    def __init__(self, path=INDEX_PATH):
+        self.path = path
+        self.series = {}
+        self.sorted_keys = []
+        self.trigrams = {}
+        self.labels = {}
+        self.updated_at = 0.0
+        self.lock = threading.RLock()
+        self.refreshing = False
+
+    # --- Mise à jour -------------------------------------------------------
+
+    @staticmethod
+    def _trigrams(text):
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def add(self, location, key, labels=None):
+        """Ajoute (ou met à jour) une série dans l'index"""
+        labels = dict(labels or {})
+        with self.lock:
+            previous = self.series.get(key)
+            if previous is not None:
+                self._unindex_labels(key, previous["labels"])
+            else:
+                bisect.insort(self.sorted_keys, key)
+                for trigram in self._trigrams(key.lower()):
+                    self.trigrams.setdefault(trigram, set()).add(key)
+            self.series[key] = {"location": location, "labels": labels}
+            for label, value in labels.items():
+                self.labels.setdefault(label, {}).setdefault(value, set()).add(key)
+
+    def remove(self, key):
+        """Retire une série de l'index"""
+        with self.lock:
+            entry = self.series.pop(key, None)
+            if entry is None:
+                return
+            self._unindex_labels(key, entry["labels"])
+            index = bisect.bisect_left(self.sorted_keys, key)
+            if index < len(self.sorted_keys) and self.sorted_keys[index] == key:
+                del self.sorted_keys[index]
+            for trigram in self._trigrams(key.lower()):
+                keys = self.trigrams.get(trigram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.trigrams[trigram]
+
+    def _unindex_labels(self, key, labels):
+        for label, value in labels.items():
+            keys = self.labels.get(label, {}).get(value)
+            if keys is not None:
+                keys.discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.series = {}
+            self.sorted_keys = []
+            self.trigrams = {}
+            self.labels = {}
+
+    def refresh(self, connections, sensor_types):
+        """
+        Reconstruit l'index depuis les shards : un TS.MGET WITHLABELS par shard
+        (filtre sur les types de capteurs connus), sans SCAN du keyspace
+        """
+        type_filter = f"type=({','.join(sensor_types)})"
+        snapshot = {}
+        for location, conn in connections.items():
+            try:
+                for key, labels, _sample in conn.execute_command("TS.MGET", "WITHLABELS", "FILTER", type_filter):
+                    snapshot[key] = (location, {label: value for label, value in labels})
+            except Exception as e:
+                print(f"Erreur lors de l'indexation du shard {location}: {e}")
+                # Conserver les entrées existantes de ce shard
+                with self.lock:
+                    for key, entry in self.series.items():
+                        if entry["location"] == location:
+                            snapshot[key] = (location, entry["labels"])
+
+        with self.lock:
+            self.clear()
+            for key, (location, labels) in snapshot.items():
+                self.add(location, key, labels)
+            self.updated_at = time.time()
+        self.save()
+        return len(snapshot)
+
+    def refresh_in_background(self, connections, sensor_types, max_age_seconds=300):
+        """Relance une reconstruction en arrière-plan si l'index est trop ancien"""
+        with self.lock:
+            if self.refreshing or time.time() - self.updated_at < max_age_seconds:
+                return False
+            self.refreshing = True
+
+        def run():
+            try:
+                self.refresh(connections, sensor_types)
+            finally:
+                self.refreshing = False
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    # --- Persistance ---------------------------------------------------------
+
+    def save(self):
+        """Sauvegarde l'index dans un fichier JSON (écriture atomique)"""
+        with self.lock:
+            data = {"updated_at": self.updated_at, "series": self.series}
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+
+    @classmethod
+    def load(cls, path=INDEX_PATH):
+        """Charge l'index depuis le disque (index vide si le fichier n'existe pas)"""
+        index = cls(path)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        for key, entry in data.get("series", {}).items():
+            index.add(entry["location"], key, entry.get("labels"))
+        index.updated_at = data.get("updated_at", 0.0)
+        return index
+
+    # --- Recherche -------------------------------------------------------------
+
+    def __len__(self):
+        return len(self.series)
+
+    def location_of(self, key):
+        entry = self.series.get(key)
+        return entry["location"] if entry else None
+
+    def search_prefix(self, prefix):
+        with self.lock:
+            start = bisect.bisect_left(self.sorted_keys, prefix)
+            end = bisect.bisect_left(self.sorted_keys, prefix + "￿")
+            return self.sorted_keys[start:end]
+
+    def search_substring(self, text):
+        """Recherche insensible à la casse d'une sous-chaîne dans les clés"""
+        text = text.lower()
+        with self.lock:
+            if len(text) < 3:
+                candidates = self.sorted_keys
+            else:
+                sets = [self.trigrams.get(trigram, set()) for trigram in self._trigrams(text)]
+                candidates = sorted(set.intersection(*sorted(sets, key=len)))
+            return [key for key in candidates if text in key.lower()]
+
+    def search_labels(self, filters):
+        """Recherche les séries ayant tous les labels donnés ({label: valeur})"""
+        with self.lock:
+            sets = [self.labels.get(label, {}).get(str(value), set()) for label, value in filters.items()]
+            if not sets:
+                return []
+            return sorted(set.intersection(*sorted(sets, key=len)))
+
+    def search(self, query):
+        """
+        Recherche générique : 'label=valeur' (plusieurs termes séparés par des espaces
+        sont combinés), 'préfixe*', sinon sous-chaîne
+        """
+        query = query.strip()
+        terms = query.split()
+        if terms and all("=" in term for term in terms):
+            return self.search_labels(dict(term.split("=", 1) for term in terms))
+        if query.endswith("*"):
+            return self.search_prefix(query[:-1])
+        return self.search_substring(query)
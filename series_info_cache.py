@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+
+def parse_ts_info(info):
+    """Convertit la réponse TS.INFO (liste) en dictionnaire, labels compris"""
+    if not isinstance(info, dict):
+        info = {info[i]: info[i + 1] for i in range(0, len(info) - 1, 2)}
+    labels = info.get("labels") or {}
+    if not isinstance(labels, dict):
+        labels = {label: value for label, value in labels}
+    return {
+        "totalSamples": int(info.get("totalSamples", 0) or 0),
+        "firstTimestamp": int(info.get("firstTimestamp", 0) or 0),
+        "lastTimestamp": int(info.get("lastTimestamp", 0) or 0),
+        "retentionTime": int(info.get("retentionTime", 0) or 0),
+        "labels": labels
+    }
+
+
+class SeriesInfoCache:
+    """
+    Cache LRU borné des métadonnées de séries (TS.INFO) avec expiration (TTL)
+    et invalidation lors des écritures faites par le même processus. Les séries
+    absentes sont aussi mises en cache (valeur None) pour éviter de répéter des
+    TS.INFO en erreur, avec un TTL court (negative_ttl_seconds, 0 pour ne pas les
+    mettre en cache) : une série créée par un autre processus apparaît vite.
+    """
+
+    def __init__(self, ttl_seconds=30, max_entries=10_000, negative_ttl_seconds=2):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, key, now):
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, info = entry
+        if expires_at < now:
+            del self.entries[key]
+            return False, None
+        self.entries.move_to_end(key)
+        return True, info
+
+    def _store(self, key, info, now):
+        if info is None and self.negative_ttl_seconds <= 0:
+            return
+        self.entries[key] = (now + (self.ttl_seconds if info is not None else self.negative_ttl_seconds), info)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, conn, key):
+        """Renvoie les métadonnées d'une série, ou None si elle n'existe pas"""
+        return self.get_many(conn, [key])[key]
+
+    def get_many(self, conn, keys):
+        """
+        Renvoie les métadonnées de plusieurs séries d'un même shard ;
+        les entrées absentes du cache sont récupérées en un seul pipeline
+        """
+        now = time.monotonic()
+        results = {}
+        missing = []
+        with self.lock:
+            for key in keys:
+                found, info = self._lookup(key, now)
+                if found:
+                    self.hits += 1
+                    results[key] = info
+                else:
+                    self.misses += 1
+                    missing.append(key)
+
+        if missing:
+            pipe = conn.pipeline(transaction=False)
+            for key in missing:
+                pipe.execute_command("TS.INFO", key)
+            replies = pipe.execute(raise_on_error=False)
+
+            with self.lock:
+                for key, reply in zip(missing, replies):
+                    if isinstance(reply, redis.exceptions.ResponseError):
+                        info = None
+                    elif isinstance(reply, Exception):
+                        raise reply
+                    else:
+                        info = parse_ts_info(reply)
+                    self._store(key, info, now)
+                    results[key] = info
+
+        return results
+
+    def record_write(self, key, timestamp_ms, count=1):
+        """Met à jour une entrée après une écriture (ou l'invalide si elle n'est plus fiable)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            expires_at, info = entry
+            if info is None or timestamp_ms <= info["lastTimestamp"]:
+                # Série créée entre-temps ou écriture dans le passé : relire depuis Redis
+                del self.entries[key]
+                return
+            updated = dict(info)
+            updated["totalSamples"] += count
+            updated["lastTimestamp"] = timestamp_ms
+            if not updated["firstTimestamp"]:
+                updated["firstTimestamp"] = timestamp_ms
+            self.entries[key] = (expires_at, updated)
+
+    def invalidate(self, key=None):
+        """Invalide une série, ou tout le cache si aucune clé n'est donnée"""
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self):
+        """Compteurs du cache (succès, échecs, évictions, taille)"""
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "size": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "negative_ttl_seconds": self.negative_ttl_seconds
+            }
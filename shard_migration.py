@@ -0,0 +1,211 @@
+import time
+
+import redis
+
+from rollups import create_rollups, rollup_keys
+from series_info_cache import parse_ts_info
+from shard_router import PinnedRouter, plan_moves
+
+
+class ShardMigrator:
+    """
+    Déplace des séries entre shards pendant que l'ingestion continue :
+    1. création des séries cibles (mêmes labels et rétention) et de leurs paliers agrégés
+    2. double écriture annoncée dans la configuration, puis copie par lots (TS.RANGE + TS.MADD)
+       des séries brutes puis de l'historique des paliers agrégés
+    3. vérification (nombre et somme des échantillons) source / cible
+    4. bascule atomique du routage dans true_sharding_config.json
+    5. suppression des séries sources (et de leurs paliers) après un délai de grâce
+    La copie est limitée en débit pour ne pas dégrader la latence des écritures en direct.
+    """
+
+    def __init__(self, sharding_system, chunk_size=5000, max_points_per_second=50_000, grace_seconds=60,
+                 keep_source=False):
+        self.system = sharding_system
+        self.chunk_size = chunk_size
+        self.max_points_per_second = max_points_per_second
+        # Délai laissé aux autres processus pour relire la configuration (génération toutes les 30s)
+        self.grace_seconds = grace_seconds
+        self.keep_source = keep_source
+
+    # --- Planification -------------------------------------------------------
+
+    def plan_rebalance(self, new_router):
+        """Séries à déplacer pour passer du routeur actuel au nouveau : {clé: (source, cible)}"""
+        keys = [key for _, _, _, key in self.system.series_keys()]
+        return plan_moves(keys, self.system.router, new_router)
+
+    def plan_pins(self, keys, target_shard):
+        """Routeur et déplacements pour épingler des séries sur un shard"""
+        current = self.system.router
+        base = current.base if isinstance(current, PinnedRouter) else current
+        pins = dict(current.pins) if isinstance(current, PinnedRouter) else {}
+        pins.update({key: target_shard for key in keys})
+        new_router = PinnedRouter(base, pins)
+        return new_router, plan_moves(keys, current, new_router)
+
+    # --- Migration -----------------------------------------------------------------
+
+    def migrate(self, new_router, moves):
+        """Exécute la migration complète et bascule vers new_router si toutes les séries sont vérifiées"""
+        started = time.perf_counter()
+        report = {"moves": len(moves), "points_copied": 0, "verified": 0, "failed": {}, "switched": False}
+        if not moves:
+            print("Aucune série à déplacer, bascule du routage uniquement")
+            self._switch(new_router)
+            report["switched"] = True
+            return report
+
+        unavailable = {shard for pair in moves.values() for shard in pair} - set(self.system.connections)
+        if unavailable:
+            raise ValueError(f"Shards indisponibles pour la migration: {', '.join(sorted(unavailable))}")
+
+        created = self._create_targets(moves, report)
+        moves = {key: pair for key, pair in moves.items() if key not in report["failed"]}
+
+        # Annoncer la double écriture puis attendre que les générateurs relisent la configuration
+        self.system.save_sharding_config({"moves": {key: list(pair) for key, pair in moves.items()},
+                                          "started_at": int(time.time() * 1000)})
+        print(f"Double écriture activée pour {len(moves)} série(s), attente de {self.grace_seconds}s...")
+        time.sleep(self.grace_seconds)
+
+        for index, (key, (source, target)) in enumerate(moves.items(), start=1):
+            try:
+                copied = self._copy_series(key, source, target)
+                report["points_copied"] += copied
+                if not self._verify(key, source, target):
+                    # Deuxième passe (idempotente) pour les points arrivés pendant la copie
+                    report["points_copied"] += self._copy_series(key, source, target)
+                    if not self._verify(key, source, target):
+                        raise ValueError("contenu différent entre source et cible")
+                report["verified"] += 1
+                report["points_copied"] += self._copy_rollups(key, source, target)
+                print(f"[{index}/{len(moves)}] {key}: {copied} points copiés de {source} vers {target} ✅")
+            except Exception as e:
+                report["failed"][key] = str(e)
+                print(f"[{index}/{len(moves)}] {key}: échec de la migration ({e}) ❌")
+
+        if report["failed"]:
+            # Pas de bascule partielle : retour au routage actuel, sans double écriture
+            self.system.save_sharding_config()
+            self._drop_targets({key: moves[key] for key in created if key in moves})
+            print(f"Migration annulée: {len(report['failed'])} série(s) en échec, routage inchangé")
+        else:
+            self._switch(new_router)
+            report["switched"] = True
+            print(f"Routage basculé, attente de {self.grace_seconds}s avant nettoyage des sources...")
+            time.sleep(self.grace_seconds)
+            self._finish(moves)
+
+        report["elapsed_seconds"] = time.perf_counter() - started
+        return report
+
+    def _create_targets(self, moves, report):
+        """Crée les séries cibles avec les labels et la rétention des sources"""
+        created = []
+        for key, (source, target) in moves.items():
+            try:
+                info = parse_ts_info(self.system.get_connection_for_location(source).execute_command("TS.INFO", key))
+                labels = [item for pair in info["labels"].items() for item in pair]
+                # DUPLICATE_POLICY LAST : copie et double écriture peuvent se recouvrir sans erreur
+                target_conn = self.system.get_connection_for_location(target)
+                target_conn.execute_command(
+                    "TS.CREATE", key, "RETENTION", info["retentionTime"], "DUPLICATE_POLICY", "LAST",
+                    *(["LABELS", *labels] if labels else []))
+                created.append(key)
+                # Règles de compaction sur la cible : les points copiés alimentent ses paliers
+                create_rollups(target_conn, key, duplicate_policy="LAST")
+            except redis.exceptions.ResponseError as e:
+                if "already exists" not in str(e):
+                    report["failed"][key] = str(e)
+            except Exception as e:
+                report["failed"][key] = str(e)
+        return created
+
+    def _throttle(self, copied, started):
+        """Limite le débit de copie à max_points_per_second (0 = illimité)"""
+        if self.max_points_per_second:
+            delay = copied / self.max_points_per_second - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+
+    def _copy_series(self, key, source, target):
+        """Copie une série par lots TS.RANGE ... COUNT suivis d'un TS.MADD"""
+        source_conn = self.system.get_connection_for_location(source)
+        target_conn = self.system.get_connection_for_location(target)
+        copied = 0
+        cursor = 0
+        started = time.perf_counter()
+        while True:
+            page = source_conn.execute_command("TS.RANGE", key, cursor, "+", "COUNT", self.chunk_size)
+            if not page:
+                break
+            args = []
+            for timestamp_ms, value in page:
+                args.extend((key, timestamp_ms, value))
+            errors = [reply for reply in target_conn.execute_command("TS.MADD", *args)
+                      if isinstance(reply, Exception)]
+            if errors:
+                raise errors[0]
+            copied += len(page)
+            self._throttle(copied, started)
+            if len(page) < self.chunk_size:
+                break
+            cursor = int(page[-1][0]) + 1
+        return copied
+
+    def _copy_rollups(self, key, source, target):
+        """
+        Copie l'historique des paliers agrégés, plus long que la rétention des séries brutes
+        (les buckets déjà recalculés sur la cible reçoivent les mêmes valeurs)
+        """
+        copied = 0
+        for rollup in rollup_keys(key):
+            try:
+                copied += self._copy_series(rollup, source, target)
+            except redis.exceptions.ResponseError as e:
+                # Série créée avant les paliers agrégés : rien à copier
+                if "does not exist" not in str(e):
+                    raise
+        return copied
+
+    def _verify(self, key, source, target):
+        """Compare le nombre et la somme des échantillons sur les deux shards"""
+        # Marge d'une seconde : une double écriture en cours peut n'avoir atteint qu'un des shards
+        cutoff = int(time.time() * 1000) - 1000
+        summaries = []
+        for shard in (source, target):
+            pipe = self.system.get_connection_for_location(shard).pipeline(transaction=False)
+            for aggregation in ("count", "sum"):
+                pipe.execute_command("TS.RANGE", key, 0, cutoff, "AGGREGATION", aggregation, cutoff + 1)
+            summaries.append([sum(float(value) for _, value in reply) for reply in pipe.execute()])
+        (source_count, source_sum), (target_count, target_sum) = summaries
+        return source_count == target_count and abs(source_sum - target_sum) <= 1e-6 * max(1.0, abs(source_sum))
+
+    def _switch(self, new_router):
+        """Bascule atomique du routage (fin de la double écriture)"""
+        self.system.router = new_router
+        self.system.save_sharding_config()
+
+    def _finish(self, moves):
+        """Supprime les séries sources et met à jour l'index et le cache des métadonnées"""
+        for key, (source, target) in moves.items():
+            if not self.keep_source:
+                try:
+                    self.system.get_connection_for_location(source).delete(key, *rollup_keys(key))
+                except Exception as e:
+                    print(f"Erreur lors de la suppression de {key} sur {source}: {e}")
+            self.system._invalidate_series(key)
+            series_index = getattr(self.system, "series_index", None)
+            if series_index is not None and series_index.location_of(key) is not None:
+                series_index.add(target, key, series_index.series[key]["labels"])
+        if getattr(self.system, "series_index", None) is not None:
+            self.system.series_index.save()
+
+    def _drop_targets(self, moves):
+        """Supprime les copies créées par une migration annulée"""
+        for key, (_, target) in moves.items():
+            try:
+                self.system.get_connection_for_location(target).delete(key, *rollup_keys(key))
+            except Exception as e:
+                print(f"Erreur lors de la suppression de la copie {key} sur {target}: {e}")
@@ -0,0 +1,146 @@
+import bisect
+import hashlib
+
+
+def stable_hash(value):
+    """Hachage stable entre processus (contrairement à hash())"""
+    return int.from_bytes(hashlib.md5(str(value).encode()).digest()[:8], "big")
+
+
+def location_of_key(key):
+    """Extrait l'emplacement d'une clé sensor:<type>:<emplacement>:<id>"""
+    parts = key.split(":")
+    return parts[2] if len(parts) >= 4 else None
+
+
+def series_key_of(key):
+    """Série brute d'une clé : une série agrégée (sensor:<type>:<emplacement>:<id>:<palier>) suit sa source"""
+    parts = key.split(":")
+    return ":".join(parts[:4]) if len(parts) > 4 else key
+
+
+class LocationRouter:
+    """Routage par défaut : un shard par emplacement (le shard porte le nom de l'emplacement)"""
+
+    name = "location"
+
+    def __init__(self, shards=None):
+        self.shards = list(shards or [])
+
+    def route(self, key):
+        return location_of_key(key)
+
+    def describe(self):
+        return {"type": self.name}
+
+
+class ConsistentHashRouter:
+    """
+    Anneau de hachage cohérent avec nœuds virtuels : chaque shard occupe vnodes
+    positions sur l'anneau, une clé va au premier nœud rencontré dans le sens horaire.
+    Ajouter ou retirer un shard ne déplace qu'environ 1/N des séries.
+    """
+
+    name = "consistent_hash"
+
+    def __init__(self, shards, vnodes=160):
+        self.vnodes = vnodes
+        self.shards = []
+        self.ring = []
+        self.ring_shards = []
+        for shard in shards:
+            self.add_shard(shard)
+
+    def _rebuild(self, points):
+        points.sort()
+        self.ring = [position for position, _ in points]
+        self.ring_shards = [shard for _, shard in points]
+
+    def add_shard(self, shard):
+        if shard in self.shards:
+            return
+        self.shards.append(shard)
+        points = list(zip(self.ring, self.ring_shards))
+        points.extend((stable_hash(f"{shard}#{i}"), shard) for i in range(self.vnodes))
+        self._rebuild(points)
+
+    def remove_shard(self, shard):
+        if shard not in self.shards:
+            return
+        self.shards.remove(shard)
+        self._rebuild([(position, owner) for position, owner in zip(self.ring, self.ring_shards) if owner != shard])
+
+    def routing_key(self, key):
+        return key
+
+    def route(self, key):
+        if not self.ring:
+            return None
+        # Une règle de compaction exige que la série agrégée soit sur le même shard que sa source
+        index = bisect.bisect_right(self.ring, stable_hash(self.routing_key(series_key_of(key)))) % len(self.ring)
+        return self.ring_shards[index]
+
+    def describe(self):
+        return {"type": self.name, "shards": list(self.shards), "vnodes": self.vnodes}
+
+
+class HashTagRouter(ConsistentHashRouter):
+    """
+    Anneau de hachage qui respecte les hash tags à la Redis Cluster : seule la partie
+    entre accolades ({salon}) est hachée, ce qui garde ensemble les séries d'un même tag
+    """
+
+    name = "hash_tag"
+
+    def routing_key(self, key):
+        start = key.find("{")
+        if start != -1:
+            end = key.find("}", start + 1)
+            if end > start + 1:
+                return key[start + 1:end]
+        return key
+
+
+class PinnedRouter:
+    """
+    Routeur avec des séries épinglées sur un shard donné (migrations ciblées) ;
+    les autres séries suivent le routeur de base
+    """
+
+    def __init__(self, base, pins=None):
+        self.base = base
+        self.pins = dict(pins or {})
+        self.shards = base.shards
+        self.name = base.name
+
+    def route(self, key):
+        return self.pins.get(series_key_of(key)) or self.base.route(key)
+
+    def describe(self):
+        return dict(self.base.describe(), pins=dict(self.pins))
+
+
+ROUTERS = {router.name: router for router in (LocationRouter, ConsistentHashRouter, HashTagRouter)}
+
+
+def router_from_config(config, shards):
+    """Reconstruit un routeur à partir de sa description (section "router" de la configuration)"""
+    config = config or {"type": LocationRouter.name}
+    router_class = ROUTERS.get(config.get("type"), LocationRouter)
+    if router_class is LocationRouter:
+        router = LocationRouter(shards)
+    else:
+        router = router_class(config.get("shards", shards), vnodes=config.get("vnodes", 160))
+    if config.get("pins"):
+        router = PinnedRouter(router, config["pins"])
+    return router
+
+
+def plan_moves(keys, old_router, new_router):
+    """Liste les séries dont le shard change entre deux routeurs : {clé: (ancien, nouveau)}"""
+    moves = {}
+    for key in keys:
+        old_shard, new_shard = old_router.route(key), new_router.route(key)
+        if old_shard != new_shard:
+            moves[key] = (old_shard, new_shard)
+    return moves
@@ -0,0 +1,887 @@
+import asyncio
+import bisect
+import fnmatch
+import json
+import queue
+import threading
+import time
+import urllib.parse
+
+import redis
+
+AGGREGATORS = {
+    "avg": lambda values: sum(values) / len(values),
+    "sum": sum,
+    "min": min,
+    "max": max,
+    "count": len,
+    "first": lambda values: values[0],
+    "last": lambda values: values[-1],
+    "range": lambda values: max(values) - min(values),
+}
+
+# Commandes refusées par un réplica et comptées dans l'offset de réplication du master
+WRITE_COMMANDS = {"TS.CREATE", "TS.ALTER", "TS.CREATERULE", "TS.DELETERULE", "TS.ADD", "TS.MADD", "TS.DEL", "DEL", "UNLINK"}
+
+
+class InMemoryTimeSeriesShard:
+    """
+    Shard Redis Time-Series simulé en mémoire, utilisé pour tester et mesurer
+    les performances sans Docker. Expose le même sous-ensemble d'API que
+    redis.Redis (decode_responses=True) utilisé par le projet.
+    """
+
+    def __init__(self, name="stand-in", latency_ms=0.0):
+        self.name = name
+        # Latence simulée (en ms) pour chaque aller-retour réseau
+        self.latency_ms = latency_ms
+        self.series = {}
+        self.lock = threading.Lock()
+        self.round_trips = 0
+        # Offset de réplication : octets de commandes d'écriture appliquées (approximation)
+        self.repl_offset = 0
+        # Instance arrêtée (panne simulée) : toutes les commandes échouent
+        self.available = True
+
+    def _round_trip(self):
+        """Simule le coût d'un aller-retour réseau"""
+        if not self.available:
+            raise redis.exceptions.ConnectionError(f"Instance {self.name} injoignable")
+        self.round_trips += 1
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000)
+
+    # --- API redis.Redis -------------------------------------------------
+
+    def ping(self):
+        self._round_trip()
+        return True
+
+    def info(self, section=None):
+        self._round_trip()
+        with self.lock:
+            return self._info(section)
+
+    def keys(self, pattern="*"):
+        self._round_trip()
+        with self.lock:
+            return [key for key in self.series if fnmatch.fnmatchcase(key, pattern)]
+
+    def scan_iter(self, match="*", count=None):
+        return iter(self.keys(match))
+
+    def scan(self, cursor=0, match=None, count=None):
+        """
+        SCAN incrémental : le curseur encode la dernière clé renvoyée (ordre trié), pour que
+        les clés supprimées entre deux appels (UNLINK) ne décalent pas le parcours
+        """
+        self._round_trip()
+        with self.lock:
+            keys = sorted(self.series)
+        cursor = int(cursor)
+        start = 0
+        if cursor:
+            last_key = cursor.to_bytes((cursor.bit_length() + 7) // 8, "big").decode()
+            start = bisect.bisect_right(keys, last_key)
+        page = keys[start:start + (count or 10)]
+        batch = [key for key in page if match is None or fnmatch.fnmatchcase(key, match)]
+        if start + len(page) >= len(keys):
+            return 0, batch
+        return int.from_bytes(page[-1].encode(), "big"), batch
+
+    def delete(self, *keys):
+        self._round_trip()
+        with self.lock:
+            return self._dispatch(("DEL", *keys))
+
+    def unlink(self, *keys):
+        return self.delete(*keys)
+
+    def dbsize(self):
+        self._round_trip()
+        with self.lock:
+            return self._dbsize()
+
+    def execute_command(self, *args):
+        self._round_trip()
+        with self.lock:
+            return self._dispatch(args)
+
+    def pipeline(self, transaction=True):
+        return InMemoryPipeline(self)
+
+    # --- Commandes Time-Series -------------------------------------------
+
+    def _dispatch(self, args):
+        command = str(args[0]).upper()
+        handler = self.COMMANDS.get(command)
+        if handler is None:
+            raise redis.exceptions.ResponseError(f"ERR unknown command '{command}'")
+        if command in WRITE_COMMANDS:
+            self.repl_offset += sum(len(str(arg)) for arg in args)
+        return handler(self, *args[1:])
+
+    def _get_series(self, key):
+        series = self.series.get(key)
+        if series is None:
+            raise redis.exceptions.ResponseError("TSDB: key does not exist")
+        return series
+
+    def _ts_create(self, key, *options):
+        if key in self.series:
+            raise redis.exceptions.ResponseError("TSDB: key already exists")
+        retention = 0
+        duplicate_policy = None
+        labels = {}
+        i = 0
+        while i < len(options):
+            option = str(options[i]).upper()
+            if option == "RETENTION":
+                retention = int(options[i + 1])
+                i += 2
+            elif option == "DUPLICATE_POLICY":
+                duplicate_policy = str(options[i + 1]).lower()
+                i += 2
+            elif option == "LABELS":
+                pairs = options[i + 1:]
+                labels = {str(pairs[j]): str(pairs[j + 1]) for j in range(0, len(pairs) - 1, 2)}
+                break
+            else:
+                i += 1
+        self.series[key] = {"timestamps": [], "values": [], "retention": retention, "labels": labels,
+                            "duplicate_policy": duplicate_policy, "rules": [], "source_key": None}
+        return "OK"
+
+    def _ts_alter(self, key, *options):
+        series = self._get_series(key)
+        i = 0
+        while i < len(options):
+            option = str(options[i]).upper()
+            if option == "RETENTION":
+                series["retention"] = int(options[i + 1])
+                i += 2
+            elif option == "DUPLICATE_POLICY":
+                series["duplicate_policy"] = str(options[i + 1]).lower()
+                i += 2
+            elif option == "LABELS":
+                pairs = options[i + 1:]
+                series["labels"] = {str(pairs[j]): str(pairs[j + 1]) for j in range(0, len(pairs) - 1, 2)}
+                break
+            else:
+                i += 1
+        self._expire(series)
+        return "OK"
+
+    @staticmethod
+    def _expire(series):
+        """
+        Rétention : les échantillons plus anciens que le dernier timestamp moins la rétention
+        expirent (immédiatement ici, par chunks entiers dans Redis) ; les paliers agrégés
+        ne sont pas modifiés
+        """
+        timestamps = series["timestamps"]
+        if not series["retention"] or not timestamps or timestamps[0] >= timestamps[-1] - series["retention"]:
+            return
+        end = bisect.bisect_left(timestamps, timestamps[-1] - series["retention"])
+        del timestamps[:end]
+        del series["values"][:end]
+
+    def _ts_createrule(self, source_key, destination_key, _aggregation, aggregator, bucket_ms, *options):
+        source = self._get_series(source_key)
+        destination = self._get_series(destination_key)
+        if destination.get("source_key"):
+            raise redis.exceptions.ResponseError("TSDB: the destination key already has a src rule")
+        if destination.get("rules"):
+            raise redis.exceptions.ResponseError("TSDB: the destination key already has a dst rule")
+        source.setdefault("rules", []).append((destination_key, str(aggregator).lower(), int(bucket_ms)))
+        destination["source_key"] = source_key
+        return "OK"
+
+    def _ts_deleterule(self, source_key, destination_key):
+        source = self._get_series(source_key)
+        rules = [rule for rule in source.get("rules", []) if rule[0] != destination_key]
+        if len(rules) == len(source.get("rules", [])):
+            raise redis.exceptions.ResponseError("TSDB: compaction rule does not exist")
+        source["rules"] = rules
+        self.series[destination_key]["source_key"] = None
+        return "OK"
+
+    def _compact(self, series, timestamp, previous_last):
+        """
+        Règles de compaction : un bucket est écrit dans la série agrégée quand il se termine
+        (arrivée d'un échantillon du bucket suivant), et recalculé si un échantillon tardif
+        arrive dans un bucket déjà terminé
+        """
+        timestamps = series["timestamps"]
+        for destination_key, aggregator, bucket_ms in series.get("rules", []):
+            destination = self.series.get(destination_key)
+            if destination is None:
+                continue
+            latest_bucket = timestamps[-1] - timestamps[-1] % bucket_ms
+            bucket = timestamp - timestamp % bucket_ms
+            if bucket < latest_bucket:
+                closed = [bucket]
+            elif previous_last is not None and previous_last - previous_last % bucket_ms < bucket:
+                closed = [previous_last - previous_last % bucket_ms]
+            else:
+                continue
+            for closed_bucket in closed:
+                start = bisect.bisect_left(timestamps, closed_bucket)
+                end = bisect.bisect_left(timestamps, closed_bucket + bucket_ms)
+                for _, value in self._aggregate(timestamps, series["values"], start, end, aggregator, bucket_ms):
+                    self._upsert(destination, closed_bucket, float(value))
+
+    @staticmethod
+    def _upsert(series, timestamp, value):
+        timestamps = series["timestamps"]
+        index = bisect.bisect_left(timestamps, timestamp)
+        if index < len(timestamps) and timestamps[index] == timestamp:
+            series["values"][index] = value
+        else:
+            timestamps.insert(index, timestamp)
+            series["values"].insert(index, value)
+
+    def _add_sample(self, key, timestamp, value):
+        series = self._get_series(key)
+        previous_last = series["timestamps"][-1] if series["timestamps"] else None
+        timestamp = self._insert_sample(series, int(timestamp), float(value))
+        if series.get("rules"):
+            self._compact(series, timestamp, previous_last)
+        self._expire(series)
+        return timestamp
+
+    def _insert_sample(self, series, timestamp, value):
+        timestamps = series["timestamps"]
+        if not timestamps or timestamp > timestamps[-1]:
+            timestamps.append(timestamp)
+            series["values"].append(value)
+            return timestamp
+        index = bisect.bisect_left(timestamps, timestamp)
+        if index < len(timestamps) and timestamps[index] == timestamp:
+            if series.get("duplicate_policy") == "last":
+                series["values"][index] = value
+                return timestamp
+            if series.get("duplicate_policy") == "first":
+                return timestamp
+            raise redis.exceptions.ResponseError(
+                "TSDB: Error at upsert, update is not supported when DUPLICATE_POLICY is set to BLOCK mode")
+        timestamps.insert(index, timestamp)
+        series["values"].insert(index, value)
+        return timestamp
+
+    def _ts_add(self, key, timestamp, value, *options):
+        if timestamp == "*":
+            timestamp = int(time.time() * 1000)
+        return self._add_sample(key, timestamp, value)
+
+    def _ts_madd(self, *triplets):
+        results = []
+        for i in range(0, len(triplets), 3):
+            try:
+                results.append(self._add_sample(*triplets[i:i + 3]))
+            except redis.exceptions.ResponseError as e:
+                results.append(e)
+        return results
+
+    def _ts_del(self, key, from_ts, to_ts):
+        """
+        Comme RedisTimeSeries : sur une série avec règles de compaction, suppression refusée
+        au-delà de la rétention, et buckets agrégés touchés recalculés (ou supprimés s'ils
+        n'ont plus d'échantillon brut)
+        """
+        series = self._get_series(key)
+        timestamps = series["timestamps"]
+        from_ts, to_ts = int(from_ts), int(to_ts)
+        if series.get("rules") and series["retention"] and timestamps \
+                and from_ts < timestamps[-1] - series["retention"]:
+            raise redis.exceptions.ResponseError(
+                "TSDB: When a series has compactions, deleting samples or compaction buckets beyond "
+                "the series retention period is not possible")
+        start = bisect.bisect_left(timestamps, from_ts)
+        end = bisect.bisect_right(timestamps, to_ts)
+        del timestamps[start:end]
+        del series["values"][start:end]
+
+        for destination_key, aggregator, bucket_ms in series.get("rules", []):
+            destination = self.series.get(destination_key)
+            if destination is None:
+                continue
+            first = bisect.bisect_left(destination["timestamps"], from_ts - from_ts % bucket_ms)
+            last = bisect.bisect_right(destination["timestamps"], to_ts)
+            for bucket in destination["timestamps"][first:last]:
+                bucket_start = bisect.bisect_left(timestamps, bucket)
+                bucket_end = bisect.bisect_left(timestamps, bucket + bucket_ms)
+                index = bisect.bisect_left(destination["timestamps"], bucket)
+                if bucket_start == bucket_end:
+                    del destination["timestamps"][index]
+                    del destination["values"][index]
+                else:
+                    value = self._aggregate(timestamps, series["values"], bucket_start, bucket_end,
+                                            aggregator, bucket_ms)[0][1]
+                    destination["values"][index] = float(value)
+        return end - start
+
+    def _ts_get(self, key):
+        series = self._get_series(key)
+        return [series["timestamps"][-1], repr(series["values"][-1])] if series["timestamps"] else []
+
+    def _ts_range(self, key, from_ts, to_ts, *options):
+        series = self._get_series(key)
+        timestamps = series["timestamps"]
+        start = 0 if from_ts == "-" else bisect.bisect_left(timestamps, int(from_ts))
+        end = len(timestamps) if to_ts == "+" else bisect.bisect_right(timestamps, int(to_ts))
+        values = series["values"]
+
+        count = None
+        aggregation = None
+        i = 0
+        while i < len(options):
+            option = str(options[i]).upper()
+            if option == "COUNT":
+                count = int(options[i + 1])
+                i += 2
+            elif option == "AGGREGATION":
+                aggregation = (str(options[i + 1]).lower(), int(options[i + 2]))
+                i += 3
+            else:
+                i += 1
+
+        if aggregation is None:
+            samples = [[timestamps[i], repr(values[i])] for i in range(start, end)]
+        else:
+            samples = self._aggregate(timestamps, values, start, end, *aggregation)
+        return samples[:count] if count is not None else samples
+
+    @staticmethod
+    def _aggregate(timestamps, values, start, end, aggregator, bucket_ms):
+        """Agrège les échantillons par bucket aligné sur l'epoch"""
+        buckets = []
+        current = None
+        bucket_values = []
+        for i in range(start, end):
+            bucket = timestamps[i] - timestamps[i] % bucket_ms
+            if bucket != current:
+                if bucket_values:
+                    buckets.append((current, bucket_values))
+                current = bucket
+                bucket_values = []
+            bucket_values.append(values[i])
+        if bucket_values:
+            buckets.append((current, bucket_values))
+        return [[bucket, repr(float(AGGREGATORS[aggregator](bucket_values)))] for bucket, bucket_values in buckets]
+
+    @staticmethod
+    def _match_filter(labels, expression):
+        """Évalue un filtre de labels (label=valeur, label!=valeur, label=(a,b))"""
+        negate = "!=" in expression
+        label, value = expression.split("!=" if negate else "=", 1)
+        if value.startswith("(") and value.endswith(")"):
+            matched = labels.get(label) in value[1:-1].split(",")
+        elif value == "":
+            matched = label not in labels
+        else:
+            matched = labels.get(label) == value
+        return not matched if negate else matched
+
+    def _ts_mrange(self, from_ts, to_ts, *options):
+        options = [str(option) for option in options]
+        upper = [option.upper() for option in options]
+        filter_index = upper.index("FILTER")
+        end_filters = filter_index + 1
+        while end_filters < len(options) and "=" in options[end_filters]:
+            end_filters += 1
+        filters = options[filter_index + 1:end_filters]
+        with_labels = "WITHLABELS" in upper
+
+        range_options = []
+        if "COUNT" in upper[:filter_index]:
+            i = upper.index("COUNT")
+            range_options += ["COUNT", options[i + 1]]
+        if "AGGREGATION" in upper[:filter_index]:
+            i = upper.index("AGGREGATION")
+            range_options += ["AGGREGATION", options[i + 1], options[i + 2]]
+
+        matches = [(key, series) for key, series in sorted(self.series.items())
+                   if all(self._match_filter(series["labels"], f) for f in filters)]
+        replies = [[key,
+                    [[k, v] for k, v in series["labels"].items()] if with_labels else [],
+                    self._ts_range(key, from_ts, to_ts, *range_options)]
+                   for key, series in matches]
+
+        if "GROUPBY" not in upper:
+            return replies
+
+        i = upper.index("GROUPBY")
+        group_label = options[i + 1]
+        reducer = options[i + 3].lower()
+        groups = {}
+        for (key, series), reply in zip(matches, replies):
+            group_value = series["labels"].get(group_label)
+            if group_value is not None:
+                groups.setdefault(group_value, []).append((key, reply[2]))
+
+        grouped = []
+        for group_value, members in sorted(groups.items()):
+            by_timestamp = {}
+            for _, samples in members:
+                for timestamp, value in samples:
+                    by_timestamp.setdefault(timestamp, []).append(float(value))
+            samples = [[timestamp, repr(float(AGGREGATORS[reducer](values)))]
+                       for timestamp, values in sorted(by_timestamp.items())]
+            labels = [[group_label, group_value], ["__reducer__", reducer],
+                      ["__source__", ",".join(key for key, _ in members)]]
+            grouped.append([f"{group_label}={group_value}", labels, samples])
+        return grouped
+
+    def _filtered_keys(self, filters):
+        return [key for key, series in sorted(self.series.items())
+                if all(self._match_filter(series["labels"], str(f)) for f in filters)]
+
+    def _ts_queryindex(self, *filters):
+        return self._filtered_keys(filters)
+
+    def _ts_mget(self, *options):
+        options = [str(option) for option in options]
+        upper = [option.upper() for option in options]
+        with_labels = "WITHLABELS" in upper
+        filters = options[upper.index("FILTER") + 1:]
+        replies = []
+        for key in self._filtered_keys(filters):
+            series = self.series[key]
+            last = ([series["timestamps"][-1], repr(series["values"][-1])] if series["timestamps"] else [])
+            labels = [[k, v] for k, v in series["labels"].items()] if with_labels else []
+            replies.append([key, labels, last])
+        return replies
+
+    def _ts_info(self, key):
+        series = self._get_series(key)
+        timestamps = series["timestamps"]
+        return [
+            "totalSamples", len(timestamps),
+            "memoryUsage", 16 * len(timestamps),
+            "firstTimestamp", timestamps[0] if timestamps else 0,
+            "lastTimestamp", timestamps[-1] if timestamps else 0,
+            "retentionTime", series["retention"],
+            "chunkCount", 1,
+            "chunkSize", 4096,
+            "duplicatePolicy", series.get("duplicate_policy"),
+            "labels", [[k, v] for k, v in series["labels"].items()],
+            "sourceKey", series.get("source_key"),
+            "rules", [[destination, bucket_ms, aggregator.upper(), 0]
+                      for destination, aggregator, bucket_ms in series.get("rules", [])],
+        ]
+
+    def _ping(self):
+        return True
+
+    def _info(self, section=None):
+        section = str(section).lower() if section else None
+        if section == "replication":
+            return {"role": "master", "connected_slaves": 0, "master_repl_offset": self.repl_offset}
+        if section == "memory":
+            return {"used_memory": self._memory_usage(), "used_memory_human": f"{self._memory_usage() / 1024:.2f}K"}
+        if section == "keyspace":
+            return {"db0": {"keys": len(self.series), "expires": 0, "avg_ttl": 0}} if self.series else {}
+        return {"role": "master"}
+
+    def _dbsize(self):
+        return len(self.series)
+
+    def _unlink(self, *keys):
+        deleted = 0
+        for key in keys:
+            series = self.series.pop(key, None)
+            if series is None:
+                continue
+            deleted += 1
+            # Les règles de compaction de la série et vers la série disparaissent avec elle
+            for destination_key, _, _ in series.get("rules", []):
+                if destination_key in self.series:
+                    self.series[destination_key]["source_key"] = None
+            source = self.series.get(series.get("source_key"))
+            if source is not None:
+                source["rules"] = [rule for rule in source["rules"] if rule[0] != key]
+        return deleted
+
+    def _memory_usage(self):
+        return sum(16 * len(series["timestamps"]) for series in self.series.values())
+
+    COMMANDS = {
+        "TS.CREATE": _ts_create,
+        "TS.ALTER": _ts_alter,
+        "TS.CREATERULE": _ts_createrule,
+        "TS.DELETERULE": _ts_deleterule,
+        "TS.ADD": _ts_add,
+        "TS.MADD": _ts_madd,
+        "TS.RANGE": _ts_range,
+        "TS.GET": _ts_get,
+        "TS.DEL": _ts_del,
+        "TS.MRANGE": _ts_mrange,
+        "TS.MGET": _ts_mget,
+        "TS.QUERYINDEX": _ts_queryindex,
+        "TS.INFO": _ts_info,
+        "PING": _ping,
+        "INFO": _info,
+        "DBSIZE": _dbsize,
+        "DEL": _unlink,
+        "UNLINK": _unlink,
+    }
+
+
+class InMemoryReplicaShard(InMemoryTimeSeriesShard):
+    """
+    Réplica simulé d'un shard en mémoire : il partage les séries du master (lectures
+    toujours à jour) mais annonce un offset de réplication en retard de lag_bytes,
+    et peut simuler un lien de réplication coupé (link_up) ou un réplica injoignable
+    (available) pour tester le routage des lectures et le repli sur le master.
+    """
+
+    def __init__(self, master, name=None, latency_ms=None):
+        super().__init__(name or f"{master.name}-replica", master.latency_ms if latency_ms is None else latency_ms)
+        self.master = master
+        self.series = master.series
+        self.lock = master.lock
+        self.lag_bytes = 0
+        self.link_up = True
+        self.promoted = False
+
+    def promote(self):
+        """Promotion en master (REPLICAOF NO ONE) : le réplica accepte désormais les écritures"""
+        self.promoted = True
+        self.repl_offset = self.master.repl_offset
+
+    def _dispatch(self, args):
+        command = str(args[0]).upper()
+        if command in WRITE_COMMANDS and not self.promoted:
+            raise redis.exceptions.ResponseError("READONLY You can't write against a read only replica.")
+        if command == "INFO":
+            return self._info(*args[1:])
+        return super()._dispatch(args)
+
+    def _info(self, section=None):
+        if self.promoted:
+            return super()._info(section)
+        if section and str(section).lower() == "replication":
+            return {"role": "slave", "master_link_status": "up" if self.link_up else "down",
+                    "slave_repl_offset": max(0, self.master.repl_offset - self.lag_bytes)}
+        info = super()._info(section)
+        if "role" in info:
+            info["role"] = "slave"
+        return info
+
+
+class InMemoryPubSub:
+    """Abonnement simulé aux canaux d'un Sentinel en mémoire (sous-ensemble de redis.client.PubSub)"""
+
+    def __init__(self, sentinel):
+        self.sentinel = sentinel
+        self.messages = queue.Queue()
+        self.channels = set()
+
+    def subscribe(self, *channels):
+        self.channels.update(channels)
+        self.sentinel.subscribers.append(self)
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        if self in self.sentinel.subscribers:
+            self.sentinel.subscribers.remove(self)
+
+
+class InMemorySentinel:
+    """
+    Sentinel simulé pour les shards en mémoire : découverte du master et de ses réplicas,
+    publication des événements de bascule (+sdown, +odown, +try-failover, +switch-master)
+    et bascule simulée avec les délais de détection et d'élection d'un vrai Sentinel.
+    Les instances ont des adresses fictives ("stand-in", n) résolues par connect().
+    """
+
+    def __init__(self):
+        self.sentinels = [self]
+        self.subscribers = []
+        self.instances = {}
+        self.masters = {}
+        self.replicas = {}
+
+    def _address(self, instance):
+        for address, candidate in self.instances.items():
+            if candidate is instance:
+                return address
+        address = ("stand-in", 7000 + len(self.instances))
+        self.instances[address] = instance
+        return address
+
+    def monitor(self, master_name, master, replicas=()):
+        """Déclare un master et ses réplicas sous un nom de master Sentinel"""
+        self.masters[master_name] = self._address(master)
+        self.replicas[master_name] = [self._address(replica) for replica in replicas]
+
+    def connect(self, host, port):
+        return self.instances[(host, int(port))]
+
+    def discover_master(self, master_name):
+        address = self.masters.get(master_name)
+        if address is None:
+            raise redis.exceptions.ConnectionError(f"No master found for '{master_name}'")
+        return address
+
+    def discover_slaves(self, master_name):
+        return list(self.replicas.get(master_name, []))
+
+    def pubsub(self):
+        return InMemoryPubSub(self)
+
+    def publish(self, channel, data):
+        for subscriber in list(self.subscribers):
+            if channel in subscriber.channels:
+                subscriber.messages.put({"type": "message", "channel": channel, "data": data})
+
+    def failover(self, master_name, detection_seconds=5.0, election_seconds=1.0):
+        """
+        Arrête le master puis, comme Sentinel : le déclare hors service après detection_seconds
+        (down-after-milliseconds), promeut son premier réplica après election_seconds et publie
+        +switch-master. Renvoie le thread de la bascule.
+        """
+        def run():
+            old_host, old_port = self.masters[master_name]
+            self.instances[(old_host, old_port)].available = False
+            time.sleep(detection_seconds)
+            description = f"master {master_name} {old_host} {old_port}"
+            self.publish("+sdown", description)
+            self.publish("+odown", f"{description} #quorum 2/2")
+            self.publish("+try-failover", description)
+            time.sleep(election_seconds)
+            new_host, new_port = self.replicas[master_name].pop(0)
+            self.instances[(new_host, new_port)].promote()
+            self.masters[master_name] = (new_host, new_port)
+            self.publish("+switch-master", f"{master_name} {old_host} {old_port} {new_host} {new_port}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+
+class InMemoryPipeline:
+    """Pipeline simulé : les commandes sont envoyées en un seul aller-retour"""
+
+    def __init__(self, shard):
+        self.shard = shard
+        self.commands = []
+
+    def execute_command(self, *args):
+        self.commands.append(args)
+        return self
+
+    def __len__(self):
+        return len(self.commands)
+
+    def execute(self, raise_on_error=True):
+        if not self.commands:
+            return []
+        self.shard._round_trip()
+        return self._run_commands(raise_on_error)
+
+    def _run_commands(self, raise_on_error):
+        commands, self.commands = self.commands, []
+        results = []
+        with self.shard.lock:
+            for args in commands:
+                try:
+                    results.append(self.shard._dispatch(args))
+                except redis.exceptions.ResponseError as e:
+                    if raise_on_error:
+                        raise
+                    results.append(e)
+        return results
+
+    def reset(self):
+        self.commands = []
+
+
+class AsyncInMemoryTimeSeriesShard:
+    """Version asyncio du shard simulé (même interface que redis.asyncio.Redis)"""
+
+    def __init__(self, shard):
+        self.shard = shard
+
+    async def _round_trip(self):
+        if self.shard.latency_ms > 0:
+            await asyncio.sleep(self.shard.latency_ms / 1000)
+
+    async def ping(self):
+        await self._round_trip()
+        return True
+
+    async def info(self, section=None):
+        await self._round_trip()
+        return {"role": "master"}
+
+    async def execute_command(self, *args):
+        await self._round_trip()
+        with self.shard.lock:
+            return self.shard._dispatch(args)
+
+    def pipeline(self, transaction=True):
+        return AsyncInMemoryPipeline(self)
+
+    async def close(self):
+        pass
+
+
+class AsyncInMemoryPipeline(InMemoryPipeline):
+    """Pipeline asyncio simulé"""
+
+    def __init__(self, async_shard):
+        super().__init__(async_shard.shard)
+        self.async_shard = async_shard
+
+    async def execute(self, raise_on_error=True):
+        if not self.commands:
+            return []
+        await self.async_shard._round_trip()
+        return self._run_commands(raise_on_error)
+
+
+class FakeInfluxWriteServer:
+    """
+    Serveur HTTP local imitant l'endpoint /api/v2/write d'InfluxDB (gzip accepté).
+    Permet d'injecter de la latence et des erreurs 503 pour tester les nouvelles tentatives.
+    """
+
+    def __init__(self, latency_ms=0.0, fail_first=0, host="127.0.0.1", port=0):
+        import http.server
+
+        self.latency_ms = latency_ms
+        self.fail_first = fail_first
+        self.lines_received = 0
+        self.requests = 0
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.startswith("/health"):
+                    self._reply(200, b'{"name":"influxdb","status":"pass","message":"ready for queries and writes"}')
+                elif self.path.startswith("/api/v2/buckets"):
+                    # Un seul bucket, quel que soit le nom demandé (suffisant pour l'archiveur)
+                    name = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query).get("name", ["sensors_archive"])
+                    bucket = {"id": "0000000000000001", "orgID": "0000000000000001", "name": name[0],
+                              "retentionRules": [], "type": "user"}
+                    self._reply(200, json.dumps({"buckets": [bucket]}).encode())
+                else:
+                    self._reply(404, b'{"code":"not found"}')
+
+            def do_POST(self):
+                import gzip
+
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.path.startswith("/api/v2/write"):
+                    self._reply(404, b'{"code":"not found"}')
+                    return
+                if fake.latency_ms > 0:
+                    time.sleep(fake.latency_ms / 1000)
+                with fake.lock:
+                    fake.requests += 1
+                    fake.bytes_received += len(body)
+                    if fake.fail_first > 0:
+                        fake.fail_first -= 1
+                        self._reply(503, b'{"code":"unavailable"}')
+                        return
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                lines = sum(1 for line in body.split(b"\n") if line.strip())
+                with fake.lock:
+                    fake.lines_received += lines
+                self._reply(204, b"")
+
+            def _reply(self, code, body):
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def create_stand_in_system(latency_ms=0.0, replicas=0, read_strategy="least_latency", sentinel=False,
+                           write_buffer_size=None, spool_dir=None):
+    """
+    Crée un RedisTrueShardingSystem dont chaque shard est simulé en mémoire, avec éventuellement
+    des réplicas simulés pour les lectures et un Sentinel simulé (system.stand_in_sentinel)
+    qui suit les masters et peut déclencher une bascule. Sans spool_dir, pas de spool disque :
+    le spool de production (sharding_metadata/spool) ne doit pas recevoir d'échantillons simulés.
+    """
+    from generate_sharding_data import ShardingLayout, RedisTrueShardingSystem
+    from replica_routing import ShardEndpoints
+    from sentinel_failover import DEFAULT_WRITE_BUFFER_SIZE
+
+    locations = ["salon", "chambre1", "chambre2", "cuisine", "salle_de_bain"]
+    connections = {location: InMemoryTimeSeriesShard(location, latency_ms) for location in locations}
+    # Un réplica au moins par shard avec Sentinel : c'est lui qui est promu lors d'une bascule
+    replica_count = max(replicas, 1 if sentinel else 0)
+    shard_replicas = {}
+    for location, master in connections.items():
+        names = [f"{location}-replica{i + 1}" for i in range(replica_count)]
+        shard_replicas[location] = {name: InMemoryReplicaShard(master, name) for name in names}
+
+    stand_in_sentinel = None
+    if sentinel:
+        stand_in_sentinel = InMemorySentinel()
+        layout = ShardingLayout()
+        for location, master in connections.items():
+            stand_in_sentinel.monitor(layout.shards[location]["sentinel"]["master_name"], master,
+                                      shard_replicas[location].values())
+
+    system = RedisTrueShardingSystem(
+        connections=connections,
+        sentinels={location: stand_in_sentinel for location in locations} if sentinel else None,
+        connect=stand_in_sentinel.connect if sentinel else None,
+        write_buffer_size=DEFAULT_WRITE_BUFFER_SIZE if write_buffer_size is None else write_buffer_size,
+        spool_dir=spool_dir)
+    system.stand_in_sentinel = stand_in_sentinel
+    if replicas:
+        for location, master in connections.items():
+            system.read_endpoints[location] = ShardEndpoints(location, master, shard_replicas[location],
+                                                             read_strategy, system.max_replica_lag_bytes)
+    return system
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Mesure de l'ingestion en masse sur des shards simulés")
+    parser.add_argument("--days", type=float, default=7, help="Nombre de jours d'historique à générer")
+    parser.add_argument("--latency-ms", type=float, default=0.2, help="Latence réseau simulée par aller-retour")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Nombre d'échantillons par TS.MADD")
+    args = parser.parse_args()
+
+    # RedisTrueShardingSystem écrit dans sharding_metadata : exécution dans un répertoire
+    # temporaire pour ne pas écraser la configuration réelle
+    os.chdir(tempfile.mkdtemp(prefix="stand_in_"))
+    os.makedirs("sharding_metadata", exist_ok=True)
+    system = create_stand_in_system(latency_ms=args.latency_ms)
+    system.create_time_series()
+    system.generate_historical_data_bulk(days_back=args.days, batch_size=args.batch_size)
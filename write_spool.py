@@ -0,0 +1,341 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+import redis
+
+from metrics import SPOOL_BYTES, SPOOL_SAMPLES, track_redis
+from sentinel_failover import is_failover_error
+
+SPOOL_DIR = "sharding_metadata/spool"
+
+# Capacité par défaut du spool d'un shard (octets, fichier pré-alloué)
+DEFAULT_SPOOL_MAX_BYTES = 64 * 1024 * 1024
+
+# Débit de rejeu par défaut vers un master qui redémarre (échantillons/s)
+DEFAULT_REPLAY_RATE = 20_000
+
+# En-tête : signature, offset de lecture, offset d'écriture, échantillons en attente
+HEADER = struct.Struct("<8sQQQ")
+MAGIC = b"TSSPOOL1"
+# Enregistrement : longueur et CRC32 du contenu, puis les échantillons
+RECORD = struct.Struct("<II")
+SAMPLE = struct.Struct("<qd")
+KEY_LENGTH = struct.Struct("<H")
+COUNT = struct.Struct("<I")
+# Échantillons par enregistrement : granularité de lecture du rejeu (et de sa limitation de débit)
+RECORD_SAMPLES = 1000
+
+
+def is_duplicate_error(error):
+    """Échantillon déjà présent (écrit avant la panne) : rien à rejouer"""
+    return "DUPLICATE_POLICY" in str(error)
+
+
+def is_missing_series_error(error):
+    """Série absente du shard (créée pendant qu'il était injoignable) : à créer avant de rejouer"""
+    return "key does not exist" in str(error)
+
+
+def encode_samples(samples):
+    """Encode des échantillons (clé, timestamp, valeur) en un enregistrement avec somme de contrôle"""
+    parts = [COUNT.pack(len(samples))]
+    for key, timestamp_ms, value in samples:
+        encoded = str(key).encode()
+        parts.append(KEY_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+        parts.append(SAMPLE.pack(int(timestamp_ms), float(value)))
+    payload = b"".join(parts)
+    return RECORD.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_samples(payload):
+    (count,) = COUNT.unpack_from(payload, 0)
+    position = COUNT.size
+    samples = []
+    for _ in range(count):
+        (length,) = KEY_LENGTH.unpack_from(payload, position)
+        position += KEY_LENGTH.size
+        key = payload[position:position + length].decode()
+        position += length
+        timestamp_ms, value = SAMPLE.unpack_from(payload, position)
+        position += SAMPLE.size
+        samples.append((key, timestamp_ms, value))
+    return samples
+
+
+class ShardSpool:
+    """
+    Spool durable d'un shard : fichier en ajout seul, pré-alloué à max_bytes et projeté
+    en mémoire (mmap). Chaque enregistrement porte sa longueur et un CRC32 ; l'en-tête
+    (offsets de lecture et d'écriture) n'est mis à jour qu'après l'écriture complète de
+    l'enregistrement. À l'ouverture, les enregistrements sont vérifiés et le spool est
+    tronqué au premier enregistrement corrompu (écriture interrompue par un arrêt brutal).
+    Quand la fin du fichier est atteinte, les enregistrements non rejoués sont ramenés au
+    début ; si le spool reste plein, les nouveaux échantillons sont refusés et comptés.
+    """
+
+    def __init__(self, shard, path, max_bytes=DEFAULT_SPOOL_MAX_BYTES):
+        self.shard = shard
+        self.path = path
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.corrupted = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        exists = os.path.exists(path)
+        self.file = open(path, "r+b" if exists else "w+b")
+        size = os.fstat(self.file.fileno()).st_size
+        if size < max(max_bytes, HEADER.size + RECORD.size):
+            self.file.truncate(max(max_bytes, HEADER.size + RECORD.size))
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        self.capacity = len(self.map)
+
+        magic, self.read_offset, self.write_offset, self.pending = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or not HEADER.size <= self.read_offset <= self.write_offset <= self.capacity:
+            if exists and magic:
+                print(f"⚠️ En-tête du spool {path} invalide, spool réinitialisé")
+            self.read_offset = self.write_offset = HEADER.size
+            self.pending = 0
+            self._write_header()
+        else:
+            self._recover()
+        SPOOL_BYTES.labels(shard=shard).set(self.write_offset - self.read_offset)
+
+    def _write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, self.read_offset, self.write_offset, self.pending)
+        self.map.flush(0, HEADER.size)
+
+    def _records(self, start, end):
+        """Parcourt les enregistrements valides : (offset, offset suivant, contenu)"""
+        position = start
+        while position + RECORD.size <= end:
+            length, checksum = RECORD.unpack_from(self.map, position)
+            payload_end = position + RECORD.size + length
+            if payload_end > end:
+                return
+            payload = bytes(self.map[position + RECORD.size:payload_end])
+            if zlib.crc32(payload) != checksum:
+                return
+            yield position, payload_end, payload
+            position = payload_end
+
+    def _recover(self):
+        """Vérifie les enregistrements en attente et tronque le spool au premier enregistrement invalide"""
+        end = self.read_offset
+        pending = 0
+        for _, next_offset, payload in self._records(self.read_offset, self.write_offset):
+            end = next_offset
+            pending += COUNT.unpack_from(payload, 0)[0]
+        if end != self.write_offset or pending != self.pending:
+            if end != self.write_offset:
+                self.corrupted += 1
+                SPOOL_SAMPLES.labels(shard=self.shard, outcome="corrupted").inc()
+                print(f"⚠️ Spool {self.path}: enregistrement corrompu à l'offset {end}, "
+                      f"{self.write_offset - end} octet(s) ignoré(s)")
+            self.write_offset = end
+            self.pending = pending
+            self._write_header()
+
+    def append(self, samples):
+        """Ajoute des échantillons au spool ; renvoie False (échantillons perdus) si le spool est plein"""
+        samples = list(samples)
+        if not samples:
+            return True
+        record = b"".join(encode_samples(samples[start:start + RECORD_SAMPLES])
+                          for start in range(0, len(samples), RECORD_SAMPLES))
+        with self.lock:
+            if self.write_offset + len(record) > self.capacity and self.read_offset > HEADER.size:
+                # Ramener les enregistrements non rejoués au début du fichier
+                unread = self.write_offset - self.read_offset
+                self.map.move(HEADER.size, self.read_offset, unread)
+                self.map.flush()
+                self.read_offset, self.write_offset = HEADER.size, HEADER.size + unread
+                self._write_header()
+            if self.write_offset + len(record) > self.capacity:
+                self.dropped += len(samples)
+                SPOOL_SAMPLES.labels(shard=self.shard, outcome="dropped").inc(len(samples))
+                return False
+            self.map[self.write_offset:self.write_offset + len(record)] = record
+            # Enregistrement persisté avant l'en-tête qui le rend visible
+            page_start = self.write_offset - self.write_offset % mmap.ALLOCATIONGRANULARITY
+            self.map.flush(page_start, self.write_offset + len(record) - page_start)
+            self.write_offset += len(record)
+            self.pending += len(samples)
+            self._write_header()
+            size = self.write_offset - self.read_offset
+        SPOOL_SAMPLES.labels(shard=self.shard, outcome="spooled").inc(len(samples))
+        SPOOL_BYTES.labels(shard=self.shard).set(size)
+        return True
+
+    def read_batch(self, max_samples):
+        """
+        Lit les plus anciens enregistrements (au moins un, jusqu'à ~max_samples échantillons) sans
+        les retirer : renvoie (échantillons, octets lus) à confirmer avec commit()
+        """
+        samples = []
+        with self.lock:
+            consumed = 0
+            for _, next_offset, payload in self._records(self.read_offset, self.write_offset):
+                samples.extend(decode_samples(payload))
+                consumed = next_offset - self.read_offset
+                if len(samples) >= max_samples:
+                    break
+        return samples, consumed
+
+    def commit(self, consumed, samples):
+        """Retire du spool les enregistrements rejoués (consumed octets, samples échantillons)"""
+        with self.lock:
+            self.read_offset += consumed
+            self.pending = max(0, self.pending - samples)
+            if self.read_offset == self.write_offset:
+                # Spool vide : repartir du début du fichier
+                self.read_offset = self.write_offset = HEADER.size
+                self.pending = 0
+            self._write_header()
+            size = self.write_offset - self.read_offset
+        SPOOL_BYTES.labels(shard=self.shard).set(size)
+
+    def dead_letter(self, rejected):
+        """
+        Conserve dans <spool>.dead (une ligne JSON par échantillon) les échantillons refusés
+        définitivement par le shard, avec l'erreur, pour qu'ils ne bloquent pas le rejeu
+        """
+        with open(f"{self.path}.dead", "a") as f:
+            for (key, timestamp_ms, value), error in rejected:
+                f.write(json.dumps({"key": key, "timestamp": timestamp_ms, "value": value, "error": str(error)}) + "\n")
+        SPOOL_SAMPLES.labels(shard=self.shard, outcome="dead_letter").inc(len(rejected))
+
+    def __len__(self):
+        return self.pending
+
+    def close(self):
+        with self.lock:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+
+
+class SpoolReplayer:
+    """
+    Rejoue en arrière-plan les spools des shards redevenus joignables, en gros lots TS.MADD,
+    avec un débit limité (replay_rate échantillons/s) pour ne pas saturer un master qui
+    redémarre. Un shard indisponible est réessayé après un délai croissant. Un lot n'est retiré
+    du spool qu'une fois écrit : les séries absentes sont d'abord créées, et seuls les refus
+    définitifs (hors doublons) sont écartés, dans le fichier des rejets du shard.
+    """
+
+    def __init__(self, system, replay_rate=DEFAULT_REPLAY_RATE, batch_size=5000, idle_interval=1.0):
+        self.system = system
+        self.replay_rate = replay_rate
+        self.batch_size = batch_size
+        self.idle_interval = idle_interval
+        self.stopped = threading.Event()
+        self.wakeup = threading.Event()
+        self.retry_at = {}
+        self.retry_delay = {}
+        self.series_created = set()
+        self.replayed = 0
+        self.thread = None
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name="spool-replayer", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+    def notify(self):
+        """Signale de nouveaux échantillons en spool"""
+        self.start()
+        self.wakeup.set()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            sent = 0
+            for shard, spool in list(self.system.spools.items()):
+                if len(spool) and time.monotonic() >= self.retry_at.get(shard, 0):
+                    sent += self._replay_batch(shard, spool)
+            if not sent:
+                self.wakeup.wait(self.idle_interval)
+                self.wakeup.clear()
+
+    def _replay_batch(self, shard, spool):
+        """Rejoue un lot du spool d'un shard ; renvoie le nombre d'échantillons envoyés"""
+        conn = self.system.writable_connection(shard)
+        if conn is None:
+            self._back_off(shard)
+            return 0
+        samples, consumed = spool.read_batch(self.batch_size)
+        if not samples:
+            return 0
+        started = time.perf_counter()
+        pipe = conn.pipeline(transaction=False)
+        batches = [samples[start:start + 1000] for start in range(0, len(samples), 1000)]
+        for batch in batches:
+            pipe.execute_command("TS.MADD", *[field for sample in batch for field in sample])
+        try:
+            with track_redis(shard, "TS.MADD"):
+                replies = pipe.execute(raise_on_error=False)
+        except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+            self._back_off(shard)
+            return 0
+        if any(isinstance(reply, Exception) and is_failover_error(reply) for reply in replies):
+            # Master rétrogradé, en chargement ou sans réplica : le lot reste dans le spool
+            self._back_off(shard)
+            return 0
+
+        replayed = duplicates = 0
+        missing = []
+        rejected = []
+        for batch, reply in zip(batches, replies):
+            outcomes = [reply] * len(batch) if isinstance(reply, Exception) else reply
+            for sample, outcome in zip(batch, outcomes):
+                if not isinstance(outcome, Exception):
+                    replayed += 1
+                elif is_duplicate_error(outcome):
+                    duplicates += 1
+                elif is_missing_series_error(outcome):
+                    missing.append((sample, outcome))
+                else:
+                    rejected.append((sample, outcome))
+        if missing and shard not in self.series_created:
+            # Séries à créer (shard injoignable lors de leur création) : le lot reste dans le spool
+            # et sera rejoué entièrement, les échantillons déjà écrits comptant alors comme doublons
+            self.series_created.add(shard)
+            self.system.create_shard_series(shard)
+            self._back_off(shard)
+            return 0
+        # Séries toujours absentes après leur création (clé inconnue du générateur) : refus définitif
+        rejected.extend(missing)
+        self.series_created.discard(shard)
+
+        # Les doublons (déjà écrits avant la panne) ne sont pas rejoués ; les autres refus
+        # définitifs partent dans le fichier des rejets plutôt que d'être perdus
+        if rejected:
+            spool.dead_letter(rejected)
+            print(f"⚠️ Spool {shard}: {len(rejected)} échantillon(s) refusé(s) conservé(s) dans {spool.path}.dead "
+                  f"({rejected[0][1]})")
+        spool.commit(consumed, len(samples))
+        self.retry_at.pop(shard, None)
+        self.retry_delay.pop(shard, None)
+        self.replayed += replayed
+        SPOOL_SAMPLES.labels(shard=shard, outcome="replayed").inc(replayed)
+        if duplicates:
+            SPOOL_SAMPLES.labels(shard=shard, outcome="duplicate").inc(duplicates)
+
+        # Limitation du débit : un lot de n échantillons occupe au moins n / replay_rate secondes
+        if self.replay_rate:
+            self.stopped.wait(max(0.0, len(samples) / self.replay_rate - (time.perf_counter() - started)))
+        return len(samples)
+
+    def _back_off(self, shard):
+        delay = self.retry_delay.get(shard, 0.5)
+        self.retry_at[shard] = time.monotonic() + delay
+        self.retry_delay[shard] = min(delay * 2, 10.0)